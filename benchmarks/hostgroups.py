@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+"""benchmarks/hostgroups.py - Benchmark the ensure pipeline with hostgroups
+
+Runs a scaled up version of 'examples/hostgroup.py' against an in-process fake
+Satellite. For every given amount of hostgroups, the declarations are applied
+twice: first when none of the hostgroups exist, so they are all created, and
+then again when nothing needs to change. Wall time, HTTP requests per entity
+and peak memory are reported for both runs, and the benchmark fails if the
+second run makes more requests per unchanged entity than allowed.
+
+Every size runs in its own process, so the peak memory of one size does not
+hide the one of the next. Run from the repository root with:
+
+    PYTHONPATH=. python benchmarks/hostgroups.py --sizes 100 1000 10000
+"""
+import sys
+import logging
+import resource
+from argparse import ArgumentParser
+from collections import namedtuple
+from multiprocessing import Pool
+from time import time
+
+import satellite_dsl
+from satellite_dsl import ensure
+from satellite_dsl.fake_satellite import FakeSatellite
+from satellite_dsl.http_sessions import close_sessions
+from satellite_dsl.nailgun_hacks import set_default_server_config
+from satellite_dsl.outcomes import (
+    UNCHANGED,
+    OutcomeCounter,
+    add_outcome_listener,
+    remove_outcome_listener,
+)
+from satellite_dsl.subscription_catalog import SUBSCRIPTION_CATALOG
+
+from nailgun.entities import (
+    Location,
+    Organization,
+    HostGroup,
+    OperatingSystem,
+    Architecture,
+    Media,
+    PartitionTable,
+    Subscription,
+)
+
+SUBSCRIPTION = 'Red Hat Enterprise Linux Server'
+
+RunResult = namedtuple(
+    'RunResult',
+    ('size', 'run', 'entities', 'unchanged', 'wall_time', 'requests',
+     'peak_rss'),
+)
+
+
+def declare(size):
+    """Declare the entities of 'examples/hostgroup.py', with the given amount
+    of hostgroups instead of one
+    """
+    main_org = ensure(Organization, name='Default Organization')
+    locations = [ensure(Location, name='Default Location')]
+    ensure(Subscription, product_name=SUBSCRIPTION, organization=main_org)
+    x86_64 = ensure(Architecture, name='x86_64')
+    centos_mirror = ensure(
+        Media,
+        name='CentOS mirror',
+        path_='http://mirror.centos.org/centos/$major.$minor/os/$arch',
+        os_family='Redhat',
+    )
+    centos7_2 = ensure(
+        OperatingSystem,
+        name='CentOS', major=7, minor=2,
+        medium=[centos_mirror],
+    )
+    ksd_ptable = ensure(PartitionTable, name='Kickstart default')
+    for num in xrange(size):
+        ensure(
+            HostGroup,
+            name='test_hg_{:05d}'.format(num),
+            location=locations,
+            organization=[main_org],
+            architecture=x86_64,
+            operatingsystem=centos7_2,
+            medium=centos_mirror,
+            ptable=ksd_ptable,
+        )
+
+
+def run_size(size, latency, jitter, workers):
+    """Benchmark the given amount of hostgroups, runs in a worker process
+
+    :returns: A RunResult for the creating run and one for the unchanged run
+    :rtype: list
+    """
+    fake = FakeSatellite(latency=latency, jitter=jitter).start()
+    try:
+        org = fake.add(Organization, name='Default Organization')
+        fake.add(Location, name='Default Location')
+        fake.add(Architecture, name='x86_64')
+        fake.add(PartitionTable, name='Kickstart default')
+        fake.add_subscription(org['id'], SUBSCRIPTION, ['RHEL Server'])
+        set_default_server_config(fake.server_config())
+        return [
+            _run(fake, size, run, workers) for run in ('create', 'unchanged')
+        ]
+    finally:
+        fake.stop()
+
+
+def _run(fake, size, run, workers):
+    """Apply the declarations once, starting without any cached entities
+    """
+    SUBSCRIPTION_CATALOG.clear()
+    close_sessions()
+    counter = OutcomeCounter()
+    add_outcome_listener(counter)
+    requests_before = len(fake.requests)
+    start = time()
+    try:
+        declare(size)
+        satellite_dsl.apply(workers=workers)
+    finally:
+        remove_outcome_listener(counter)
+    return RunResult(
+        size=size,
+        run=run,
+        entities=sum(counter.counts.itervalues()),
+        unchanged=counter.counts.get(UNCHANGED, 0),
+        wall_time=time() - start,
+        requests=len(fake.requests) - requests_before,
+        peak_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    )
+
+
+def _run_size_star(args):
+    return run_size(*args)
+
+
+def main():
+    parser = ArgumentParser(
+        description='Benchmark ensuring hostgroups against a fake Satellite'
+    )
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+        help='The amounts of hostgroups to benchmark'
+    )
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help='Seconds the fake Satellite waits before answering a request'
+    )
+    parser.add_argument(
+        '--jitter', type=float, default=0.0,
+        help='Up to how many seconds to randomly add to the latency'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=satellite_dsl.DEFAULT_WORKERS,
+        help='The amount of entities to ensure at the same time'
+    )
+    parser.add_argument(
+        '--max-unchanged-requests', type=float, default=0.1,
+        help='The most HTTP requests per unchanged entity allowed, the '
+        'benchmark fails if exceeded'
+    )
+    args = parser.parse_args()
+    logging.basicConfig()
+    satellite_dsl.LOGGER.setLevel(logging.WARNING)
+
+    print '{:>6} {:>9} {:>8} {:>9} {:>8} {:>11} {:>9}'.format(
+        'size', 'run', 'entities', 'wall (s)', 'requests', 'req/entity',
+        'peak (MB)'
+    )
+    failed = False
+    for size in args.sizes:
+        pool = Pool(1)
+        try:
+            results = pool.map(_run_size_star, [
+                (size, args.latency, args.jitter, args.workers)
+            ])[0]
+        finally:
+            pool.close()
+            pool.join()
+        for result in results:
+            per_entity = float(result.requests) / max(result.entities, 1)
+            print '{:>6} {:>9} {:>8} {:>9.2f} {:>8} {:>11.3f} {:>9.1f}'.format(
+                result.size, result.run, result.entities, result.wall_time,
+                result.requests, per_entity, result.peak_rss / 1024.0
+            )
+            if result.run == 'unchanged':
+                if result.unchanged != result.entities:
+                    print 'FAIL: {} entities changed on the unchanged run' \
+                        .format(result.entities - result.unchanged)
+                    failed = True
+                elif per_entity > args.max_unchanged_requests:
+                    print 'FAIL: {:.3f} requests per unchanged entity, ' \
+                        'expected at most {}'.format(
+                            per_entity, args.max_unchanged_requests
+                        )
+                    failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
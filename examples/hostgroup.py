@@ -67,6 +67,7 @@ def main():
         medium=centos_mirror,
         ptable=ksd_ptable,
     )
+    satellite_dsl.apply()
 
     logger.info("Katello configuration complete")
 
@@ -1,25 +1,62 @@
 #!/usr/bin/env python
 """A Mini-DSL for doing puppet-like declerative configuration of Satellite 6
 """
+__version__ = '0.1.0'
+
 from logger import LOGGER
 
-from entity_ensurer import EntityEnsurer
-import life_cycle_environment_ensurer
-import operating_system_ensurer
-import product_ensurer
-import subscription_ensurer
+from deferred import EnsureGraph, ensure_many
+from entity_ref import EntityRef
+from executor import DEFAULT_WORKERS, SerialExecutor, ThreadPoolExecutor
+from instrumentation import disable_instrumentation, enable_instrumentation
+from journal import disable_journal, enable_journal
+from manifest import disable_incremental, enable_incremental
+from runner import fan_out
+from state_cache import disable_state_cache, enable_state_cache
+from type_handler import lazy_type_handler
+from write_scheduler import set_max_writes
 
 # to make pyflakes happy
 assert LOGGER
-assert life_cycle_environment_ensurer
-assert operating_system_ensurer
-assert product_ensurer
-assert subscription_ensurer
+assert SerialExecutor
+assert ThreadPoolExecutor
+assert disable_state_cache
+assert enable_state_cache
+assert fan_out
+assert disable_instrumentation
+assert enable_instrumentation
+assert disable_journal
+assert enable_journal
+assert disable_incremental
+assert enable_incremental
+assert set_max_writes
+assert EntityRef
+assert ensure_many
+
+# Ensurer modules import NailGun entities which takes a while, so they are
+# only imported when an entity of a class they handle is first ensured
+for _entity_cls, _module in (
+    ('Host', 'host_ensurer'),
+    ('HostGroup', 'host_group_ensurer'),
+    ('LifecycleEnvironment', 'life_cycle_environment_ensurer'),
+    ('OperatingSystem', 'operating_system_ensurer'),
+    ('Product', 'product_ensurer'),
+    ('Subscription', 'subscription_ensurer'),
+):
+    lazy_type_handler(
+        'nailgun.entities.' + _entity_cls, '{}.{}'.format(__name__, _module)
+    )
+lazy_type_handler('nailgun.entity_mixins.Entity', __name__ + '.entity_ensurer')
+del _entity_cls, _module
+
+
+_GRAPH = EnsureGraph()
 
 
 def ensure(entity_cls, **attrs):
-    """Ensures that a Satellite entity of the given class exists and has its
-    attributes set to the given values.
+    """Declares that a Satellite entity of the given class should exist and
+    have its attributes set to the given values. The entity is actually
+    ensured when 'apply' is called.
 
     :param type entity_cls: The (nailgun) class of the Satellte entity to be
                             managed
@@ -27,12 +64,61 @@ def ensure(entity_cls, **attrs):
 
     Other named parameters are taken as attributes for the manage entity.
 
-    :returns: A pointer to the entity that was created that can be assigned to
-              other entities` link attributes (Please do no assume that is an
+    :returns: A lazy pointer to the entity that can be assigned to other
+              entities` link attributes (Please do no assume that is an
               entity object - this is subject to change)
     """
-    # TODO: Do not ensure directly instead create an object to be
-    #       used later when ensuring in bulk
     # TODO: Ensure things that are not NailGun classes
-    ensurer = EntityEnsurer(entity_cls)
-    return ensurer.ensure(entity_cls, **attrs)
+    return _GRAPH.add(entity_cls, attrs)
+
+
+def apply(workers=DEFAULT_WORKERS, executor=None):
+    """Ensure all the entities declared with 'ensure' since the last time this
+    was called. Entities that do not link to one another are ensured
+    concurrently.
+
+    :param int workers: The maximal amount of entities to ensure at the same
+                        time (Ignored if executor is given)
+    :param SerialExecutor executor: The executor to ensure entities with, can
+                                    be used to share a thread pool between
+                                    calls
+    :returns: The list of pointers to the entities that were ensured
+    :rtype: list
+    """
+    return _GRAPH.apply(workers=workers, executor=executor)
+
+
+def plan_mode(snapshot, server_config=None):
+    """A context manager within which requests to Satellite are answered from
+    a snapshot, see 'snapshot.plan_mode'
+    """
+    from snapshot import plan_mode
+    return plan_mode(snapshot, server_config)
+
+
+def load_config(path):
+    """Declare the entities in a YAML or JSON configuration file, as if
+    'ensure' was called for each of them, see 'loader.load_config'
+
+    :param str path: The path of the configuration file
+    :returns: The lazy pointers to the declared entities, in order
+    :rtype: list
+    """
+    from loader import load_config
+    return load_config(path, ensure)
+
+
+def set_rate_limit(rate, burst=None):
+    """Limit the rate of requests started to every Satellite server, see
+    'governor.set_rate_limit'
+    """
+    from governor import set_rate_limit
+    set_rate_limit(rate, burst)
+
+
+def take_snapshot(path, server_config=None, entity_classes=None, read=True):
+    """Write a snapshot of the entities in a Satellite server to a file, see
+    'snapshot.take_snapshot'
+    """
+    from snapshot import take_snapshot
+    return take_snapshot(path, server_config, entity_classes, read)
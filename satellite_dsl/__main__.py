@@ -0,0 +1,8 @@
+#!/usr/bin/env python
+"""Command line interface, run with 'python -m satellite_dsl'
+"""
+import sys
+
+from satellite_dsl.runner import main
+
+sys.exit(main() or 0)
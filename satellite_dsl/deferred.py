@@ -0,0 +1,499 @@
+#!/usr/bin/env python
+"""Classes for deferring the ensuring of entities so that it can be done in
+bulk later on, while ensuring entities that do not depend on one another
+concurrently
+"""
+import json
+import sys
+from hashlib import sha1
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
+
+import entity_ref
+from entity_ref import EntityRef
+from executor import DEFAULT_WORKERS, import_lock_released, make_executor
+from instrumentation import ensure_span
+from journal import get_journal
+from manifest import get_manifest
+from outcomes import RESUMED, SKIPPED, report_outcome, take_last_outcome
+from state_cache import get_state_cache
+from type_handler import import_lazy_handlers
+
+from logger import LOGGER
+
+DEFAULT_CHUNK_SIZE = 100
+# Modules that import NailGun, bound by '_import_ensuring_modules'
+EntityEnsurer = PREFETCH_INDEX = None
+
+
+class DeferredEntity(object):
+    """A lazy reference to an entity that is to be ensured when the graph it
+    was added to is applied.
+
+    Deferred entities may be passed as (or within lists passed as) link
+    attributes of other entities, which makes the other entities depend on
+    them. Once the entity had been ensured, attribute access is passed on to
+    the ensured entity. Only a lightweight reference to the ensured entity is
+    kept, so keeping many deferred entities around after they were ensured
+    takes little memory
+    """
+    def __init__(self, entity_cls, attrs):
+        """
+        :param type entity_cls: The (nailgun) class of the entity to ensure
+        :param dict attrs: The attributes to ensure the entity with
+        """
+        self.entity_cls = entity_cls
+        self.attrs = attrs
+        self._ensured = False
+        self._entity = None
+        self._ensurer = None
+        self._digest = None
+
+    def dependencies(self):
+        """Returns the deferred entities this entity links to
+
+        :rtype: set
+        """
+        return set(iter_deferred(self.attrs.itervalues()))
+
+    def digest(self):
+        """Returns a digest of the declaration of the entity, its class and
+        attributes. Linked deferred entities are included by their own
+        digests, so the digest changes if a linked declaration changes
+
+        :rtype: str
+        """
+        if self._digest is None:
+            self._digest = sha1(json.dumps(
+                [
+                    '{}.{}'.format(
+                        self.entity_cls.__module__, self.entity_cls.__name__
+                    ),
+                    dict(
+                        (attr, _digest_value(value))
+                        for attr, value in self.attrs.iteritems()
+                    ),
+                ],
+                sort_keys=True,
+                default=unicode,
+            )).hexdigest()
+        return self._digest
+
+    def ensure(self):
+        """Ensure the entity, after replacing deferred entities in its
+        attributes with the entities they were ensured as
+
+        If a journal is active, an entity found in it is trusted to be as
+        journaled instead of being ensured again, and the same goes for an
+        entity found in the manifest of the last run if runs are incremental.
+        Ensured entities are recorded in both
+
+        :returns: A reference to the ensured entity
+        :rtype: EntityRef
+        """
+        journal = get_journal()
+        manifest = get_manifest()
+        if journal is not None or manifest is not None:
+            entity = self._trust_recorded(journal, manifest)
+            if entity is not None:
+                return entity
+        attrs = dict(
+            (attr, resolve_deferred(value))
+            for attr, value in self.attrs.iteritems()
+        )
+        take_last_outcome()
+        with ensure_span(self.entity_cls):
+            self._entity = EntityRef.from_entity(
+                self.ensurer().ensure(self.entity_cls, **attrs)
+            )
+        self._ensured = True
+        outcome = take_last_outcome()
+        for records in (journal, manifest):
+            if records is not None:
+                records.record(self.digest(), self._entity, outcome)
+        return self._entity
+
+    def _trust_recorded(self, journal, manifest):
+        """If the entity is found in the journal or in the manifest of the
+        last run, trust it to be as recorded there and record it for the
+        current run
+
+        :returns: A reference to the recorded entity or None if it was not
+                  found
+        """
+        server_config = entity_ref.default_server_config()
+        found = self._find_recorded(journal, manifest)
+        if found is None:
+            return None
+        source, outcome, entry = found
+        self._entity = EntityRef(
+            self.entity_cls, entry.id, server_config=server_config
+        )
+        self._ensured = True
+        report_outcome(outcome, self._entity)
+        if journal is not None and source is not journal:
+            journal.record(self.digest(), self._entity, entry.outcome)
+        if manifest is not None:
+            manifest.record(self.digest(), self._entity, entry.outcome)
+        return self._entity
+
+    def _find_recorded(self, journal, manifest):
+        """Look the entity up in the journal and in the manifest of the last
+        run
+
+        :returns: The (source, outcome to report, entry) the entity was found
+                  with or None if it was not found
+        :rtype: tuple
+        """
+        server_url = entity_ref.default_server_config().url
+        for source, outcome in ((journal, RESUMED), (manifest, SKIPPED)):
+            if source is not None:
+                entry = source.find(self.digest(), server_url)
+                if entry is not None:
+                    return source, outcome, entry
+        return None
+
+    def ensurer(self):
+        """Returns the ensurer for the entity class. Ensurers (and NailGun
+        entities with them) are only imported once the first entity is
+        ensured
+
+        :rtype: EntityEnsurer
+        """
+        if self._ensurer is None:
+            _import_ensuring_modules()
+            self._ensurer = EntityEnsurer(self.entity_cls)
+        return self._ensurer
+
+    def ensured(self):
+        """Returns wither the entity had already been ensured
+
+        :rtype: bool
+        """
+        return self._ensured
+
+    def result(self):
+        """Returns a reference to the ensured entity
+
+        :rtype: EntityRef
+
+        :raises RuntimeError: If the entity was not ensured yet
+        """
+        if not self._ensured:
+            raise RuntimeError(
+                '{} entity was not ensured yet, please call apply()'
+                .format(self.entity_cls.__name__)
+            )
+        return self._entity
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.result(), attr)
+
+
+def iter_deferred(values):
+    """Iterate over the deferred entities found in the given attribute values
+
+    :param iterable values: Attribute values, that may be deferred entities or
+                            lists of them
+    :rtype: iterator
+    """
+    for value in values:
+        if isinstance(value, DeferredEntity):
+            yield value
+        elif isinstance(value, (list, tuple)):
+            for deferred in iter_deferred(value):
+                yield deferred
+
+
+def _digest_value(value):
+    """Reduce an attribute value to plain data for digesting a declaration
+    """
+    if isinstance(value, DeferredEntity):
+        return ['deferred', value.digest()]
+    elif isinstance(value, (list, tuple)):
+        return [_digest_value(item) for item in value]
+    elif hasattr(value, 'id'):
+        return ['entity', type(value).__name__, value.id]
+    elif isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+
+def resolve_deferred(value):
+    """Replace deferred entities in the given attribute value with the
+    entities they were ensured as
+
+    :param object value: An attribute value
+    :returns: The value with deferred entities resolved
+    """
+    if isinstance(value, DeferredEntity):
+        return value.result()
+    elif isinstance(value, (list, tuple)):
+        return type(value)(resolve_deferred(sval) for sval in value)
+    else:
+        return value
+
+
+class EnsureGraph(object):
+    """A graph of deferred entities, where the edges are the links between
+    them
+    """
+    def __init__(self):
+        self._pending = []
+
+    def add(self, entity_cls, attrs):
+        """Add an entity to be ensured into the graph
+
+        :param type entity_cls: The (nailgun) class of the entity to ensure
+        :param dict attrs: The attributes to ensure the entity with
+        :returns: A deferred reference to the entity
+        :rtype: DeferredEntity
+        """
+        deferred = DeferredEntity(entity_cls, attrs)
+        self._pending.append(deferred)
+        return deferred
+
+    def waves(self):
+        """Split the pending entities into waves so that entities in each wave
+        only depend on entities from previous waves (or ones that were ensured
+        already)
+
+        :returns: A list of lists of deferred entities
+        :rtype: list
+        """
+        pending = set(self._pending)
+        waiting_on = dict(
+            (deferred, set(
+                dep for dep in deferred.dependencies() if not dep.ensured()
+            ))
+            for deferred in self._pending
+        )
+        for deferred, deps in waiting_on.iteritems():
+            if not deps.issubset(pending):
+                raise RuntimeError(
+                    '{} entity links to an entity that will never be ensured'
+                    .format(deferred.entity_cls.__name__)
+                )
+        waves = []
+        done = set()
+        while pending:
+            # Keep declaration order within each wave
+            wave = [
+                deferred for deferred in self._pending
+                if deferred in pending and waiting_on[deferred].issubset(done)
+            ]
+            if not wave:
+                raise RuntimeError('Circular links found between entities')
+            waves.append(wave)
+            done.update(wave)
+            pending.difference_update(wave)
+        return waves
+
+    def apply(self, workers=DEFAULT_WORKERS, executor=None):
+        """Ensure all pending entities in the graph wave by wave, ensuring the
+        entities in each wave concurrently. If ensuring an entity fails, the
+        entities that were not ensured remain pending, so applying the graph
+        again retries them
+
+        :param int workers: The maximal amount of entities to ensure at the
+                            same time (Ignored if executor is given)
+        :param SerialExecutor executor: The executor to ensure entities with,
+                                        if not given one is created for the
+                                        duration of the call
+        :returns: The list of deferred entities that were ensured
+        :rtype: list
+        """
+        waves = self.waves()
+        if not self._pending:
+            return []
+        _import_ensuring_modules()
+        for deferred in self._pending:
+            deferred.ensurer()
+        applied, self._pending = self._pending, []
+        try:
+            with import_lock_released():
+                if executor is None:
+                    with make_executor(workers) as executor:
+                        self._apply_waves(waves, executor)
+                else:
+                    self._apply_waves(waves, executor)
+        except BaseException:
+            self._pending = [
+                deferred for deferred in applied if not deferred.ensured()
+            ] + self._pending
+            raise
+        finally:
+            _forget_listings()
+        manifest = get_manifest()
+        if manifest is not None:
+            manifest.save()
+        return applied
+
+    def _apply_waves(self, waves, executor):
+        """Ensure the given waves of deferred entities one after the other
+
+        :param list waves: A list of lists of deferred entities
+        :param SerialExecutor executor: The executor to ensure entities with
+        """
+        for wave_num, wave in enumerate(waves, 1):
+            LOGGER.debug(
+                'Ensuring wave %d/%d (%d entities)',
+                wave_num, len(waves), len(wave)
+            )
+            _search_keys(wave)
+            executor.map(_ensure_deferred, wave)
+
+
+def _search_keys(wave):
+    """Search for the existing entities of the classes in a wave that are not
+    prefetched, with batched searches by their keys instead of one search for
+    each entity
+    """
+    journal = get_journal()
+    manifest = get_manifest()
+    by_class = {}
+    for deferred in wave:
+        ensurer = deferred.ensurer()
+        if ensurer.prefetch:
+            continue
+        if (journal is not None or manifest is not None) and \
+                deferred._find_recorded(journal, manifest) is not None:
+            continue
+        by_class.setdefault((ensurer, deferred.entity_cls), []).append(dict(
+            (attr, resolve_deferred(value))
+            for attr, value in deferred.attrs.iteritems()
+        ))
+    for (ensurer, entity_cls), attrs_list in by_class.iteritems():
+        if len(attrs_list) > 1:
+            try:
+                PREFETCH_INDEX.search_keys(ensurer, entity_cls, attrs_list)
+            except TypeError:
+                # Missing key attributes, which ensuring the entities reports
+                pass
+
+
+def ensure_many(
+    entity_cls,
+    attrs_iter,
+    workers=DEFAULT_WORKERS,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+):
+    """Ensure many entities of the same class, consuming their attributes
+    from the given iterable (E.g. a generator) as they are needed
+
+    The attributes are read in chunks, the keys of each chunk are looked up
+    together (in the shared prefetch index, or with batched searches for
+    classes that are not prefetched) and the entities are ensured
+    concurrently while the next chunk is read and looked up. No more than
+    'chunk_size' entities are in flight at any time, so memory use does not
+    grow with the amount of entities
+
+    :param type entity_cls: The (nailgun) class of the entities to ensure
+    :param iterable attrs_iter: Dictionaries of the attributes to ensure the
+                                entities with. Link attributes may point to
+                                deferred entities that were already ensured
+    :param int workers: The maximal amount of entities to ensure at the same
+                        time
+    :param int chunk_size: The amount of entities to look up at once
+    :returns: An iterator over the ensured deferred entities, in the order
+              they were ensured in. If ensuring an entity fails, the iterator
+              raises the exception
+    """
+    _import_ensuring_modules()
+    attrs_iter = iter(attrs_iter)
+    done = Queue()
+    pending = 0
+    pool = ThreadPool(max(workers, 1))
+    try:
+        while True:
+            chunk = [
+                DeferredEntity(entity_cls, attrs)
+                for attrs in islice(attrs_iter, chunk_size)
+            ]
+            if not chunk:
+                break
+            with import_lock_released():
+                _search_keys(chunk)
+            for deferred in chunk:
+                while pending >= chunk_size:
+                    pending -= 1
+                    yield _take_done(done)
+                pool.apply_async(_ensure_into, (deferred, done))
+                pending += 1
+            while not done.empty():
+                pending -= 1
+                yield _take_done(done)
+        while pending:
+            pending -= 1
+            yield _take_done(done)
+        manifest = get_manifest()
+        if manifest is not None:
+            manifest.save()
+    finally:
+        pool.close()
+        with import_lock_released():
+            pool.join()
+        _forget_listings()
+
+
+def _import_ensuring_modules():
+    """Import the modules ensuring entities needs (and with them NailGun) in
+    the thread that applies entities, before any worker thread runs.
+
+    In Python 2 every 'import' statement waits for the global import lock,
+    even when the module is already loaded, and a thread importing a module
+    holds that lock until the import is done. Worker threads must therefore
+    not import anything, or applying entities while a DSL module is imported
+    (E.g. a module calling 'apply' that is imported with 'import') would hang
+    """
+    global EntityEnsurer, PREFETCH_INDEX
+    if PREFETCH_INDEX is None:
+        from entity_ensurer import EntityEnsurer
+        from prefetch import PREFETCH_INDEX
+    entity_ref.import_nailgun_hacks()
+    import_lazy_handlers()
+
+
+def _forget_listings():
+    """Drop the entities listed while ensuring (and the times the state cache
+    noted they were listed with), so the next 'apply' or 'ensure_many' call
+    sees changes made to Satellite since
+    """
+    if PREFETCH_INDEX is not None:
+        PREFETCH_INDEX.clear()
+    state_cache = get_state_cache()
+    if state_cache is not None:
+        state_cache.forget_listed()
+
+
+def _ensure_into(deferred, done):
+    """Ensure a deferred entity for 'ensure_many', and put it in the given
+    queue along with the exception information if ensuring it failed
+    """
+    try:
+        deferred.ensure()
+    except Exception:
+        done.put((deferred, sys.exc_info()))
+    else:
+        done.put((deferred, None))
+
+
+def _take_done(done):
+    """Wait for an entity ensured by 'ensure_many' and return it, or raise the
+    exception ensuring it raised
+    """
+    with import_lock_released():
+        deferred, exc_info = done.get()
+    if exc_info is not None:
+        raise exc_info[0], exc_info[1], exc_info[2]
+    return deferred
+
+
+def _ensure_deferred(deferred):
+    """Ensure a deferred entity (a module level function so it can be passed
+    to an executor)
+    """
+    return deferred.ensure()
@@ -3,20 +3,71 @@
 """
 from pprint import pformat
 from requests import HTTPError
-from itertools import izip_longest
 import nailgun.entities
+from nailgun.entity_fields import OneToManyField
 
 from type_handler import type_handler
-from nailgun_hacks import entity_search_by_attrs
+from nailgun_hacks import (
+    build_entity_attr_query,
+    default_server_config,
+    entity_search,
+    forget_entity,
+    read_entity,
+)
+from entity_ref import EntityRef
+from prefetch import PREFETCH_INDEX
+from outcomes import CREATED, UNCHANGED, UPDATED, report_outcome
+from write_scheduler import WRITE_SCHEDULER
+
+from logger import LOGGER, LazyPFormat
+
+
+class _EntityId(object):
+    """A normalized reference to an entity, which never equals a normalized
+    scalar or list
+    """
+    __slots__ = ('id',)
+
+    def __init__(self, id):
+        self.id = id
+
+    def __eq__(self, other):
+        return isinstance(other, _EntityId) and self.id == other.id
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.id)
 
-from logger import LOGGER
+    def __repr__(self):
+        return '_EntityId({!r})'.format(self.id)
 
 
 @type_handler(fortype=nailgun.entities.Entity)
 class EntityEnsurer(object):
     """Class for encupsulating code that ensures that a Satellite entity of a
     given type and properties exists
+
+    Unless 'prefetch' is set to False, entities are looked up by listing all
+    the entities of their class within their search context once, instead of
+    searching for each entity separately. Entities of classes that are not
+    prefetched are searched for in batches, by the keys of all the entities
+    of each wave of an ensure graph
+
+    Existing entities are populated from the fields found in the search
+    results, and only read if fields that should be compared are missing from
+    the results or listed in 'unlisted_fields'
     """
+    prefetch = True
+    # Fields that may be found in search results but with unreliable values,
+    # so the entity must be read to compare them
+    unlisted_fields = ()
+    # Fields linking to lists of entities in which the order of the entities
+    # matters. Other such fields are compared as sets of entity ids, since
+    # Satellite does not keep the order they were set in
+    ordered_fields = ()
+
     def ensure(self, entity_cls, **attrs):
         """Ensures that a Satellite entity of the given class exists and has
         its attributes set to the given values.
@@ -31,21 +82,28 @@ class EntityEnsurer(object):
                   is an entity object - this is subject to change)
         """
         template = self.entity_from_attrs(entity_cls, attrs)
-        LOGGER.debug('template: %s', pformat(template.get_values()))
+        LOGGER.debug('template: %s', LazyPFormat(template.get_values))
         existing = self.find_by_key(entity_cls, **attrs)
         if existing:
-            existing_data = existing[0].read()
-            LOGGER.debug('existing: %s', pformat(existing_data.get_values()))
+            existing_data = self.read_existing(existing[0], template)
+            LOGGER.debug(
+                'existing: %s', LazyPFormat(existing_data.get_values)
+            )
             template.id = existing_data.id
             if self.similar_entities(existing_data, template):
                 LOGGER.info(
                     'Unchanged entitiy: %s',
                     self.format_entity(existing_data)
                 )
+                report_outcome(UNCHANGED, existing_data)
                 return existing_data
             else:
                 self.log_entity_diff(existing_data, template)
-        return self.update_or_create(template)
+        entity = self.update_or_create(template)
+        forget_entity(entity)
+        if self.prefetch:
+            PREFETCH_INDEX.update(self, entity_cls, attrs, entity)
+        return entity
 
     def entity_from_attrs(self, entity_cls, attrs):
         """Create and entity from the given class and attributes while
@@ -58,7 +116,7 @@ class EntityEnsurer(object):
         :returns: The created entity
         :rtype nailgun.entities.Entity
         """
-        entity = entity_cls()
+        entity = entity_cls(default_server_config())
         fields = entity.get_fields()
         for attr, value in attrs.iteritems():
             if attr not in fields:
@@ -83,37 +141,86 @@ class EntityEnsurer(object):
         """
         key = self.extract_key_attrs(attrs)
         context = self.extract_context(attrs)
-        return entity_search_by_attrs(
+        if self.prefetch:
+            return PREFETCH_INDEX.find(self, entity_cls, key, context)
+        searched = \
+            PREFETCH_INDEX.take_searched(self, entity_cls, key, context)
+        if searched is not None:
+            return searched
+        return entity_search(
             entity_cls,
+            query=build_entity_attr_query(**key),
             context=context,
-            **key
+            hydrate=True,
         )
 
+    def read_existing(self, entity, template):
+        """Returns the data of an existing entity needed for comparing it to
+        the given template. Reading the entity is avoided if it was populated
+        from search results with all the fields set in the template
+
+        :param nailgun.entities.Entity entity: The existing entity, as found
+                                               by 'find_by_key'
+        :param nailgun.entities.Entity template: The wanted entity
+        :returns: The existing entity data
+        :rtype: nailgun.entities.Entity
+        """
+        wanted_fields = set(template.get_values())
+        missing_fields = \
+            wanted_fields.difference(entity.get_values()) | \
+            wanted_fields.intersection(self.unlisted_fields)
+        if missing_fields:
+            LOGGER.debug(
+                'Reading %s for fields: %s',
+                self.format_entity(entity), ', '.join(sorted(missing_fields))
+            )
+            return read_entity(entity)
+        return entity
+
     def update_or_create(self, entity):
         """If the given entity has the 'id' attribute set, try to update it.
         If not, or if the update failes because the entity doesn't exist, try
         to creat it instead.
 
+        The write is sent through the shared write scheduler, which limits the
+        amount of writes sent to the server at the same time
+
         :param nailgun.entities.Entity entity: The entity to create
         :returns: The entity object that was created
         :rtype nailgun.entities.Entity
         """
+        return WRITE_SCHEDULER.write(self, entity)
+
+    def write_entity(self, entity):
+        """Update or create an entity right away, as 'update_or_create' does
+        once the write scheduler lets it
+
+        :param nailgun.entities.Entity entity: The entity to write
+        :returns: The outcome (CREATED or UPDATED) and the written entity
+        :rtype: tuple
+        """
         if hasattr(entity, 'id') and entity.id is not None:
             try:
                 updated = entity.update()
                 LOGGER.info('Updated entity: %s', self.format_entity(updated))
-                return updated
+                report_outcome(UPDATED, updated)
+                return UPDATED, updated
             except HTTPError as httpe:
                 if httpe.response.status_code != 404:
                     raise
         created = entity.create()
         LOGGER.info('Created entity: %s', self.format_entity(created))
-        return created
+        report_outcome(CREATED, created)
+        return CREATED, created
 
     def similar_entities(self, entity_a, entity_b):
         """Compares two entities. Entities are considered similar if all common
         attributes have the same valus.
 
+        The entities are compared by the normalized values of their common
+        attributes, so values are only normalized once per entity, and lists
+        of linked entities which order does not matter are compared as sets
+
         :param nailgun.entities.Entity entity_a: 1st entity to be compared
         :param nailgun.entities.Entity entity_b: 2nd entity to be compared
 
@@ -127,52 +234,76 @@ class EntityEnsurer(object):
             )
         cmn_attrs = \
             set(entity_a.get_values()).intersection(set(entity_b.get_values()))
-        return next(
-            (
-                False for attr in cmn_attrs
-                if not
-                self.similar_values(
-                    getattr(entity_a, attr),
-                    getattr(entity_b, attr)
-                )
-            ),
-            True
+        return self.normalize_attrs(entity_a, cmn_attrs) == \
+            self.normalize_attrs(entity_b, cmn_attrs)
+
+    def normalize_attrs(self, entity, attrs):
+        """Normalize the values of the given entity attributes
+
+        :param nailgun.entities.Entity entity: The entity
+        :param iterable attrs: The names of the attributes to normalize
+        :returns: The normalized values by attribute name
+        :rtype: dict
+        """
+        fields = entity.get_fields()
+        return dict(
+            (attr, self.normalize_value(
+                getattr(entity, attr), self.ordered_field(fields, attr)
+            ))
+            for attr in attrs
         )
 
-    def similar_values(self, value_a, value_b):
+    def ordered_field(self, fields, attr):
+        """Returns wither the order of the values of an entity field matters
+        when comparing it. It does for all fields but the ones linking to
+        lists of entities, unless they are listed in 'ordered_fields'
+
+        :param dict fields: The fields of the entity class
+        :param str attr: The name of the field
+        :rtype: bool
+        """
+        return not isinstance(fields.get(attr), OneToManyField) or \
+            attr in self.ordered_fields
+
+    def normalize_value(self, value, ordered=True):
+        """Normalize an entity attribute value, so that values to be
+        considered equivalent are equal (References to entities are reduced
+        to their ids, and scalars to integers where possible or text)
+
+        :param object value: The value to normalize
+        :param bool ordered: Wither the order of the items matters if the
+                             value is a list, if not the list is normalized
+                             into a set
+        :returns: A hashable normalized value
+        """
+        if value is None:
+            return None
+        elif hasattr(value, 'id'):
+            return _EntityId(self.normalize_value(value.id))
+        elif hasattr(value, '__iter__'):
+            items = (self.normalize_value(item) for item in value)
+            return tuple(items) if ordered else frozenset(items)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            if isinstance(value, str):
+                return value.decode('utf-8')
+            return unicode(value)
+
+    def similar_values(self, value_a, value_b, ordered=True):
         """Compare entity values, returns if tye are to be considered equivalent
         (Same value or pointing to same entity)
 
         :param object entity_a: 1st value to be compared
         :param object entity_b: 2nd value to be compared
+        :param bool ordered: Wither the order of the items matters if the
+                             values are lists
 
         :returns: Wither the values are similar or not
         :rtype: bool
         """
-        if value_a is None and value_b is not None:
-            return False
-        elif value_a is not None and value_b is None:
-            return False
-        elif hasattr(value_a, 'id') and hasattr(value_b, 'id'):
-            return value_a.id == value_b.id
-        elif hasattr(value_a, '__iter__') and hasattr(value_b, '__iter__'):
-            return next(
-                (
-                    False for sva, svb in izip_longest(value_a, value_b)
-                    if not self.similar_values(sva, svb)
-                ),
-                True
-            )
-        else:
-            try:
-                value_a = int(value_a)
-            except (TypeError, ValueError):
-                value_a = str(value_a)
-            try:
-                value_b = int(value_b)
-            except (TypeError, ValueError):
-                value_b = str(value_b)
-            return value_a == value_b
+        return self.normalize_value(value_a, ordered) == \
+            self.normalize_value(value_b, ordered)
 
     def log_entity_diff(self, existing, wanted):
         """Log the needed chjanges to an entity
@@ -188,10 +319,13 @@ class EntityEnsurer(object):
             )
         cmn_attrs = \
             set(existing.get_values()).intersection(set(wanted.get_values()))
+        fields = existing.get_fields()
         for attr in cmn_attrs:
             existing_val = getattr(existing, attr)
             wanted_val = getattr(wanted, attr)
-            if not self.similar_values(existing_val, wanted_val):
+            if not self.similar_values(
+                existing_val, wanted_val, self.ordered_field(fields, attr)
+            ):
                 LOGGER.info(
                     '%s %s attribute is %s, should be %s',
                     self.format_entity(existing),
@@ -207,6 +341,8 @@ class EntityEnsurer(object):
         :returns: A string represenation of the entity
         :rtype: str
         """
+        if isinstance(entity, EntityRef):
+            return str(entity)
         return EntityEnsurer(type(entity))._format_self_entity(entity)
 
     def _format_self_entity(self, entity):
@@ -231,7 +367,7 @@ class EntityEnsurer(object):
                 otherwise just call 'str'
         :rtype: str
         """
-        if isinstance(value, nailgun.entities.Entity):
+        if isinstance(value, (nailgun.entities.Entity, EntityRef)):
             return self.format_entity(value)
         elif hasattr(value, '__iter__'):
             return pformat([self.format_attr(aval) for aval in value])
@@ -265,3 +401,14 @@ class EntityEnsurer(object):
         :rtype: dict
         """
         return {}
+
+    def snapshot_contexts(self, entity_cls, organizations):
+        """Returns the search contexts in which entities of the given class
+        should be listed when taking a snapshot of a Satellite server, which
+        are the contexts 'extract_context' may return
+
+        :param type entity_cls: The class of the entities
+        :param list organizations: The organizations found on the server
+        :rtype: list
+        """
+        return [{}]
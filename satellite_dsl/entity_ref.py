@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""Lightweight references to Satellite entities
+
+NailGun entities carry a dictionary of field definitions and the values of
+all their fields, which adds up when keeping many of them around (E.g. the
+entities a script ensured, or search results that only the ids of are used).
+Entity references only hold the class, id, name and server configuration of an
+entity, can be passed as link attributes of other entities, and materialize a
+full NailGun entity only when its fields are needed
+"""
+_base_paths = {}
+# Bound by 'import_nailgun_hacks', since nailgun_hacks imports this module
+default_server_config = read_entity = None
+
+
+def import_nailgun_hacks():
+    """Import the NailGun supplements that references use, unless they were
+    already imported. Called from the thread that applies entities before
+    handing references to worker threads, since in Python 2 every 'import'
+    statement waits for the global import lock, even for loaded modules, and
+    a thread that is importing a module that applies entities holds that lock
+    """
+    global default_server_config, read_entity
+    if read_entity is None:
+        from nailgun_hacks import default_server_config, read_entity
+
+
+class EntityRef(object):
+    """A reference to a Satellite entity
+
+    Reading an attribute that is not held by the reference reads the entity
+    from the server (or the entity state cache if one is enabled) the first
+    time, and the read entity is kept on the reference for reading further
+    attributes. Calling 'read' always reads the entity again
+    """
+    __slots__ = ('entity_cls', 'id', 'name', '_server_config', '_entity')
+
+    def __init__(self, entity_cls, id, name=None, server_config=None):
+        """
+        :param type entity_cls: The (nailgun) class of the entity
+        :param int id: The id of the entity
+        :param str name: The name of the entity, if known
+        :param nailgun.config.ServerConfig server_config: Connection
+                                                          information
+        """
+        if server_config is None:
+            import_nailgun_hacks()
+            server_config = default_server_config()
+        self.entity_cls = entity_cls
+        self.id = id
+        self.name = name
+        self._server_config = server_config
+        self._entity = None
+
+    @classmethod
+    def from_entity(cls, entity):
+        """Returns a reference to the given entity
+
+        :param nailgun.entities.Entity entity: The entity, or a reference to
+                                               it which is returned as is
+        :rtype: EntityRef
+        """
+        if isinstance(entity, cls):
+            return entity
+        return cls(
+            type(entity),
+            entity.id,
+            getattr(entity, 'name', None),
+            entity._server_config,
+        )
+
+    def path(self, which=None):
+        """Returns the API path of the entity, like the NailGun entity 'path'
+        method. The base path of each entity class is only computed once
+
+        :param str which: Which path to return (E.g. 'base' or 'self'), by
+                          default the 'self' path
+        :rtype: str
+        """
+        if which not in (None, 'base', 'self'):
+            return self.to_entity().path(which)
+        base = entity_base_path(self.entity_cls, self._server_config)
+        if which == 'base':
+            return base
+        return '{}/{}'.format(base, self.id)
+
+    def to_entity(self):
+        """Returns a NailGun entity with only the 'id' field set, that can be
+        read from the server
+
+        :rtype: nailgun.entities.Entity
+        """
+        return self.entity_cls(self._server_config, id=self.id)
+
+    def read(self):
+        """Read the referenced entity from Satellite, and keep it on the
+        reference for reading its attributes
+
+        :returns: The read entity
+        :rtype: nailgun.entities.Entity
+        """
+        import_nailgun_hacks()
+        self._entity = read_entity(self.to_entity())
+        return self._entity
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        entity = self._entity
+        if entity is None:
+            entity = self.read()
+        return getattr(entity, attr)
+
+    def __eq__(self, other):
+        return isinstance(other, EntityRef) and \
+            self.entity_cls == other.entity_cls and self.id == other.id and \
+            self._server_config.url == other._server_config.url
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.entity_cls, self.id))
+
+    def __str__(self):
+        if self.name is None:
+            return '{} #{}'.format(self.entity_cls.__name__, self.id)
+        return '{} "{}"'.format(self.entity_cls.__name__, self.name)
+
+    def __repr__(self):
+        return 'EntityRef({}, id={!r}, name={!r})'.format(
+            self.entity_cls.__name__, self.id, self.name
+        )
+
+
+def entity_base_path(entity_cls, server_config):
+    """Returns the base API path of the entities of the given class, computing
+    it only once for every class and server
+
+    :param type entity_cls: The (nailgun) class of the entities
+    :param nailgun.config.ServerConfig server_config: Connection information
+    :rtype: str
+    """
+    key = (entity_cls, server_config.url)
+    try:
+        return _base_paths[key]
+    except KeyError:
+        path = _base_paths[key] = entity_cls(server_config).path('base')
+        return path
@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+"""An in-memory store of Satellite entities that answers API requests the way
+Satellite does
+
+It backs both the fake Satellite server used for testing and the offline
+snapshots used for planning
+"""
+import json
+from re import findall, match, sub
+from datetime import datetime
+from threading import Lock
+
+import nailgun.config
+import nailgun.entities
+from nailgun.entity_fields import OneToManyField, OneToOneField
+from nailgun.entity_mixins import EntityReadMixin
+
+
+class EntityStore(object):
+    """An in-memory store of entities
+
+    Entities are kept as the JSON dictionaries the API would return and are
+    keyed by the API path of their nailgun class
+    """
+    def __init__(self, server_config=None):
+        """
+        :param nailgun.config.ServerConfig server_config: The configuration
+                                                          NailGun entity
+                                                          classes are created
+                                                          with when completing
+                                                          entity attributes
+        """
+        if server_config is None:
+            server_config = nailgun.config.ServerConfig(url='http://localhost')
+        self._server_config = server_config
+        self._lock = Lock()
+        self._last_id = 0
+        self._entity_classes = None
+        self.entities = {}
+        self.contexts = {}
+
+    def add(self, entity_cls, **attrs):
+        """Add an entity to the store
+
+        :param type entity_cls: The (nailgun) class of the entity
+        Other keyword arguments are taken as the API attributes of the entity
+        (E.g. 'organization_ids' and not 'organization')
+
+        :returns: The JSON dictionary of the added entity
+        :rtype: dict
+        """
+        api_path = entity_cls(self._server_config)._meta['api_path']
+        return self.create(api_path, attrs)
+
+    def load(self, api_path, ent_json, context=None):
+        """Load an entity exactly as it was returned by a server
+
+        :param str api_path: The API path of the entity class
+        :param dict ent_json: The JSON data of the entity
+        :param dict context: A search context the entity was listed in, such
+                             as {'organization_id': 1}
+        """
+        with self._lock:
+            self.entities.setdefault(api_path, {})[ent_json['id']] = ent_json
+            self._last_id = max(self._last_id, ent_json['id'])
+            if context:
+                self.contexts.setdefault(
+                    (api_path, ent_json['id']), []
+                ).append(dict(
+                    (param, unicode(value))
+                    for param, value in context.iteritems()
+                ))
+
+    def create(self, api_path, attrs):
+        """Store a new entity in the given API path
+
+        :param str api_path: The API path of the entity class
+        :param dict attrs: The API attributes of the entity
+        :returns: The JSON dictionary of the created entity
+        :rtype: dict
+        """
+        entity = dict(attrs, updated_at=_timestamp())
+        self._complete_entity(api_path, entity)
+        with self._lock:
+            self._last_id += 1
+            entity['id'] = self._last_id
+            self.entities.setdefault(api_path, {})[entity['id']] = entity
+            return entity
+
+    def update(self, api_path, entity_id, attrs):
+        """Update a stored entity
+
+        :param str api_path: The API path of the entity class
+        :param int entity_id: The entity id
+        :param dict attrs: The API attributes to update
+        :returns: The JSON dictionary of the updated entity or None if it was
+                  not found
+        :rtype: dict
+        """
+        with self._lock:
+            entity = self.entities.get(api_path, {}).get(entity_id)
+            if entity is not None:
+                entity.update(attrs)
+                entity.update(id=entity_id, updated_at=_timestamp())
+            return entity
+
+    def delete(self, api_path, entity_id):
+        """Remove a stored entity
+
+        :param str api_path: The API path of the entity class
+        :param int entity_id: The entity id
+        :returns: The JSON dictionary of the removed entity or None if it was
+                  not found
+        :rtype: dict
+        """
+        with self._lock:
+            self.contexts.pop((api_path, entity_id), None)
+            return self.entities.get(api_path, {}).pop(entity_id, None)
+
+    def get(self, api_path, entity_id):
+        """Returns a stored entity
+
+        :param str api_path: The API path of the entity class
+        :param int entity_id: The entity id
+        :returns: The JSON dictionary of the entity or None if it was not
+                  found
+        :rtype: dict
+        """
+        with self._lock:
+            return self.entities.get(api_path, {}).get(entity_id)
+
+    def search(self, api_path, params):
+        """Returns the entities in the given API path matching the given
+        search parameters, in the same format Satellite returns them
+
+        :param str api_path: The API path of the entity class
+        :param dict params: The search parameters
+        :rtype: dict
+        """
+        params = dict(params)
+        query = _parse_query(params.pop('search', None) or '')
+        per_page = int(params.pop('per_page', 20))
+        page = int(params.pop('page', 1))
+        thin = params.pop('thin', False) in (True, 'true', 'True', '1')
+        with self._lock:
+            entities = sorted(
+                self.entities.get(api_path, {}).itervalues(),
+                key=lambda entity: entity['id']
+            )
+        total = len(entities)
+        entities = [
+            entity for entity in entities
+            if _match_query(entity, query) and
+            self._match_context(api_path, entity, params)
+        ]
+        subtotal = len(entities)
+        entities = entities[(page - 1) * per_page:page * per_page]
+        if thin:
+            entities = [
+                dict(id=entity['id'], name=entity.get('name'))
+                for entity in entities
+            ]
+        return dict(
+            total=total,
+            subtotal=subtotal,
+            page=page,
+            per_page=per_page,
+            search=None,
+            results=entities,
+        )
+
+    def handle(self, method, path, params):
+        """Answer an API request
+
+        :param str method: The HTTP method of the request
+        :param str path: The URL path of the request
+        :param dict params: The query string and body parameters of the
+                            request
+        :returns: A tuple of the HTTP status and the JSON response data
+        :rtype: tuple
+        """
+        path_match = match(r'^/*(.*?)(?:/(\d+))?/*$', path)
+        api_path, entity_id = path_match.groups()
+        if entity_id is not None:
+            entity_id = int(entity_id)
+        # Some entities are listed under the organization they belong to
+        org_match = match(r'^(.*)/organizations/(\d+)/(\w+)$', api_path)
+        if org_match:
+            api_path = '{}/{}'.format(*org_match.group(1, 3))
+            params = dict(params, organization_id=org_match.group(2))
+        if method == 'GET':
+            if entity_id is None:
+                return 200, self.search(api_path, params)
+            entity = self.get(api_path, entity_id)
+        elif method == 'POST':
+            return 201, self.create(api_path, params)
+        elif method == 'PUT':
+            entity = self.update(api_path, entity_id, params)
+        elif method == 'DELETE':
+            entity = self.delete(api_path, entity_id)
+        else:
+            return 405, dict(error=dict(message='Method not allowed'))
+        if entity is None:
+            return 404, dict(error=dict(message='Resource not found'))
+        return 200, entity
+
+    def _match_context(self, api_path, entity, params):
+        """Returns wither the given entity matches context parameters such as
+        'organization_id'
+        """
+        context = dict(
+            (param, unicode(value)) for param, value in params.iteritems()
+            if param.endswith('_id')
+        )
+        if not context:
+            return True
+        with self._lock:
+            listed_in = self.contexts.get((api_path, entity['id']))
+        if listed_in is not None:
+            return any(
+                all(lctx.get(param) == value
+                    for param, value in context.iteritems())
+                for lctx in listed_in
+            )
+        for param, value in context.iteritems():
+            if param in entity:
+                if unicode(entity[param]) != value:
+                    return False
+            elif param + 's' in entity:
+                if int(value) not in entity[param + 's']:
+                    return False
+        return True
+
+    def _complete_entity(self, api_path, entity):
+        """Add the attributes NailGun expects to read but were not given, so
+        the entity could be read as if it came from a real server
+        """
+        entity_cls = self._entity_class(api_path)
+        if entity_cls is None:
+            return
+        for name, field in entity_cls(self._server_config).get_fields() \
+                .iteritems():
+            if isinstance(field, OneToOneField):
+                if name not in entity:
+                    entity.setdefault(name + '_id', None)
+            elif isinstance(field, OneToManyField):
+                if name not in entity and name + 's' not in entity:
+                    entity.setdefault(name + '_ids', [])
+            elif name.endswith('_'):
+                # NailGun renames some attributes that clash with methods
+                entity.setdefault(name[:-1], entity.pop(name, None))
+            else:
+                entity.setdefault(name, None)
+        if 'parent_id' in entity:
+            entity.setdefault('ancestry', entity['parent_id'])
+
+    def _entity_class(self, api_path):
+        """Returns the NailGun entity class for the given API path or None if
+        there is none
+        """
+        with self._lock:
+            if self._entity_classes is None:
+                self._entity_classes = {}
+                for entity_cls in vars(nailgun.entities).itervalues():
+                    if not (
+                        isinstance(entity_cls, type) and
+                        issubclass(entity_cls, EntityReadMixin)
+                    ):
+                        continue
+                    try:
+                        path = entity_cls(self._server_config)._meta.get(
+                            'api_path'
+                        )
+                    except Exception:
+                        # Some classes need more parameters to build a path
+                        continue
+                    self._entity_classes.setdefault(path, entity_cls)
+            return self._entity_classes.get(api_path)
+
+
+def request_params(query_params, body):
+    """Merge the query string parameters and JSON body of a request
+
+    :param dict query_params: The query string parameters
+    :param str body: The request body
+    :rtype: dict
+    """
+    params = dict(query_params)
+    if body:
+        body = json.loads(body)
+        # The API accepts entity attributes wrapped in a dict named after the
+        # entity
+        if len(body) == 1 and isinstance(body.values()[0], dict):
+            body = body.values()[0]
+        params.update(body)
+    return params
+
+
+def _timestamp():
+    """Returns the current time formatted like Satellite 'updated_at' values
+    """
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f UTC')
+
+
+def _parse_query(query):
+    """Parse a search query made of 'attr = value' terms joined with 'and',
+    and groups of such terms, optionally in parentheses, joined with 'or'
+
+    :param str query: The query to parse
+    :returns: A list of the groups joined with 'or', each a list of
+              (attr, value) pairs
+    :rtype: list
+    """
+    if isinstance(query, str):
+        query = query.decode('utf-8')
+    groups = [[]]
+    tokens = [
+        token for token in findall(r'"(?:\\.|[^"\\])*"|[()]|[^\s()]+', query)
+        if token not in ('(', ')', 'and')
+    ]
+    pos = 0
+    while pos < len(tokens):
+        if tokens[pos] == 'or':
+            groups.append([])
+            pos += 1
+            continue
+        groups[-1].append((tokens[pos], _unquote(tokens[pos + 2])))
+        pos += 3
+    return groups
+
+
+def _unquote(token):
+    """Remove the quotes (and escaping within them) from a query value
+    """
+    if len(token) > 1 and token.startswith('"') and token.endswith('"'):
+        return sub(r'\\(.)', r'\1', token[1:-1])
+    return token
+
+
+def _match_query(entity, query):
+    """Returns wither the given entity matches the given parsed query
+    """
+    return any(
+        all(_text(entity.get(attr)) == value for attr, value in group)
+        for group in query
+    )
+
+
+def _text(value):
+    """Convert a JSON value to text for comparing it with query values
+    """
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""Executor classes for running entity ensuring calls either one after the
+other or concurrently on a bounded pool of threads, and a shared I/O pool for
+running Satellite queries asynchronously
+"""
+import imp
+from contextlib import contextmanager
+from threading import Lock, local
+from multiprocessing.pool import ThreadPool
+
+from instrumentation import in_current_span
+
+DEFAULT_WORKERS = 8
+IO_WORKERS = 64
+
+_io_pool = None
+_io_pool_lock = Lock()
+_io_thread = local()
+
+
+class SerialExecutor(object):
+    """An executor that runs calls one after the other in the calling thread
+    """
+    def map(self, func, iterable):
+        """Call the given function for every item in the given iterable
+
+        :param callable func: The function to call
+        :param iterable iterable: The arguments to call the function with
+        :returns: A list of the function results in the order of the arguments
+        :rtype: list
+        """
+        return [func(item) for item in iterable]
+
+    def close(self):
+        """Release the resources of the executor
+        """
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ThreadPoolExecutor(SerialExecutor):
+    """An executor that runs calls concurrently on a bounded pool of threads
+    """
+    def __init__(self, workers=DEFAULT_WORKERS):
+        """
+        :param int workers: The maximal amount of calls to run at the same
+                            time
+        """
+        self.workers = workers
+        self._pool = ThreadPool(workers)
+
+    def map(self, func, iterable):
+        """Call the given function for every item in the given iterable
+        concurrently, and wait for all calls to finish
+
+        :param callable func: The function to call
+        :param iterable iterable: The arguments to call the function with
+        :returns: A list of the function results in the order of the arguments
+        :rtype: list
+        """
+        return self._pool.map(func, iterable, chunksize=1)
+
+    def close(self):
+        """Wait for running calls to finish and stop the pool threads
+        """
+        self._pool.close()
+        self._pool.join()
+
+
+def make_executor(workers=DEFAULT_WORKERS):
+    """Create an executor for running the given amount of calls at the same
+    time
+
+    :param int workers: The maximal amount of calls to run at the same time
+    :returns: A SerialExecutor if workers is 1 or less, a ThreadPoolExecutor
+              otherwise
+    """
+    if workers <= 1:
+        return SerialExecutor()
+    return ThreadPoolExecutor(workers)
+
+
+def io_pool():
+    """Returns the shared pool asynchronous Satellite queries are run on,
+    creating it on first use
+
+    :rtype: multiprocessing.pool.ThreadPool
+    """
+    global _io_pool
+    with _io_pool_lock:
+        if _io_pool is None:
+            _io_pool = ThreadPool(IO_WORKERS, initializer=_mark_io_worker)
+        return _io_pool
+
+
+def _mark_io_worker():
+    _io_thread.worker = True
+
+
+def in_io_pool():
+    """Returns wither the current thread is a worker of the shared I/O pool,
+    in which case it must not wait on other asynchronous calls
+
+    :rtype: bool
+    """
+    return getattr(_io_thread, 'worker', False)
+
+
+def set_io_workers(workers):
+    """Set the maximal amount of asynchronous Satellite queries that may be in
+    flight at the same time. Queries already running on the previous pool are
+    allowed to finish
+
+    :param int workers: The amount of queries
+    """
+    global _io_pool, IO_WORKERS
+    with _io_pool_lock:
+        old_pool, _io_pool = _io_pool, None
+        IO_WORKERS = workers
+    if old_pool is not None:
+        old_pool.close()
+
+
+def forget_io_pool():
+    """Drop the shared pool without closing it. Meant for forked processes,
+    which inherit the pool but not its threads
+    """
+    global _io_pool, _io_pool_lock
+    _io_pool_lock = Lock()
+    _io_pool = None
+
+
+@contextmanager
+def import_lock_released():
+    """A context manager that releases the import lock within its block if
+    the calling thread holds it, and takes it again after the block.
+
+    In Python 2 every 'import' statement waits for the global import lock,
+    even when the module is already loaded, and a thread holds the lock while
+    it imports a module. Threads that wait for worker threads (which import
+    modules lazily, as libraries like 'requests' do) do so within this block,
+    so that applying entities from a module that is being imported does not
+    hang. Worker threads are not expected to import that module itself, which
+    they would find only partly initialized
+    """
+    released = 0
+    while True:
+        try:
+            imp.release_lock()
+        except RuntimeError:
+            # Not held (anymore) by this thread
+            break
+        released += 1
+    try:
+        yield
+    finally:
+        for _ in xrange(released):
+            imp.acquire_lock()
+
+
+def run_async(func, *args, **kwargs):
+    """Run the given function with the given arguments on the shared I/O pool
+
+    Functions passed here should not wait on other asynchronous calls, as
+    that can starve the pool (Code that may run either way can check
+    'in_io_pool' and make its calls synchronously instead)
+
+    :param callable func: The function to run
+    :returns: An object which 'get' method waits for the function to finish
+              and returns its result (or raises its exception)
+    :rtype: multiprocessing.pool.AsyncResult
+    """
+    return io_pool().apply_async(in_current_span(func), args, kwargs)
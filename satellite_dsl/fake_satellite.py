@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""A local stand-in for the Satellite 6 API that keeps entities in memory
+
+It is meant for testing and benchmarking the DSL without a real Satellite,
+and implements just enough of the Foreman and Katello APIs for searching,
+reading, creating, updating and deleting entities, including listing the
+subscriptions of organizations. Latency can be added to every request to
+simulate a remote server, and the server can be made to turn requests away
+to simulate an overloaded one
+"""
+import json
+from uuid import uuid4
+from hashlib import md5
+from random import uniform
+from threading import Lock, Thread
+from time import sleep, time
+from urlparse import urlparse, parse_qsl
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+import nailgun.config
+import nailgun.entities
+
+from entity_store import EntityStore, request_params
+from logger import LOGGER
+
+
+class FakeSatellite(EntityStore):
+    """An in-memory fake Satellite server running on a background thread
+
+    Entities are kept in an 'EntityStore', use 'add' to populate it
+    """
+    def __init__(
+        self,
+        host='127.0.0.1',
+        port=0,
+        latency=0.0,
+        jitter=0.0,
+        max_concurrent=None,
+        error_rate=0.0,
+        retry_after=None,
+    ):
+        """
+        :param str host: The address to listen on
+        :param int port: The port to listen on, a free port is picked if 0
+        :param float latency: Seconds to wait before answering every request
+        :param float jitter: Up to how many seconds to randomly add to the
+                             latency of every request
+        :param int max_concurrent: If set, requests that arrive while this
+                                   many are being handled are answered with
+                                   503, like a full Passenger queue
+        :param float error_rate: The fraction of requests to randomly answer
+                                 with 502
+        :param int retry_after: The 'Retry-After' header value to send with
+                                503 responses, if any
+        """
+        self._server = _ThreadingHTTPServer((host, port), _RequestHandler)
+        self._server.fake_satellite = self
+        self._thread = None
+        self.latency = latency
+        self.jitter = jitter
+        self.max_concurrent = max_concurrent
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.rejected = 0
+        self._in_flight_lock = Lock()
+        super(FakeSatellite, self).__init__(self.server_config())
+        self.requests = []
+        self.sessions = set()
+        self.basic_auth_requests = 0
+
+    def add_subscription(self, organization_id, product_name, products=()):
+        """Add a Katello subscription to an organization, along with the
+        products it provides
+
+        :param int organization_id: The id of the organization
+        :param str product_name: The product name of the subscription
+        :param list products: The names of the provided products
+        :returns: The JSON dictionary of the added subscription
+        :rtype: dict
+        """
+        provided = [
+            self.add(
+                nailgun.entities.Product,
+                name=name,
+                organization_id=organization_id,
+            )
+            for name in products
+        ]
+        return self.add(
+            nailgun.entities.Subscription,
+            name=product_name,
+            product_name=product_name,
+            organization_id=organization_id,
+            provided_products=[
+                dict(id=product['id'], name=product['name'])
+                for product in provided
+            ],
+        )
+
+    @property
+    def url(self):
+        """The base URL of the fake server
+        """
+        return 'http://{}:{}'.format(*self._server.server_address)
+
+    def server_config(self):
+        """Returns a NailGun server configuration for connecting to the fake
+        server
+
+        :rtype: nailgun.config.ServerConfig
+        """
+        return nailgun.config.ServerConfig(
+            url=self.url,
+            auth=('admin', 'changeme'),
+            verify=False,
+        )
+
+    def start(self):
+        """Start serving requests on a background thread
+
+        :returns: self
+        """
+        self._thread = Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving requests
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """Request handler for the fake Satellite API
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def do_PUT(self):
+        self._handle()
+
+    def do_DELETE(self):
+        self._handle()
+
+    @property
+    def fake(self):
+        return self.server.fake_satellite
+
+    def _handle(self):
+        """Answer the request from the entities stored in the fake server
+        """
+        self._started = time()
+        url = urlparse(self.path)
+        self.fake.requests.append((self.command, url.path))
+        length = int(self.headers.get('content-length', 0))
+        params = request_params(
+            parse_qsl(url.query),
+            self.rfile.read(length) if length else None,
+        )
+        if not self._authenticate():
+            return
+        fake = self.fake
+        with fake._in_flight_lock:
+            overloaded = fake.max_concurrent is not None and \
+                fake.in_flight >= fake.max_concurrent
+            failed = not overloaded and uniform(0, 1) < fake.error_rate
+            if overloaded or failed:
+                fake.rejected += 1
+            else:
+                fake.in_flight += 1
+        if overloaded:
+            self._respond(503, dict(error=dict(message='Service Unavailable')))
+            return
+        if failed:
+            self._respond(502, dict(error=dict(message='Bad Gateway')))
+            return
+        try:
+            if fake.latency or fake.jitter:
+                sleep(fake.latency + uniform(0, fake.jitter))
+            status, data = fake.handle(self.command, url.path, params)
+        finally:
+            with fake._in_flight_lock:
+                fake.in_flight -= 1
+        # Only single entities are cached by clients
+        etag = self.command == 'GET' and status == 200 and \
+            'results' not in data
+        self._respond(status, data, etag=etag)
+
+    def _authenticate(self):
+        """Authenticate the request either by HTTP basic auth, in which case a
+        session cookie is handed out, or by a session cookie. Responds with 401
+        and returns False if authentication fails
+        """
+        self._new_session = None
+        if 'authorization' in self.headers:
+            self.fake.basic_auth_requests += 1
+            self._new_session = uuid4().hex
+            self.fake.sessions.add(self._new_session)
+            return True
+        cookies = dict(
+            cookie.strip().split('=', 1)
+            for cookie in self.headers.get('cookie', '').split(';')
+            if '=' in cookie
+        )
+        if cookies.get('_session_id') in self.fake.sessions:
+            return True
+        self._respond(401, dict(error=dict(message='Unable to authenticate')))
+        return False
+
+    def _respond(self, status, data, etag=False):
+        body = json.dumps(data)
+        if etag:
+            etag = '"{}"'.format(md5(body).hexdigest())
+            if self.headers.get('if-none-match') == etag:
+                status, body = 304, ''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        # Like Rails, report how long handling the request took
+        self.send_header(
+            'X-Runtime', '{:.6f}'.format(time() - self._started)
+        )
+        if etag:
+            self.send_header('ETag', etag)
+        if status == 503 and self.fake.retry_after is not None:
+            self.send_header('Retry-After', str(self.fake.retry_after))
+        if getattr(self, '_new_session', None):
+            self.send_header(
+                'Set-Cookie',
+                '_session_id={}; path=/'.format(self._new_session)
+            )
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOGGER.debug('Fake Satellite: ' + format, *args)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+"""Client side traffic governing for the requests sent to Satellite servers
+
+Every server gets a governor that all the requests sent to it pass through.
+A governor limits the requests in flight to a concurrency window it adapts to
+how the server copes: the window grows slowly while responses come back fast
+and successful, and is halved when the server signals overload (429, 502, 503
+and 504 responses, connection failures or responses much slower than usual).
+Requests may also be limited to a fixed rate with a token bucket.
+
+Idempotent requests that fail due to overload are retried with jittered
+exponential backoff, and a 'Retry-After' header pauses all the requests to the
+server for as long as it asks. Writes are only retried if the server turned
+them away with 429 or 503, as after gateway errors and connection failures
+they may have been carried out
+"""
+from random import uniform
+from threading import Condition, Lock
+from time import sleep, time
+
+from requests.exceptions import ConnectionError, Timeout
+
+from logger import LOGGER
+
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+# Statuses other requests are retried on, as they are sent before a request
+# is handed to Foreman (E.g. when the Passenger queue is full)
+REJECTED_STATUSES = frozenset([429, 503])
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+MAX_RETRY_AFTER = 300.0
+INITIAL_CONCURRENCY = 16
+MAX_CONCURRENCY = 64
+# Responses slower than this many times the usual latency signal overload,
+# unless they take less than SLOW_RESPONSE seconds
+SLOW_FACTOR = 4.0
+SLOW_RESPONSE = 1.0
+
+_governors = {}
+_governors_lock = Lock()
+_rate = None
+_burst = None
+
+
+class TrafficGovernor(object):
+    """Governs the traffic sent to a single server
+    """
+    def __init__(
+        self,
+        rate=None,
+        burst=None,
+        concurrency=INITIAL_CONCURRENCY,
+        max_concurrency=MAX_CONCURRENCY,
+    ):
+        """
+        :param float rate: The maximal amount of requests to start per second,
+                           unlimited if None
+        :param int burst: How many requests may be started at once after a
+                          quiet period when rate is limited, defaults to the
+                          rate
+        :param int concurrency: The initial size of the concurrency window
+        :param int max_concurrency: The largest the concurrency window may grow
+        """
+        self._cond = Condition(Lock())
+        self._tokens = float('inf')
+        self.set_rate(rate, burst)
+        self.concurrency = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.retries = 0
+        self.overloads = 0
+        self._refilled_at = time()
+        self._hold_until = 0.0
+        self._latency = None
+        self._usual_latency = None
+        self._since_decrease = int(concurrency)
+
+    def set_rate(self, rate, burst=None):
+        """Change the rate requests are started at
+
+        :param float rate: The maximal amount of requests to start per second,
+                           None for unlimited
+        :param int burst: How many requests may be started at once after a
+                          quiet period when rate is limited, defaults to the
+                          rate
+        """
+        with self._cond:
+            self.rate = rate
+            self.burst = burst or max(int(rate or 1), 1)
+            self._tokens = min(self._tokens, float(self.burst))
+            self._cond.notify_all()
+
+    def send(self, method, send_request):
+        """Send a request once the governor allows it, retrying it if the
+        server is overloaded and the request can be safely repeated
+
+        :param str method: The HTTP method of the request
+        :param callable send_request: A function that sends the request and
+                                      returns the response
+        :returns: The last response received
+        :rtype: requests.Response
+        """
+        attempt = 0
+        while True:
+            self._acquire()
+            start = time()
+            try:
+                response = send_request()
+            except (ConnectionError, Timeout):
+                self._release(time() - start, overloaded=True)
+                if method not in IDEMPOTENT_METHODS or attempt >= MAX_RETRIES:
+                    raise
+                delay = self._backoff(attempt)
+                reason = 'connection failure'
+            except BaseException:
+                # Failures that say nothing about the server load must still
+                # give the request slot back
+                self._release(time() - start, overloaded=None)
+                raise
+            else:
+                overloaded = response.status_code in RETRY_STATUSES
+                self._release(time() - start, overloaded)
+                if not overloaded:
+                    return response
+                retry_after = _retry_after(response)
+                if retry_after is not None:
+                    self._hold(retry_after)
+                if attempt >= MAX_RETRIES or not (
+                    method in IDEMPOTENT_METHODS or
+                    response.status_code in REJECTED_STATUSES
+                ):
+                    return response
+                delay = self._backoff(attempt)
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                reason = 'status {}'.format(response.status_code)
+                # Release the connection back to the pool
+                response.content
+                response.close()
+            attempt += 1
+            with self._cond:
+                self.retries += 1
+            LOGGER.debug(
+                'Retrying %s request in %.2fs due to %s (attempt %d/%d)',
+                method, delay, reason, attempt, MAX_RETRIES
+            )
+            sleep(delay)
+
+    def _acquire(self):
+        """Wait until a request may be sent
+        """
+        with self._cond:
+            while True:
+                now = time()
+                wait = self._hold_until - now
+                if wait <= 0 and self.in_flight >= int(self.concurrency):
+                    self._cond.wait()
+                    continue
+                if wait <= 0 and self.rate:
+                    self._refill(now)
+                    if self._tokens < 1:
+                        wait = (1 - self._tokens) / self.rate
+                    else:
+                        self._tokens -= 1
+                if wait <= 0:
+                    self.in_flight += 1
+                    return
+                self._cond.wait(wait)
+
+    def _release(self, latency, overloaded):
+        """Record the result of a request and adapt the concurrency window
+
+        :param float latency: How long the request took
+        :param bool overloaded: Wither the server signalled overload, None if
+                                the request failed in a way that tells
+                                nothing about it, so the window is kept as is
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if overloaded is None:
+                self._cond.notify_all()
+                return
+            self._since_decrease += 1
+            if not overloaded:
+                overloaded = self._slow(latency)
+            if overloaded:
+                self.overloads += 1
+                # Only back off once per window, as the requests that were
+                # already in flight are likely to report overload as well
+                if self._since_decrease >= int(self.concurrency):
+                    self._since_decrease = 0
+                    self.concurrency = max(self.concurrency / 2, 1.0)
+                    LOGGER.debug(
+                        'Server overloaded, concurrency lowered to %d',
+                        self.concurrency
+                    )
+            elif self.concurrency < self.max_concurrency:
+                self.concurrency = min(
+                    self.concurrency + 1 / self.concurrency,
+                    self.max_concurrency,
+                )
+            self._cond.notify_all()
+
+    def _slow(self, latency):
+        """Track the usual response latency and return wither the given one
+        is much slower than usual (The lock must be held)
+        """
+        if self._latency is None:
+            self._latency = latency
+        else:
+            self._latency = 0.8 * self._latency + 0.2 * latency
+        if self._usual_latency is None or \
+                self._latency < self._usual_latency:
+            self._usual_latency = self._latency
+        return latency > max(SLOW_RESPONSE, SLOW_FACTOR * self._usual_latency)
+
+    def _refill(self, now):
+        """Add the tokens earned since the last refill (The lock must be
+        held)
+        """
+        self._tokens = min(
+            self._tokens + (now - self._refilled_at) * self.rate,
+            float(self.burst),
+        )
+        self._refilled_at = now
+
+    def _hold(self, seconds):
+        """Hold all the requests to the server for the given amount of seconds
+        """
+        with self._cond:
+            self._hold_until = max(self._hold_until, time() + seconds)
+
+    def _backoff(self, attempt):
+        """Returns how long to wait before retrying, with 'full jitter'
+        """
+        return uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _retry_after(response):
+    """Returns the amount of seconds a response asks to wait before retrying,
+    or None. Only the delay-seconds form of 'Retry-After' is supported
+    """
+    try:
+        seconds = float(response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+def get_governor(base_url):
+    """Returns the governor for the given server, creating it on first use
+
+    :param str base_url: The scheme and network location of the server
+    :rtype: TrafficGovernor
+    """
+    with _governors_lock:
+        try:
+            return _governors[base_url]
+        except KeyError:
+            governor = _governors[base_url] = TrafficGovernor(_rate, _burst)
+            return governor
+
+
+def set_rate_limit(rate, burst=None):
+    """Limit the rate of requests started to every server, including the
+    ones already talked to
+
+    :param float rate: The maximal amount of requests to start per second,
+                       None for unlimited
+    :param int burst: How many requests may be started at once after a quiet
+                      period, defaults to the rate
+    """
+    global _rate, _burst
+    with _governors_lock:
+        _rate, _burst = rate, burst
+        for governor in _governors.itervalues():
+            governor.set_rate(rate, burst)
+
+
+def forget_governors():
+    """Drop all the governors. Meant for forked processes, which inherit the
+    governors and the requests they count as in flight, but not the threads
+    that sent them
+    """
+    global _governors_lock
+    _governors_lock = Lock()
+    _governors.clear()
@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+"""A class fo ensuring existance of nailgun Host entities
+"""
+import nailgun.entities
+
+from type_handler import type_handler
+
+from entity_ensurer import EntityEnsurer
+
+
+@type_handler(fortype=nailgun.entities.Host, incls=EntityEnsurer)
+class HostEnsurer(EntityEnsurer):
+    """Ensurer class for Host entities
+
+    Satellite servers may have many more hosts than a script ensures, so
+    instead of listing all the hosts, the hosts in each wave of an ensure
+    graph (or chunk of 'ensure_many') are searched for by their names in
+    batches
+    """
+    prefetch = False
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+"""A class fo ensuring existance of nailgun HostGroup entities
+"""
+import nailgun.entities
+
+from type_handler import type_handler
+
+from entity_ensurer import EntityEnsurer
+
+
+@type_handler(fortype=nailgun.entities.HostGroup, incls=EntityEnsurer)
+class HostGroupEnsurer(EntityEnsurer):
+    """Ensurer class for HostGroup entities
+
+    Satellite 6.1 does not return the content fields of host groups when
+    listing or reading them (NailGun reads them with an empty update instead,
+    see BZ #1235377), so host groups that set them are always read
+    """
+    unlisted_fields = (
+        'content_source',
+        'content_view',
+        'lifecycle_environment',
+    )
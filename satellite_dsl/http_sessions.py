@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""Pooled, keep-alive HTTP sessions for talking to Satellite
+
+All HTTP requests NailGun makes (and therefore all the ones made by
+'nailgun_hacks') are routed through one 'requests.Session' per server and
+credentials, so connections (and their TLS sessions) are kept alive and
+reused. Once Foreman hands out a session cookie, requests authenticate with it
+instead of sending HTTP basic auth, which is expensive to verify on servers
+that authenticate against LDAP
+"""
+from threading import Lock
+from time import time
+from urlparse import urlparse
+
+import requests
+import requests.adapters
+import requests.auth
+import nailgun.client
+
+from governor import get_governor
+from instrumentation import get_instrumentation
+from logger import LOGGER
+
+POOL_SIZE = 64
+SESSION_COOKIE = '_session_id'
+
+_sessions = {}
+_adapters = {}
+_sessions_lock = Lock()
+
+
+class ForemanSessionAuth(requests.auth.AuthBase):
+    """Authentication handler that uses HTTP basic auth only as long as there
+    is no Foreman session cookie, and falls back to it if the session expires
+    """
+    def __init__(self, username, password):
+        """
+        :param str username: The user name for HTTP basic auth
+        :param str password: The password for HTTP basic auth
+        """
+        self.basic_auth = requests.auth.HTTPBasicAuth(username, password)
+
+    def __call__(self, request):
+        if _has_session_cookie(request):
+            request.register_hook('response', self.handle_401)
+            return request
+        return self.basic_auth(request)
+
+    def handle_401(self, response, **kwargs):
+        """Response hook that retries the request with HTTP basic auth if the
+        session cookie it was sent with was rejected
+        """
+        if response.status_code != 401:
+            return response
+        LOGGER.debug('Foreman session expired, re-authenticating')
+        # Consume the content so the connection can be released to the pool
+        response.content
+        response.close()
+        request = response.request.copy()
+        request.headers.pop('Cookie', None)
+        request.deregister_hook('response', self.handle_401)
+        self.basic_auth(request)
+        retry = response.connection.send(request, **kwargs)
+        retry.history.append(response)
+        retry.request = request
+        return retry
+
+
+def _has_session_cookie(request):
+    """Returns wither the given prepared request carries a Foreman session
+    cookie
+    """
+    cookies = request.headers.get('Cookie', '')
+    return any(
+        cookie.strip().startswith(SESSION_COOKIE + '=')
+        for cookie in cookies.split(';')
+    )
+
+
+def get_session(base_url, auth=None):
+    """Returns the shared session for the given server and credentials,
+    creating it on first use
+
+    :param str base_url: The scheme and network location of the server
+    :param tuple auth: A (username, password) tuple or a requests auth object
+    :rtype: requests.Session
+    """
+    key = (base_url, auth)
+    with _sessions_lock:
+        try:
+            return _sessions[key]
+        except KeyError:
+            pass
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=POOL_SIZE,
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if base_url in _adapters:
+            session.mount(base_url, _adapters[base_url])
+        if isinstance(auth, tuple):
+            session.auth = ForemanSessionAuth(*auth)
+        else:
+            session.auth = auth
+        _sessions[key] = session
+        return session
+
+
+def server_config_session(server_config):
+    """Returns the shared session for the given server configuration
+
+    :param nailgun.config.ServerConfig server_config: Connection information
+    :rtype: requests.Session
+    """
+    return get_session(
+        _base_url(server_config.url),
+        getattr(server_config, 'auth', None),
+    )
+
+
+def close_sessions():
+    """Close all shared sessions and their pooled connections
+    """
+    with _sessions_lock:
+        sessions = _sessions.values()
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+def mount_adapter(url, adapter):
+    """Send all the requests to the given server through the given transport
+    adapter instead of the network (E.g. to answer them from a snapshot)
+
+    :param str url: The URL of the server
+    :param requests.adapters.BaseAdapter adapter: The adapter
+    """
+    base_url = _base_url(url)
+    with _sessions_lock:
+        _adapters[base_url] = adapter
+    _close_server_sessions(base_url)
+
+
+def unmount_adapter(url):
+    """Send the requests to the given server through the network again
+
+    :param str url: The URL of the server
+    """
+    base_url = _base_url(url)
+    with _sessions_lock:
+        _adapters.pop(base_url, None)
+    _close_server_sessions(base_url)
+
+
+def _close_server_sessions(base_url):
+    """Close the shared sessions for the given server, so they are created
+    again with the right adapters
+    """
+    with _sessions_lock:
+        keys = [key for key in _sessions if key[0] == base_url]
+        sessions = [_sessions.pop(key) for key in keys]
+    for session in sessions:
+        session.close()
+
+
+def _base_url(url):
+    """Returns the scheme and network location part of the given URL
+    """
+    parsed = urlparse(url)
+    return '{}://{}'.format(parsed.scheme, parsed.netloc)
+
+
+class PooledRequests(object):
+    """A stand-in for the 'requests' module that sends requests through the
+    shared sessions and the traffic governor of their server. Attributes
+    other than the request functions are taken from the 'requests' module
+    """
+    def request(self, method, url, **kwargs):
+        base_url = _base_url(url)
+        session = get_session(base_url, kwargs.pop('auth', None))
+
+        def send_request():
+            instrumentation = get_instrumentation()
+            if instrumentation is None:
+                return session.request(method, url, **kwargs)
+            start = time()
+            response = session.request(method, url, **kwargs)
+            instrumentation.record_response(response, time() - start)
+            return response
+        return get_governor(base_url).send(method.upper(), send_request)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('HEAD', url, **kwargs)
+
+    def get(self, url, params=None, **kwargs):
+        return self.request('GET', url, params=params, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request('POST', url, data=data, json=json, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request('PUT', url, data=data, **kwargs)
+
+    def patch(self, url, data=None, **kwargs):
+        return self.request('PATCH', url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(requests, attr)
+
+
+def install():
+    """Make NailGun send all its requests through the shared sessions
+    """
+    if not isinstance(nailgun.client.requests, PooledRequests):
+        nailgun.client.requests = PooledRequests()
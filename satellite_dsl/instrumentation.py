@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+"""Instrumentation of ensure calls and of the HTTP requests made to Satellite
+
+When enabled, the time spent ensuring entities and the HTTP requests made
+while doing so are recorded per entity class, so it can be told wither a slow
+run is spending its time in Satellite (as reported by the 'X-Runtime' response
+header), in the network or in client side processing. When disabled, the
+hooks only cost a check for wither instrumentation is enabled
+"""
+import os
+import json
+from contextlib import contextmanager
+from threading import Lock, local
+from time import time
+
+# The label for requests not made on behalf of ensuring a specific entity
+OTHER = '(other)'
+
+_instrumentation = None
+_current = local()
+
+
+class ClassStats(object):
+    """Statistics collected for one entity class
+    """
+    __slots__ = (
+        'ensures',
+        'ensure_seconds',
+        'requests',
+        'request_seconds',
+        'received_bytes',
+        'server_seconds',
+    )
+
+    def __init__(self):
+        for attr in self.__slots__:
+            setattr(self, attr, 0)
+
+    def as_dict(self):
+        """Returns the statistics as a dictionary, including the estimated
+        time spent in the network and in client side processing
+
+        :rtype: dict
+        """
+        stats = dict((attr, getattr(self, attr)) for attr in self.__slots__)
+        stats.update(
+            network_seconds=max(self.request_seconds - self.server_seconds, 0),
+            client_seconds=max(self.ensure_seconds - self.request_seconds, 0),
+        )
+        return stats
+
+
+class Instrumentation(object):
+    """Collects ensure and HTTP request statistics per entity class
+    """
+    def __init__(self):
+        self.started = time()
+        self.stats = {}
+        self._lock = Lock()
+
+    def record_ensure(self, entity_class, seconds):
+        """Record the ensuring of an entity
+
+        :param str entity_class: The entity class name
+        :param float seconds: The wall time ensuring took
+        """
+        with self._lock:
+            stats = self._class_stats(entity_class)
+            stats.ensures += 1
+            stats.ensure_seconds += seconds
+
+    def record_response(self, response, seconds):
+        """Record an HTTP request made on behalf of the entity class being
+        ensured in the current thread
+
+        :param requests.Response response: The response to the request
+        :param float seconds: The wall time the request took
+        """
+        received = len(response.content or '')
+        try:
+            server_seconds = float(response.headers.get('X-Runtime', 0))
+        except ValueError:
+            server_seconds = 0
+        with self._lock:
+            stats = self._class_stats(current_entity_class())
+            stats.requests += 1
+            stats.request_seconds += seconds
+            stats.received_bytes += received
+            stats.server_seconds += server_seconds
+
+    def report(self):
+        """Returns a report of the collected statistics
+
+        :returns: A JSON serializable dictionary
+        :rtype: dict
+        """
+        with self._lock:
+            classes = dict(
+                (entity_class, stats.as_dict())
+                for entity_class, stats in self.stats.iteritems()
+            )
+        totals = ClassStats()
+        for stats in classes.itervalues():
+            for attr in ClassStats.__slots__:
+                setattr(totals, attr, getattr(totals, attr) + stats[attr])
+        return dict(
+            wall_seconds=time() - self.started,
+            totals=totals.as_dict(),
+            classes=classes,
+        )
+
+    def write_json(self, path):
+        """Write the report as a JSON file
+
+        :param str path: The path of the file
+        """
+        with open(path, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2, sort_keys=True)
+
+    def write_prometheus(self, path, prefix='satellite_dsl'):
+        """Write the statistics as Prometheus metrics in the text exposition
+        format, for the node exporter textfile collector. The file is
+        replaced atomically so the collector never reads a partial file
+
+        :param str path: The path of the file, should end with '.prom'
+        :param str prefix: The prefix of the metric names
+        """
+        classes = self.report()['classes']
+        lines = []
+        for attr, metric, help_text in _PROMETHEUS_METRICS:
+            name = '{}_{}'.format(prefix, metric)
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} counter'.format(name))
+            for entity_class, stats in sorted(classes.iteritems()):
+                lines.append('{}{{entity_class="{}"}} {!r}'.format(
+                    name, _prometheus_label(entity_class), stats[attr]
+                ))
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as metrics_file:
+            metrics_file.write('\n'.join(lines) + '\n')
+        os.rename(tmp_path, path)
+
+    def _class_stats(self, entity_class):
+        """Returns the statistics object of an entity class (The lock must be
+        held)
+        """
+        try:
+            return self.stats[entity_class]
+        except KeyError:
+            stats = self.stats[entity_class] = ClassStats()
+            return stats
+
+
+_PROMETHEUS_METRICS = (
+    ('ensures', 'ensures_total', 'Entities ensured'),
+    ('ensure_seconds', 'ensure_seconds_total', 'Wall time spent ensuring'),
+    ('requests', 'http_requests_total', 'HTTP requests made'),
+    ('request_seconds', 'http_request_seconds_total',
+     'Wall time spent in HTTP requests'),
+    ('received_bytes', 'http_received_bytes_total', 'HTTP response bytes'),
+    ('server_seconds', 'server_seconds_total',
+     'Time Satellite reported spending on requests'),
+    ('network_seconds', 'network_seconds_total',
+     'Estimated time spent in the network'),
+    ('client_seconds', 'client_seconds_total',
+     'Estimated time spent in client side processing'),
+)
+
+
+def _prometheus_label(value):
+    """Escape a Prometheus label value
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def enable_instrumentation():
+    """Start collecting statistics, discarding ones collected so far
+
+    :rtype: Instrumentation
+    """
+    global _instrumentation
+    _instrumentation = Instrumentation()
+    return _instrumentation
+
+
+def disable_instrumentation():
+    """Stop collecting statistics
+
+    :returns: The instrumentation that was active, if any
+    :rtype: Instrumentation
+    """
+    global _instrumentation
+    instrumentation, _instrumentation = _instrumentation, None
+    return instrumentation
+
+
+def get_instrumentation():
+    """Returns the active instrumentation or None if it is disabled
+
+    :rtype: Instrumentation
+    """
+    return _instrumentation
+
+
+def current_entity_class():
+    """Returns the name of the entity class being ensured by the current
+    thread, or OTHER
+
+    :rtype: str
+    """
+    return getattr(_current, 'entity_class', OTHER)
+
+
+@contextmanager
+def ensure_span(entity_cls):
+    """A context manager to wrap the ensuring of an entity with, so its wall
+    time is recorded and the HTTP requests made within it are attributed to
+    its class
+
+    :param type entity_cls: The class of the entity
+    """
+    instrumentation = _instrumentation
+    if instrumentation is None:
+        yield
+        return
+    with _entity_class(entity_cls.__name__):
+        start = time()
+        try:
+            yield
+        finally:
+            instrumentation.record_ensure(entity_cls.__name__, time() - start)
+
+
+def in_current_span(func):
+    """Wrap a function that is to be run on another thread, so the HTTP
+    requests it makes are attributed to the entity class being ensured by
+    the current thread
+
+    :param callable func: The function
+    :rtype: callable
+    """
+    if _instrumentation is None:
+        return func
+    entity_class = current_entity_class()
+
+    def in_span(*args, **kwargs):
+        with _entity_class(entity_class):
+            return func(*args, **kwargs)
+    return in_span
+
+
+@contextmanager
+def _entity_class(entity_class):
+    """Set the entity class the current thread is working on
+    """
+    previous = current_entity_class()
+    _current.entity_class = entity_class
+    try:
+        yield
+    finally:
+        _current.entity_class = previous
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""A journal of the entities ensured by a run, for resuming failed runs
+
+The journal is a file of JSON lines, one for every entity that was ensured,
+with the digest of its declaration, the server it was ensured on, the id it
+was resolved to and what ensuring it did. When a run is resumed from the
+journal of a failed run, entities whose declarations did not change since are
+trusted to be as the journal says, and are not looked up on the server again
+"""
+import json
+from threading import Lock
+from time import time
+
+from logger import LOGGER
+
+JOURNAL_FORMAT = 1
+
+_journal = None
+
+
+class JournalEntry(object):
+    """An entity recorded in the journal
+    """
+    __slots__ = ('digest', 'server', 'entity_class', 'id', 'outcome')
+
+    def __init__(self, digest, server, entity_class, id, outcome):
+        self.digest = digest
+        self.server = server
+        self.entity_class = entity_class
+        self.id = id
+        self.outcome = outcome
+
+    def to_json(self):
+        return dict((attr, getattr(self, attr)) for attr in self.__slots__)
+
+
+class Journal(object):
+    """A journal of ensured entities
+    """
+    def __init__(self, path, resume=False):
+        """
+        :param str path: The path of the journal file
+        :param bool resume: Wither to load the entries already in the file
+                            and keep adding to it. If False, the file is
+                            started over
+        """
+        self.path = path
+        self.entries = {}
+        self._lock = Lock()
+        if not (resume and self._load()):
+            self._file = open(path, 'w')
+            self._write(dict(format=JOURNAL_FORMAT, started_at=time()))
+            self._file.close()
+        # Appending keeps the lines of processes sharing the journal (E.g.
+        # when fanning out to several servers) from overwriting each other
+        self._file = open(path, 'a')
+
+    def find(self, digest, server):
+        """Returns the entry of an entity declaration, if it was journaled
+
+        :param str digest: The digest of the declaration
+        :param str server: The URL of the server the entity is ensured on
+        :rtype: JournalEntry
+        """
+        return self.entries.get((server, digest))
+
+    def record(self, digest, entity, outcome):
+        """Record an ensured entity
+
+        :param str digest: The digest of the declaration
+        :param EntityRef entity: The ensured entity
+        :param str outcome: What ensuring the entity did
+        """
+        entry = JournalEntry(
+            digest=digest,
+            server=entity._server_config.url,
+            entity_class=entity.entity_cls.__name__,
+            id=entity.id,
+            outcome=outcome,
+        )
+        with self._lock:
+            self.entries[(entry.server, digest)] = entry
+            self._write(entry.to_json())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _write(self, data):
+        """Write a line to the journal, flushing it so it survives the process
+        """
+        self._file.write(json.dumps(data, separators=(',', ':')))
+        self._file.write('\n')
+        self._file.flush()
+
+    def _load(self):
+        """Load the entries in the journal file, if it exists. A partially
+        written last line (from a killed run) is ignored
+
+        :returns: Wither the file exists
+        :rtype: bool
+        """
+        try:
+            journal_file = open(self.path)
+        except IOError:
+            return False
+        with journal_file:
+            lines = iter(journal_file)
+            header = json.loads(next(lines, 'null') or 'null')
+            if header is not None and \
+                    header.get('format') != JOURNAL_FORMAT:
+                raise ValueError(
+                    'Unsupported journal format: {}'
+                    .format(header.get('format'))
+                )
+            for line in lines:
+                try:
+                    entry = JournalEntry(**json.loads(line))
+                except (TypeError, ValueError):
+                    continue
+                self.entries[(entry.server, entry.digest)] = entry
+        LOGGER.info(
+            'Resuming from %d journaled entities in: %s',
+            len(self.entries), self.path
+        )
+        return True
+
+
+def enable_journal(path, resume=False):
+    """Start journaling ensured entities in the given file
+
+    :param str path: The path of the journal file
+    :param bool resume: Wither to trust the entities already in the journal
+                        (E.g. to resume a failed run) instead of starting a
+                        new journal
+    :rtype: Journal
+    """
+    global _journal
+    disable_journal()
+    _journal = Journal(path, resume)
+    return _journal
+
+
+def disable_journal():
+    """Stop journaling ensured entities
+    """
+    global _journal
+    if _journal is not None:
+        _journal.close()
+    _journal = None
+
+
+def get_journal():
+    """Returns the active journal or None if journaling is disabled
+
+    :rtype: Journal
+    """
+    return _journal
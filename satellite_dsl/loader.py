@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+"""Loading entity declarations from YAML and JSON data files
+
+A configuration file declares entities instead of calling 'ensure' for them,
+for example:
+
+    - entity: Organization
+      ref: main_org
+      name: Default Organization
+    - entity: HostGroup
+      name: test_hg
+      organization: [{$ref: main_org}]
+
+Every declaration names the NailGun entity class in 'entity', may name itself
+in 'ref' so later declarations can link to it with '{$ref: <name>}', and sets
+the entity attributes with its other keys. YAML files ('.yaml', '.yml') may
+hold several documents, each a declaration or a list of them, and JSON files
+hold either a list of declarations ('.json') or one declaration per line
+('.jsonl'). YAML documents and '.jsonl' lines are parsed one at a time, but
+a '.json' file or a YAML document holding a list of declarations is parsed
+whole, and the compiled declarations of a file are always kept in memory
+together, so very large configurations are better split into several
+documents or written as '.jsonl'.
+
+All the declarations are validated before any of them is ensured, and the
+validated declarations are cached in a compact binary form keyed by a digest
+of the file and the satellite_dsl version, so loading an unchanged file again
+skips parsing and validation. Cache files that cannot be loaded for any reason
+are ignored and replaced
+"""
+import os
+import json
+import cPickle
+from hashlib import sha1
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from satellite_dsl import __version__
+from logger import LOGGER
+
+CONFIG_FORMAT = 1
+YAML_EXTENSIONS = ('.yaml', '.yml')
+JSON_EXTENSIONS = ('.json', '.jsonl')
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'satellite_dsl', 'configs'
+)
+REF_KEY = '$ref'
+
+
+class _Ref(object):
+    """A link to an earlier declaration in a compiled configuration
+    """
+    __slots__ = ('index',)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getstate__(self):
+        return (self.index,)
+
+    def __setstate__(self, state):
+        self.index, = state
+
+
+def is_config_file(path):
+    """Returns wither the given file is a configuration file the loader can
+    read, judging by its extension
+
+    :param str path: The path of the file
+    :rtype: bool
+    """
+    return os.path.splitext(path)[1].lower() in \
+        YAML_EXTENSIONS + JSON_EXTENSIONS
+
+
+def compile_config(path, cache_dir=DEFAULT_CACHE_DIR):
+    """Parse and validate a configuration file, or load the result of doing
+    so from the cache if the file did not change since
+
+    :param str path: The path of the configuration file
+    :param str cache_dir: The directory to cache compiled configurations in,
+                          None to disable caching
+    :returns: A list of (entity class name, attributes) tuples, where links
+              to other declarations are replaced by references to their
+              index in the list
+    :rtype: list
+    """
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = os.path.join(
+            cache_dir, '{}.pickle'.format(_file_digest(path))
+        )
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                compiled = cPickle.load(cache_file)
+            if not isinstance(compiled, list):
+                raise TypeError('not a compiled configuration')
+            LOGGER.debug('Loaded compiled configuration: %s', cache_path)
+            return compiled
+        except Exception as exc:
+            LOGGER.debug(
+                'Ignoring compiled configuration: %s (%s)', cache_path, exc
+            )
+    compiled = _validate(path, _iter_declarations(path))
+    if cache_path is not None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        with open(tmp_path, 'wb') as cache_file:
+            cPickle.dump(compiled, cache_file, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, cache_path)
+    return compiled
+
+
+def load_config(path, ensure, cache_dir=DEFAULT_CACHE_DIR):
+    """Declare the entities in a configuration file
+
+    :param str path: The path of the configuration file
+    :param callable ensure: The function to declare entities with (E.g.
+                            'satellite_dsl.ensure')
+    :param str cache_dir: The directory to cache compiled configurations in,
+                          None to disable caching
+    :returns: The values 'ensure' returned for the declarations, in order
+    :rtype: list
+    """
+    import nailgun.entities
+
+    declared = []
+    for class_name, attrs in compile_config(path, cache_dir):
+        declared.append(ensure(
+            getattr(nailgun.entities, class_name),
+            **dict(
+                (attr, _resolve_refs(value, declared))
+                for attr, value in attrs.iteritems()
+            )
+        ))
+    LOGGER.info('Declared %d entities from: %s', len(declared), path)
+    return declared
+
+
+def _resolve_refs(value, declared):
+    if isinstance(value, _Ref):
+        return declared[value.index]
+    elif isinstance(value, list):
+        return [_resolve_refs(item, declared) for item in value]
+    return value
+
+
+def _file_digest(path):
+    """Returns a digest of the content of a file, of the version of the
+    compiled form and of the satellite_dsl version the file is compiled with
+    """
+    digest = sha1('{}:{}:'.format(CONFIG_FORMAT, __version__))
+    with open(path, 'rb') as config_file:
+        for chunk in iter(lambda: config_file.read(1024 * 1024), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _iter_declarations(path):
+    """Iterate over the declarations in a configuration file, parsing YAML
+    files one document at a time and '.jsonl' files one line at a time
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path) as config_file:
+        if extension in YAML_EXTENSIONS:
+            if yaml is None:
+                raise ImportError(
+                    'PyYAML is needed to load YAML configuration files'
+                )
+            documents = yaml.safe_load_all(config_file)
+        elif extension == '.jsonl':
+            documents = (json.loads(line) for line in config_file if
+                         line.strip())
+        else:
+            documents = [json.load(config_file)]
+        for document in documents:
+            if isinstance(document, list):
+                for declaration in document:
+                    yield declaration
+            elif document is not None:
+                yield document
+
+
+def _validate(path, declarations):
+    """Validate declarations and compile them
+
+    :raises ValueError: Listing all the problems found, if any
+    """
+    import nailgun.config
+    import nailgun.entities
+    from nailgun.entity_fields import OneToManyField, OneToOneField
+    from entity_ensurer import EntityEnsurer
+
+    server_config = nailgun.config.ServerConfig(url='http://localhost')
+    fields_cache = {}
+    compiled = []
+    refs = {}
+    errors = []
+    for num, declaration in enumerate(declarations, 1):
+        where = '{} declaration #{}'.format(path, num)
+        if not isinstance(declaration, dict):
+            errors.append('{}: not a mapping'.format(where))
+            continue
+        attrs = dict(declaration)
+        class_name = attrs.pop('entity', None)
+        ref = attrs.pop('ref', None)
+        entity_cls = getattr(nailgun.entities, str(class_name), None)
+        if not isinstance(entity_cls, type) or \
+                not issubclass(entity_cls, nailgun.entities.Entity):
+            errors.append(
+                '{}: unknown entity class: {}'.format(where, class_name)
+            )
+            continue
+        if class_name not in fields_cache:
+            try:
+                EntityEnsurer(entity_cls)
+                fields_cache[class_name] = \
+                    entity_cls(server_config).get_fields()
+            except TypeError:
+                fields_cache[class_name] = None
+        fields = fields_cache[class_name]
+        if fields is None:
+            errors.append('{}: {} entities can not be ensured'.format(
+                where, class_name
+            ))
+            continue
+        for attr, value in attrs.iteritems():
+            if attr not in fields:
+                errors.append(
+                    "{}: entities of type '{}' do not have an '{}' attribute"
+                    .format(where, class_name, attr)
+                )
+                continue
+            field = fields[attr]
+            try:
+                attrs[attr] = _compile_value(
+                    value, refs,
+                    link=isinstance(field, (OneToOneField, OneToManyField)),
+                    many=isinstance(field, OneToManyField),
+                )
+            except ValueError as error:
+                errors.append('{}: {}: {}'.format(where, attr, error))
+        if ref is not None:
+            if ref in refs:
+                errors.append('{}: duplicate ref: {}'.format(where, ref))
+            refs[ref] = len(compiled)
+        compiled.append((class_name, attrs))
+    if errors:
+        raise ValueError(
+            'Invalid configuration:\n' + '\n'.join(errors)
+        )
+    return compiled
+
+
+def _compile_value(value, refs, link, many):
+    """Compile an attribute value, replacing links with references to the
+    declarations they link to
+
+    :param dict refs: The indices of the declarations seen so far, by ref
+    :param bool link: Wither the attribute links to other entities
+    :param bool many: Wither the attribute links to a list of entities
+    """
+    if not link:
+        if _is_ref(value):
+            raise ValueError('links are only allowed in link attributes')
+        return value
+    if many:
+        if not isinstance(value, list):
+            raise ValueError('expected a list of links')
+        return [_compile_value(item, refs, link, False) for item in value]
+    if not _is_ref(value):
+        raise ValueError('expected a link, as {{{}: <ref>}}'.format(REF_KEY))
+    try:
+        return _Ref(refs[value[REF_KEY]])
+    except KeyError:
+        raise ValueError(
+            'link to undeclared ref (refs must be declared before they are '
+            'linked to): {}'.format(value[REF_KEY])
+        )
+
+
+def _is_ref(value):
+    return isinstance(value, dict) and value.keys() == [REF_KEY]
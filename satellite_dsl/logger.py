@@ -2,5 +2,26 @@
 """Common logger for all satellite_ensurer components
 """
 import logging
+from pprint import pformat
 
 LOGGER = logging.getLogger(__name__)
+
+
+class LazyPFormat(object):
+    """A log message argument that pretty-prints the return value of a
+    function, but only if the message is actually emitted. E.g.:
+
+        LOGGER.debug('values: %s', LazyPFormat(entity.get_values))
+    """
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, *args):
+        """
+        :param callable func: The function returning the value to print
+        Other arguments are passed to the function
+        """
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return pformat(self.func(*self.args))
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""A manifest of the entities ensured by the last successful run, for
+incremental runs
+
+The manifest keeps the declaration digest and the resolved id of every entity
+a run ensured. In an incremental run, declarations whose digest is found in
+the manifest of the previous run did not change since, so their entities are
+trusted to be as they were left instead of being looked up on the server.
+Since digests include the digests of linked declarations, entities linking to
+changed declarations are ensured as well.
+
+Changes made to Satellite outside of the DSL are only caught by a full verify
+run, which ensures every entity regardless of the manifest. A full verify is
+made once the manifest was last verified longer ago than 'verify_after'.
+
+When applying a script to several servers at once, every server gets its own
+manifest file, named after the given one
+"""
+import os
+import json
+from urlparse import urlparse
+from threading import Lock
+from time import time
+
+from journal import JournalEntry
+
+from logger import LOGGER
+
+MANIFEST_FORMAT = 1
+
+_manifest = None
+
+
+class Manifest(object):
+    """The manifest of the previous run, and the one being built by the
+    current run
+    """
+    def __init__(self, path, verify_after=None):
+        """
+        :param str path: The path of the manifest file
+        :param float verify_after: The amount of seconds after which to make
+                                   a full verify run, never if None
+        """
+        self.path = path
+        self.verify_after = verify_after
+        self.previous = {}
+        self.entries = {}
+        self.verified_at = time()
+        self._lock = Lock()
+        self._load()
+
+    def find(self, digest, server):
+        """Returns the entry of an entity declaration in the manifest of the
+        previous run, if it is there and no full verify is due
+
+        :param str digest: The digest of the declaration
+        :param str server: The URL of the server the entity is ensured on
+        :rtype: JournalEntry
+        """
+        return self.previous.get((server, digest))
+
+    def record(self, digest, entity, outcome):
+        """Record an entity ensured by the current run
+
+        :param str digest: The digest of the declaration
+        :param EntityRef entity: The ensured entity
+        :param str outcome: What ensuring the entity did
+        """
+        entry = JournalEntry(
+            digest=digest,
+            server=entity._server_config.url,
+            entity_class=entity.entity_cls.__name__,
+            id=entity.id,
+            outcome=outcome,
+        )
+        with self._lock:
+            self.entries[(entry.server, digest)] = entry
+
+    def save(self):
+        """Write the manifest of the current run, replacing the file
+        atomically
+        """
+        with self._lock:
+            data = dict(
+                format=MANIFEST_FORMAT,
+                verified_at=self.verified_at,
+                entries=[entry.to_json() for entry in self.entries.values()],
+            )
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(data, manifest_file, separators=(',', ':'))
+        os.rename(tmp_path, self.path)
+
+    def _load(self):
+        """Load the manifest of the previous run, unless a full verify is due
+        """
+        try:
+            with open(self.path) as manifest_file:
+                data = json.load(manifest_file)
+        except IOError:
+            LOGGER.info('No manifest found, making a full run: %s', self.path)
+            return
+        if data.get('format') != MANIFEST_FORMAT:
+            raise ValueError(
+                'Unsupported manifest format: {}'.format(data.get('format'))
+            )
+        if self.verify_after is not None and \
+                time() - data['verified_at'] >= self.verify_after:
+            LOGGER.info('Manifest is due for verification, making a full run')
+            return
+        self.verified_at = data['verified_at']
+        for entry_json in data['entries']:
+            entry = JournalEntry(**entry_json)
+            self.previous[(entry.server, entry.digest)] = entry
+        LOGGER.info(
+            'Making an incremental run against %d entities in manifest: %s',
+            len(self.previous), self.path
+        )
+
+
+def server_manifest_path(path, url):
+    """Returns the path of the manifest of a single server, when fanning out
+    to several servers
+
+    :param str path: The path of the manifest file given by the user
+    :param str url: The URL of the server
+    :rtype: str
+    """
+    return '{}.{}'.format(path, urlparse(url).netloc.replace(':', '_'))
+
+
+def enable_incremental(path, verify_after=None):
+    """Start making incremental runs against the manifest in the given file.
+    The manifest is replaced after every successful 'apply'
+
+    :param str path: The path of the manifest file
+    :param float verify_after: The amount of seconds after which to make a
+                               full verify run, never if None
+    :rtype: Manifest
+    """
+    global _manifest
+    _manifest = Manifest(path, verify_after)
+    return _manifest
+
+
+def disable_incremental():
+    """Stop making incremental runs
+    """
+    global _manifest
+    _manifest = None
+
+
+def get_manifest():
+    """Returns the active manifest or None if runs are not incremental
+
+    :rtype: Manifest
+    """
+    return _manifest
@@ -3,11 +3,21 @@
 
 Mostly to enable searching and querying agains Satellite
 """
-from re import match
+from contextlib import contextmanager
+from re import UNICODE, match, search
+from threading import Lock
+from urllib import quote_plus
 
 import nailgun.config
 import nailgun.client
 import nailgun.entities
+from nailgun.entity_fields import OneToManyField, OneToOneField
+from nailgun.entity_mixins import EntityReadMixin, MissingValueError
+
+from entity_ref import EntityRef, entity_base_path
+from executor import in_io_pool, run_async
+from state_cache import get_state_cache
+import http_sessions
 
 try:
     # Hide ugly warning about no ssl cert verification
@@ -15,11 +25,88 @@ try:
 except AttributeError:
     pass
 
+# Send all NailGun requests, including entity reads, creates and updates,
+# through pooled keep-alive sessions
+http_sessions.install()
+
+DEFAULT_PER_PAGE = 100
+# The longest (URL encoded) search query to send, leaving room in the request
+# line for the path and other parameters within common server limits (8KiB)
+MAX_QUERY_LENGTH = 4096
+# Characters that have a meaning in search queries
+QUERY_SPECIAL_CHARS = '()"\'&|!=<>~,^'
+QUERY_KEYWORDS = ('and', 'or', 'not', 'has', 'in', 'like')
+# The JSON attributes the 'read' methods of NailGun entity classes rename
+# before populating entities, by class name
+JSON_RENAMES = {
+    'DiscoveryRule': (('search', 'search_'),),
+    'Domain': (('parameters', 'domain_parameters_attributes'),),
+    'Host': (
+        ('parameters', 'host_parameters_attributes'),
+        ('puppetclasses', 'puppet_class'),
+    ),
+    'HostGroup': (('ancestry', 'parent_id'),),
+    'Media': (('path', 'path_'),),
+    'System': (
+        ('checkin_time', 'last_checkin'),
+        ('hostCollections', 'host_collections'),
+        ('installedProducts', 'installed_products'),
+    ),
+}
+
+_default_server_config = None
+_default_server_config_lock = Lock()
+
+
+def default_server_config():
+    """Returns the default NailGun server configuration. The configuration
+    file is only read on the first call, and not when this module is imported
+
+    :rtype: nailgun.config.ServerConfig
+    """
+    global _default_server_config
+    with _default_server_config_lock:
+        if _default_server_config is None:
+            _default_server_config = nailgun.config.ServerConfig.get()
+        return _default_server_config
+
+
+def set_default_server_config(server_config):
+    """Set the server configuration to use when none is given, E.g. to apply
+    a DSL script to a server other than the NailGun default one
+
+    :param nailgun.config.ServerConfig server_config: Connection information
+    """
+    global _default_server_config
+    with _default_server_config_lock:
+        _default_server_config = server_config
+
+
+@contextmanager
+def default_server_config_replaced(server_config):
+    """A context manager that makes the given server configuration the
+    default one within its block, and restores the previous default after it
+
+    :param nailgun.config.ServerConfig server_config: Connection information
+    """
+    global _default_server_config
+    with _default_server_config_lock:
+        previous, _default_server_config = \
+            _default_server_config, server_config
+    try:
+        yield
+    finally:
+        with _default_server_config_lock:
+            _default_server_config = previous
+
 
 def entity_index(
     entity_cls,
     context={},
-    server_config=nailgun.config.ServerConfig.get()
+    server_config=None,
+    per_page=DEFAULT_PER_PAGE,
+    thin=False,
+    hydrate=False,
 ):
     """Returns all visible entities of the given entity class
 
@@ -27,20 +114,61 @@ def entity_index(
     :param str context: Addtional context parameters for the query (some
                         classes require these in order to be queried)
     :param nailgun.config.ServerConfig server_config: Connection information
+    :param int per_page: The amount of entities to fetch in each request
+    :param bool thin: Wither to ask the server to only list entity ids and
+                      names
+    :param bool hydrate: Wither to populate the entities with the fields
+                         found in the search results
     :returns: A list of objects of type 'entity_cls' ready to be read()
     """
-    entities = satellite_get_entities(
+    return list(entity_iter(
+        entity_cls=entity_cls,
+        context=context,
+        server_config=server_config,
+        per_page=per_page,
+        thin=thin,
+        hydrate=hydrate,
+    ))
+
+
+def entity_iter(
+    entity_cls,
+    context={},
+    server_config=None,
+    per_page=DEFAULT_PER_PAGE,
+    thin=False,
+    hydrate=False,
+):
+    """Iterate over all visible entities of the given entity class, fetching
+    them page by page
+
+    :param type entity_cls: The class of the entity to be listed
+    :param str context: Addtional context parameters for the query (some
+                        classes require these in order to be queried)
+    :param nailgun.config.ServerConfig server_config: Connection information
+    :param int per_page: The amount of entities to fetch in each request
+    :param bool thin: Wither to ask the server to only list entity ids and
+                      names
+    :param bool hydrate: Wither to populate the entities with the fields
+                         found in the search results
+    :returns: An iterator over objects of type 'entity_cls' ready to be read()
+    """
+    if server_config is None:
+        server_config = default_server_config()
+    return satellite_iter_entities(
         entity_cls=entity_cls,
-        query_path=entity_cls().path(),
+        query_path=entity_base_path(entity_cls, server_config),
         query_data=context,
-        server_config=server_config
+        server_config=server_config,
+        per_page=per_page,
+        thin=thin,
+        hydrate=hydrate,
     )
-    return entities
 
 
 def entity_search_by_attrs(
     entity_cls,
-    server_config=nailgun.config.ServerConfig.get(),
+    server_config=None,
     context={},
     **attrs
 ):
@@ -68,29 +196,167 @@ def entity_search_by_attrs(
 
 def build_entity_attr_query(**attrs):
     """Build a foreman query from the given attribute name and value pairs
+
+    :returns: The UTF-8 encoded query
+    :rtype: str
     """
-    query = ' and '.join(
-        '{} = {}'.format(attr, format_entity_query_value(value))
+    query = u' and '.join(
+        u'{} = {}'.format(attr, format_entity_query_value(value))
         for attr, value in attrs.iteritems()
     )
-    return query
+    return query.encode('utf-8')
 
 
 def format_entity_query_value(value):
     """Format and if needed, quote a value to be place in an entity search query
+
+    :returns: The formatted value as text
+    :rtype: unicode
     """
-    value_s = str(value)
-    if len(value_s.split()) > 1:
-        return '"{}"'.format(value_s.replace('"', '\\"'))
+    if isinstance(value, str):
+        value_s = value.decode('utf-8')
+    else:
+        value_s = unicode(value)
+    if not value_s or search(r'\s', value_s, UNICODE) or \
+            any(char in value_s for char in QUERY_SPECIAL_CHARS) or \
+            value_s.lower() in QUERY_KEYWORDS:
+        return u'"{}"'.format(
+            value_s.replace(u'\\', u'\\\\').replace(u'"', u'\\"')
+        )
     else:
         return value_s
 
 
+def build_entity_keys_query(keys):
+    """Build a foreman query matching entities by any of the given keys
+
+    :param list keys: Dictionaries of attribute name and value pairs
+    :returns: A query like '(name = a) or (name = b)'
+    :rtype: str
+    """
+    return ' or '.join(
+        '({})'.format(build_entity_attr_query(**key)) for key in keys
+    )
+
+
+def iter_entity_keys_queries(keys, max_length=MAX_QUERY_LENGTH):
+    """Split the given keys into chunks which queries built with
+    'build_entity_keys_query' stay within the given length once URL encoded
+
+    :param list keys: Dictionaries of attribute name and value pairs
+    :param int max_length: The longest query to build. A key which query is
+                           longer on its own is queried alone
+    :returns: An iterator over (list of keys, query) tuples
+    """
+    chunk = []
+    length = 0
+    for key in keys:
+        key_length = len(quote_plus(build_entity_keys_query([key])))
+        if chunk and length + len(' or ') + key_length > max_length:
+            yield chunk, build_entity_keys_query(chunk)
+            chunk = []
+            length = 0
+        if chunk:
+            length += len(' or ')
+        chunk.append(key)
+        length += key_length
+    if chunk:
+        yield chunk, build_entity_keys_query(chunk)
+
+
+def entity_search_by_keys(
+    entity_cls,
+    keys,
+    context={},
+    server_config=None,
+    hydrate=False,
+    max_query_length=MAX_QUERY_LENGTH,
+):
+    """Search satellite for many entities of the given class by their key
+    attributes, with as few queries as the query length limit allows
+
+    :param type entity_cls: The class of the entities to be searched
+    :param list keys: Dictionaries of key attribute name and value pairs
+    :param str context: Addtional context parameters for the query (some
+                        classes require these in order to be queried)
+    :param nailgun.config.ServerConfig server_config: Connection information
+    :param bool hydrate: Wither to populate the entities with the fields
+                         found in the search results
+    :param int max_query_length: The longest (URL encoded) query to send
+    :returns: A list with the list of entities found for each of the given
+              keys, in the same order
+    :rtype: list
+    """
+    if server_config is None:
+        server_config = default_server_config()
+    found = dict((entity_key(key), []) for key in keys)
+    key_attrs = set(tuple(sorted(key)) for key in keys)
+    for chunk, query in iter_entity_keys_queries(
+        _unique_keys(keys), max_query_length
+    ):
+        for ent_json in satellite_iter_results(
+            query_path=entity_base_path(entity_cls, server_config),
+            query_data=dict(context, search=query),
+            server_config=server_config,
+            per_page=max(DEFAULT_PER_PAGE, len(chunk)),
+        ):
+            # Demultiplex the results by the key attributes they match
+            for attrs in key_attrs:
+                if not all(attr in ent_json for attr in attrs):
+                    continue
+                matched = found.get(entity_key(
+                    dict((attr, ent_json[attr]) for attr in attrs)
+                ))
+                if matched is not None:
+                    matched.append(satellite_json_to_entity(
+                        ent_json, entity_cls, server_config, hydrate
+                    ))
+    return [list(found[entity_key(key)]) for key in keys]
+
+
+def _unique_keys(keys):
+    """Returns the given keys without repetitions, in the same order
+    """
+    seen = set()
+    unique = []
+    for key in keys:
+        norm_key = entity_key(key)
+        if norm_key not in seen:
+            seen.add(norm_key)
+            unique.append(key)
+    return unique
+
+
+def entity_key(key):
+    """Convert a dictionary of key attributes into a hashable key, so values
+    sent by the DSL and returned by the server compare equal (E.g. 7 and u'7')
+
+    :param dict key: Key attribute name and value pairs
+    :rtype: tuple
+    """
+    return tuple(sorted(
+        (attr, normalize_key_value(value)) for attr, value in key.iteritems()
+    ))
+
+
+def normalize_key_value(value):
+    """Normalize a key attribute value
+
+    :rtype: unicode
+    """
+    if hasattr(value, 'id'):
+        value = value.id
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
+
+
 def entity_search(
     entity_cls,
     query,
     context={},
-    server_config=nailgun.config.ServerConfig.get()
+    server_config=None,
+    hydrate=False,
 ):
     """Search satellite for entities of the given class
 
@@ -99,16 +365,21 @@ def entity_search(
     :param str context: Addtional context parameters for the query (some
                         classes require these in order to be queried)
     :param nailgun.config.ServerConfig server_config: Connection information
+    :param bool hydrate: Wither to populate the entities with the fields
+                         found in the search results
     :returns: A list of objects of type 'entity_cls' ready to be read()
     """
+    if server_config is None:
+        server_config = default_server_config()
     data = {}
     data.update(search=query)
     data.update(context)
     entities = satellite_get_entities(
         entity_cls=entity_cls,
-        query_path=entity_cls().path(),
+        query_path=entity_base_path(entity_cls, server_config),
         query_data=data,
-        server_config=server_config
+        server_config=server_config,
+        hydrate=hydrate,
     )
     return entities
 
@@ -117,7 +388,8 @@ def satellite_get_entities(
     entity_cls,
     query_path,
     query_data,
-    server_config=nailgun.config.ServerConfig.get()
+    server_config=None,
+    hydrate=False,
 ):
     """Run HTTP query against Satellite 6 and return Nailgun entities
 
@@ -127,22 +399,113 @@ def satellite_get_entities(
     :param str query_path: The API path to query against
     :param str query_data: The HTTP GET parameters to send woth the query
     :param nailgun.config.ServerConfig server_config: Connection information
-    :returns: A list on Nailgun entities
+    :param bool hydrate: Wither to populate the entities with the fields
+                         found in the search results
+    :returns: A list on Nailgun entities (EntityRef references to them
+              unless hydrated)
     :rtype: list
     """
-    json = satellite_get_response(query_path, query_data, server_config)
-    entities = satellite_json_to_entities(
-        json=json['results'],
+    return list(satellite_iter_entities(
         entity_cls=entity_cls,
+        query_path=query_path,
+        query_data=query_data,
         server_config=server_config,
+        hydrate=hydrate,
+    ))
+
+
+def satellite_iter_entities(
+    entity_cls,
+    query_path,
+    query_data,
+    server_config=None,
+    per_page=DEFAULT_PER_PAGE,
+    thin=False,
+    hydrate=False,
+):
+    """Run a paginated HTTP query against Satellite 6 and iterate over the
+    returned Nailgun entities
+
+    :param type entity_cls: The class of the entity to be returned (Not actual
+                            type matching of the query results and the class is
+                            done, this is up to the user)
+    :param str query_path: The API path to query against
+    :param str query_data: The HTTP GET parameters to send woth the query
+    :param nailgun.config.ServerConfig server_config: Connection information
+    :param int per_page: The amount of entities to fetch in each request
+    :param bool thin: Wither to ask the server to only list entity ids and
+                      names
+    :param bool hydrate: Wither to populate the entities with the fields
+                         found in the search results
+    :returns: An iterator over Nailgun entities (EntityRef references to
+              them unless hydrated)
+    """
+    for ent_json in satellite_iter_results(
+        query_path, query_data, server_config, per_page, thin
+    ):
+        yield satellite_json_to_entity(
+            ent_json, entity_cls, server_config, hydrate
+        )
+
+
+def satellite_iter_results(
+    query_path,
+    query_data={},
+    server_config=None,
+    per_page=DEFAULT_PER_PAGE,
+    thin=False,
+    prefetch=True,
+):
+    """Run a paginated HTTP query against Satellite 6 and iterate over the
+    JSON results in all pages. While the results of one page are consumed,
+    the next page is fetched in the background
+
+    :param str query_path: The API path to query against
+    :param str query_data: The HTTP GET parameters to send woth the query
+    :param nailgun.config.ServerConfig server_config: Connection information
+    :param int per_page: The amount of results to fetch in each request
+    :param bool thin: Wither to ask the server to only list entity ids and
+                      names
+    :param bool prefetch: Wither to fetch the next page in the background.
+                          Ignored when running on the shared I/O pool (E.g.
+                          from 'entity_index_async'), since waiting there on
+                          another asynchronous call can starve the pool
+    :returns: An iterator over JSON dicts
+    """
+    prefetch = prefetch and not in_io_pool()
+    page_data = dict(query_data, per_page=per_page)
+    if thin:
+        page_data.update(thin=True)
+    page = 1
+    response = satellite_get_response(
+        query_path, dict(page_data, page=page), server_config
     )
-    return entities
+    while True:
+        results = response['results']
+        total = int(response.get('subtotal', response.get('total')) or 0)
+        page_size = int(response.get('per_page') or per_page)
+        more = results and page * page_size < total
+        if more:
+            page += 1
+            next_query = \
+                (query_path, dict(page_data, page=page), server_config)
+            if prefetch:
+                next_response = satellite_get_response_async(*next_query)
+        for result in results:
+            yield result
+        if not more:
+            return
+        if prefetch:
+            response = next_response.get()
+        else:
+            response = satellite_get_response(*next_query)
 
 
 def satellite_json_to_entities(
     json,
     entity_cls,
-    server_config=nailgun.config.ServerConfig.get()
+    server_config=None,
+    hydrate=False,
 ):
     """Convert JSON data returned from satellite into Nailgun entities
 
@@ -151,11 +514,14 @@ def satellite_json_to_entities(
                             done, this is up to the user)
     :param list json: A JSON list containing entities returned from Satellite
     :param nailgun.config.ServerConfig server_config: Connection information
-    :returns: A list on Nailgun entities
+    :param bool hydrate: Wither to populate the entities with the fields
+                         found in the search results
+    :returns: A list on Nailgun entities (EntityRef references to them
+              unless hydrated)
     :rtype: list
     """
     entities = [
-        satellite_json_to_entity(ent_json, entity_cls, server_config)
+        satellite_json_to_entity(ent_json, entity_cls, server_config, hydrate)
         for ent_json in json
     ]
     return entities
@@ -164,7 +530,8 @@ def satellite_json_to_entities(
 def satellite_json_to_entity(
     json,
     entity_cls,
-    server_config=nailgun.config.ServerConfig.get()
+    server_config=None,
+    hydrate=False,
 ):
     """Convert JSON data returned from satellite into Nailgun entity
 
@@ -173,17 +540,166 @@ def satellite_json_to_entity(
                             done, this is up to the user)
     :param dict json: A JSON dict returned from Satellite
     :param nailgun.config.ServerConfig server_config: Connection information
-    :returns: A Nailgun entity (of type entity_cls)
+    :param bool hydrate: Wither to populate the entity with the fields found
+                         in the JSON data, if not a lightweight reference to
+                         the entity is returned instead
+    :returns: A Nailgun entity (of type entity_cls), or a reference to it
+    :rtype: nailgun.entities.Entity or EntityRef
+    """
+    if server_config is None:
+        server_config = default_server_config()
+    if not hydrate:
+        return EntityRef(
+            entity_cls, json['id'], json.get('name'), server_config
+        )
+    state_cache = get_state_cache()
+    if state_cache is not None and 'updated_at' in json:
+        state_cache.note_listed(
+            server_config.url,
+            entity_cls.__name__,
+            json['id'],
+            json['updated_at'],
+        )
+    return hydrate_entity(entity_cls(server_config, id=json['id']), json)
+
+
+def compact_entity(entity):
+    """Returns the values of the fields of an entity, with links to other
+    entities reduced to their ids, for keeping many entities in memory. The
+    entity can be built again with 'expand_entity'
+
+    :param nailgun.entities.Entity entity: The entity
+    :rtype: dict
+    """
+    values = entity.get_values()
+    for name, field in entity.get_fields().iteritems():
+        value = values.get(name)
+        if value is None:
+            continue
+        if isinstance(field, OneToOneField):
+            values[name] = value.id
+        elif isinstance(field, OneToManyField):
+            values[name] = tuple(item.id for item in value)
+    return values
+
+
+def expand_entity(entity_cls, values, server_config):
+    """Build an entity from values returned by 'compact_entity'
+
+    :param type entity_cls: The (nailgun) class of the entity
+    :param dict values: The values of the entity fields
+    :param nailgun.config.ServerConfig server_config: Connection information
+    :rtype: nailgun.entities.Entity
+    """
+    return entity_cls(server_config, **values)
+
+
+def hydrate_entity(entity, json):
+    """Populate an entity with the fields found in partial JSON data, such as
+    search results. Fields missing from the data are left unset, so they can
+    be told apart by looking at the entity`s 'get_values()'
+
+    The 'read' methods some entity classes override may send requests to get
+    fields the data lacks (E.g. HostGroup does on Satellite 6.1), so the data
+    is only renamed as they would (see 'JSON_RENAMES') and the base 'read'
+    method populates the entity
+
+    :param nailgun.entities.Entity entity: The entity to populate
+    :param dict json: A JSON dict returned from Satellite
+    :returns: A new populated entity or the given entity if the data could not
+              be parsed
+    :rtype: nailgun.entities.Entity
+    """
+    # NailGun sometimes renames attributes in place, so pass a copy
+    attrs = dict(json)
+    for json_name, name in JSON_RENAMES.get(type(entity).__name__, ()):
+        if json_name in attrs:
+            attrs[name] = attrs.pop(json_name)
+    try:
+        return EntityReadMixin.read(
+            entity, attrs=attrs, ignore=json_missing_fields(entity, attrs)
+        )
+    except (KeyError, MissingValueError):
+        return entity
+
+
+def read_entity(entity):
+    """Read an entity from Satellite, going through the entity state cache if
+    one is enabled.
+
+    If the entity was listed in this run with the same 'updated_at' time as
+    the cached entity, the cached data is used as is, otherwise a conditional
+    request is made so the server only sends the entity data if it does not
+    match the cached ETag
+
+    :param nailgun.entities.Entity entity: The entity to read
+    :returns: The read entity
     :rtype: nailgun.entities.Entity
     """
-    entity = entity_cls(server_config, id=json['id'])
-    return entity
+    state_cache = get_state_cache()
+    if state_cache is None:
+        return entity.read()
+    server_config = entity._server_config
+    key = (server_config.url, type(entity).__name__, entity.id)
+    cached = state_cache.get(*key)
+    if cached is not None and cached.updated_at is not None and \
+            cached.updated_at == state_cache.listed_updated_at(*key):
+        return entity.read(attrs=dict(cached.json))
+    headers = {}
+    if cached is not None and cached.etag is not None:
+        headers['If-None-Match'] = cached.etag
+    response = nailgun.client.get(
+        entity.path('self'),
+        headers=headers,
+        **server_config.get_client_kwargs()
+    )
+    if response.status_code == 304:
+        return entity.read(attrs=dict(cached.json))
+    response.raise_for_status()
+    ent_json = response.json()
+    state_cache.put(*key, ent_json=ent_json, etag=response.headers.get('ETag'))
+    return entity.read(attrs=ent_json)
+
+
+def forget_entity(entity):
+    """Remove an entity from the entity state cache if one is enabled, should
+    be called when the entity is changed
+
+    :param nailgun.entities.Entity entity: The entity to forget
+    """
+    state_cache = get_state_cache()
+    if state_cache is not None:
+        state_cache.forget(
+            entity._server_config.url, type(entity).__name__, entity.id
+        )
+
+
+def json_missing_fields(entity, json):
+    """Returns the names of the fields of the given entity for which the given
+    JSON data has no value
+
+    :param nailgun.entities.Entity entity: The entity which fields to check
+    :param dict json: A JSON dict returned from Satellite
+    :rtype: set
+    """
+    missing = set()
+    for name, field in entity.get_fields().iteritems():
+        if isinstance(field, OneToOneField):
+            json_names = (name, name + '_id')
+        elif isinstance(field, OneToManyField):
+            json_names = (name, name + 's', name + '_ids')
+        else:
+            # NailGun adds '_' to names of fields that clash with methods
+            json_names = (name, name.rstrip('_'))
+        if not any(json_name in json for json_name in json_names):
+            missing.add(name)
+    return missing
 
 
 def satellite_get_response(
     query_path,
     query_data={},
-    server_config=nailgun.config.ServerConfig.get()
+    server_config=None
 ):
     """Run HTTP query against Satellite 6
 
@@ -193,6 +709,8 @@ def satellite_get_response(
     :returns: A parsed json response data structure
     :rtype: dict
     """
+    if server_config is None:
+        server_config = default_server_config()
     if not match('https?://', query_path):
         query_path = server_config.url + '/' + query_path.strip('/')
     response = nailgun.client.get(
@@ -202,3 +720,57 @@ def satellite_get_response(
     )
     response.raise_for_status()
     return response.json()
+
+
+def entity_index_async(*args, **kwargs):
+    """Asynchronous version of 'entity_index'
+
+    :returns: An object which 'get' method returns the list of entities
+    :rtype: multiprocessing.pool.AsyncResult
+    """
+    return run_async(entity_index, *args, **kwargs)
+
+
+def entity_search_by_attrs_async(*args, **kwargs):
+    """Asynchronous version of 'entity_search_by_attrs'
+
+    :returns: An object which 'get' method returns the list of entities
+    :rtype: multiprocessing.pool.AsyncResult
+    """
+    return run_async(entity_search_by_attrs, *args, **kwargs)
+
+
+def entity_search_by_keys_async(*args, **kwargs):
+    """Asynchronous version of 'entity_search_by_keys'
+
+    :returns: An object which 'get' method returns the lists of entities
+    :rtype: multiprocessing.pool.AsyncResult
+    """
+    return run_async(entity_search_by_keys, *args, **kwargs)
+
+
+def entity_search_async(*args, **kwargs):
+    """Asynchronous version of 'entity_search'
+
+    :returns: An object which 'get' method returns the list of entities
+    :rtype: multiprocessing.pool.AsyncResult
+    """
+    return run_async(entity_search, *args, **kwargs)
+
+
+def satellite_get_entities_async(*args, **kwargs):
+    """Asynchronous version of 'satellite_get_entities'
+
+    :returns: An object which 'get' method returns the list of entities
+    :rtype: multiprocessing.pool.AsyncResult
+    """
+    return run_async(satellite_get_entities, *args, **kwargs)
+
+
+def satellite_get_response_async(*args, **kwargs):
+    """Asynchronous version of 'satellite_get_response'
+
+    :returns: An object which 'get' method returns the parsed json response
+    :rtype: multiprocessing.pool.AsyncResult
+    """
+    return run_async(satellite_get_response, *args, **kwargs)
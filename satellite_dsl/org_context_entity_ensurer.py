@@ -22,3 +22,14 @@ class OrgContextEntityEnsurer(EntityEnsurer):
                 "Missing entity search context attibute: {}"
                 .format(kerr.args[0])
             )
+
+    def snapshot_contexts(self, entity_cls, organizations):
+        """Returns the search contexts in which entities of the given class
+        should be listed when taking a snapshot of a Satellite server
+
+        :param type entity_cls: The class of the entities
+        :param list organizations: The organizations found on the server
+        :returns: A context for every organization
+        :rtype: list
+        """
+        return [{'organization_id': org.id} for org in organizations]
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Reporting of what ensuring each entity ended up doing
+
+Ensurers report an outcome for every entity they ensure, and listeners added
+with 'add_outcome_listener' are called with it (E.g. to show progress)
+"""
+from threading import Lock, local
+
+UNCHANGED = 'unchanged'
+CREATED = 'created'
+UPDATED = 'updated'
+# Entities trusted to be as a journal of a previous run says
+RESUMED = 'resumed'
+# Entities which declarations did not change since the last incremental run
+SKIPPED = 'skipped'
+
+_listeners = []
+_listeners_lock = Lock()
+_current = local()
+
+
+def add_outcome_listener(listener):
+    """Add a function to be called with the outcome of every ensured entity
+
+    :param callable listener: A function that is called with the outcome
+                              (One of UNCHANGED, CREATED, UPDATED, RESUMED
+                              or SKIPPED) and the
+                              ensured entity. It may be called from several
+                              threads at the same time
+    """
+    with _listeners_lock:
+        _listeners.append(listener)
+
+
+def remove_outcome_listener(listener):
+    """Stop calling a function added with 'add_outcome_listener'
+
+    :param callable listener: The function
+    """
+    with _listeners_lock:
+        _listeners.remove(listener)
+
+
+def report_outcome(outcome, entity):
+    """Report the outcome of ensuring an entity to all listeners
+
+    :param str outcome: One of UNCHANGED, CREATED, UPDATED, RESUMED or
+                        SKIPPED
+    :param nailgun.entities.Entity entity: The ensured entity
+    """
+    _current.outcome = outcome
+    with _listeners_lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        listener(outcome, entity)
+
+
+def take_last_outcome():
+    """Returns the last outcome reported by the current thread since the last
+    call, or None
+
+    :rtype: str
+    """
+    outcome = getattr(_current, 'outcome', None)
+    _current.outcome = None
+    return outcome
+
+
+class OutcomeCounter(object):
+    """An outcome listener that counts the outcomes it is called with
+    """
+    def __init__(self):
+        self.counts = {}
+        self._lock = Lock()
+
+    def __call__(self, outcome, entity):
+        with self._lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
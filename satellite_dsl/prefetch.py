@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""An in-memory index of Satellite entities used for finding entities by
+their key attributes without sending a search query for each entity
+"""
+from threading import Lock
+
+from entity_ref import entity_base_path
+from nailgun_hacks import (
+    compact_entity,
+    default_server_config,
+    entity_key,
+    entity_search_by_keys,
+    expand_entity,
+    normalize_key_value,
+    satellite_iter_results,
+    satellite_json_to_entity,
+)
+
+from logger import LOGGER
+
+
+class PrefetchIndex(object):
+    """An index of entities, that lists all the entities of a given class
+    within a given search context once, and then answers lookups by key
+    attributes from memory.
+
+    The key attributes of each entity are determined by the ensurer the entity
+    is looked up with, so composite keys (like the name, major and minor
+    attributes of OperatingSystem entities) are supported
+
+    Only the field values of listed entities are kept, with links reduced to
+    ids, and entities are only built from them when they are looked up.
+    Listings are kept until the index is cleared, which 'apply' does once it
+    is done so changes made to Satellite between runs are seen
+
+    Entities of classes too big to list whole can be searched for in batches
+    by their keys instead, with 'search_keys', and the results are kept until
+    taken with 'take_searched'
+    """
+    def __init__(self):
+        self._indexes = {}
+        self._searched = {}
+        self._load_locks = {}
+        self._lock = Lock()
+
+    def find(
+        self,
+        ensurer,
+        entity_cls,
+        key,
+        context,
+        server_config=None
+    ):
+        """Find entities by their key attributes
+
+        :param EntityEnsurer ensurer: The ensurer for the entity class
+        :param type entity_cls: The class of entity to look for
+        :param dict key: The key attributes of the entity
+        :param dict context: The search context of the entity
+        :param nailgun.config.ServerConfig server_config: Connection
+                                                          information
+        :returns: A list of the found entities
+        :rtype: list
+        """
+        if server_config is None:
+            server_config = default_server_config()
+        index = self._get_index(ensurer, entity_cls, context, server_config)
+        with self._lock:
+            found = list(index.get(entity_key(key), ()))
+        return [
+            expand_entity(entity_cls, values, server_config)
+            for values in found
+        ]
+
+    def update(
+        self,
+        ensurer,
+        entity_cls,
+        attrs,
+        entity,
+        server_config=None
+    ):
+        """Update the index with an entity that was created or updated. Does
+        nothing if the entities of the given class and context were not
+        listed yet (As listing them would include the entity). Only the id of
+        the entity is kept, so it is read if it is looked up again
+
+        :param EntityEnsurer ensurer: The ensurer for the entity class
+        :param type entity_cls: The class of the entity
+        :param dict attrs: The attributes the entity was ensured with
+        :param nailgun.entities.Entity entity: The entity
+        :param nailgun.config.ServerConfig server_config: Connection
+                                                          information
+        """
+        if server_config is None:
+            server_config = default_server_config()
+        index_id = _index_id(
+            entity_cls, ensurer.extract_context(attrs), server_config
+        )
+        key = entity_key(ensurer.extract_key_attrs(attrs))
+        with self._lock:
+            index = self._indexes.get(index_id)
+            if index is not None:
+                index[key] = [dict(id=entity.id)]
+
+    def search_keys(
+        self,
+        ensurer,
+        entity_cls,
+        attrs_list,
+        server_config=None
+    ):
+        """Search for many entities of the given class at once, by the keys
+        in the given attributes, so later lookups of the entities can be
+        answered with 'take_searched' instead of searching for each one
+
+        :param EntityEnsurer ensurer: The ensurer for the entity class
+        :param type entity_cls: The class of the entities
+        :param list attrs_list: The attributes the entities are to be ensured
+                                with
+        :param nailgun.config.ServerConfig server_config: Connection
+                                                          information
+        """
+        if server_config is None:
+            server_config = default_server_config()
+        by_context = {}
+        for attrs in attrs_list:
+            context = ensurer.extract_context(attrs)
+            by_context.setdefault(
+                _index_id(entity_cls, context, server_config), (context, [])
+            )[1].append(ensurer.extract_key_attrs(attrs))
+        for index_id, (context, keys) in by_context.iteritems():
+            LOGGER.debug(
+                'Searching for %d %s entities in context: %s',
+                len(keys), entity_cls.__name__, context
+            )
+            found = entity_search_by_keys(
+                entity_cls, keys, context, server_config, hydrate=True
+            )
+            with self._lock:
+                for key, entities in zip(keys, found):
+                    self._searched[(index_id, entity_key(key))] = entities
+
+    def take_searched(
+        self,
+        ensurer,
+        entity_cls,
+        key,
+        context,
+        server_config=None
+    ):
+        """Returns the entities found for the given key by 'search_keys', and
+        forget them so the next lookup of the key searches again
+
+        :param EntityEnsurer ensurer: The ensurer for the entity class
+        :param type entity_cls: The class of entity to look for
+        :param dict key: The key attributes of the entity
+        :param dict context: The search context of the entity
+        :param nailgun.config.ServerConfig server_config: Connection
+                                                          information
+        :returns: A list of the found entities, or None if the key was not
+                  searched for
+        :rtype: list
+        """
+        if server_config is None:
+            server_config = default_server_config()
+        with self._lock:
+            return self._searched.pop(
+                (_index_id(entity_cls, context, server_config),
+                 entity_key(key)),
+                None
+            )
+
+    def clear(self):
+        """Drop all the listed entities, so they are listed again on the next
+        lookup
+        """
+        with self._lock:
+            self._indexes.clear()
+            self._searched.clear()
+
+    def _get_index(self, ensurer, entity_cls, context, server_config):
+        """Returns the index of the entities of the given class in the given
+        context, listing them if they were not listed yet. The entities of
+        each class and context are only listed once, even if they are looked
+        up by many threads at the same time
+        """
+        index_id = _index_id(entity_cls, context, server_config)
+        with self._lock:
+            try:
+                return self._indexes[index_id]
+            except KeyError:
+                load_lock = self._load_locks.setdefault(index_id, Lock())
+        with load_lock:
+            with self._lock:
+                if index_id in self._indexes:
+                    return self._indexes[index_id]
+            index = self._load_index(
+                ensurer, entity_cls, context, server_config
+            )
+            with self._lock:
+                self._indexes[index_id] = index
+            return index
+
+    def _load_index(self, ensurer, entity_cls, context, server_config):
+        """List all the entities of the given class in the given context and
+        index them by their key attributes
+
+        :rtype: dict
+        """
+        LOGGER.debug(
+            'Listing %s entities in context: %s', entity_cls.__name__, context
+        )
+        index = {}
+        for ent_json in satellite_iter_results(
+            query_path=entity_base_path(entity_cls, server_config),
+            query_data=context,
+            server_config=server_config,
+        ):
+            try:
+                key = ensurer.extract_key_attrs(ent_json)
+            except TypeError:
+                # The listing is missing the key attributes
+                continue
+            index.setdefault(entity_key(key), []).append(compact_entity(
+                satellite_json_to_entity(
+                    ent_json, entity_cls, server_config, hydrate=True
+                )
+            ))
+        return index
+
+
+def _index_id(entity_cls, context, server_config):
+    """Returns the identifier of the index for the given entity class and
+    context
+    """
+    return (
+        server_config.url,
+        entity_cls,
+        tuple(sorted(
+            (attr, normalize_key_value(value))
+            for attr, value in context.iteritems()
+        )),
+    )
+
+
+PREFETCH_INDEX = PrefetchIndex()
@@ -10,7 +10,10 @@ from nailgun_hacks import (
 )
 
 from entity_ensurer import EntityEnsurer
+from entity_ref import EntityRef
 from org_context_entity_ensurer import OrgContextEntityEnsurer
+from outcomes import UNCHANGED, report_outcome
+from subscription_catalog import SUBSCRIPTION_CATALOG
 
 
 # The code in the class below is mostly ment as a workaround for:
@@ -45,50 +48,77 @@ class ProductEnsurer(OrgContextEntityEnsurer):
                   is an entity object - this is subject to change)
         """
         if 'subscription' in attrs:
-            return self.ensure_in_context(self, **attrs)
+            return self.ensure_in_context(**attrs)
         else:
             return super(type(self), self).ensure(entity_cls, **attrs)
 
-    def ensure_in_context(self, subscription, name):
+    def ensure_in_context(self, subscription, name, organization=None):
         """Ensure that a Product with the given name exists in the given
         subscription
 
+        The product is looked up in the shared subscription catalog, so all the
+        subscriptions of the organization are listed once instead of reading
+        every subscription products are looked up in
+
         :param str name: The product name
         :param nailgun.entities.Subscription subscription: The subscription for
                                                            the product
+        :param nailgun.entities.Organization organization: The organization of
+                                                           the subscription,
+                                                           looked up from the
+                                                           subscription if not
+                                                           given
         :rturns: An entity representing the product (an exception is raised
                  if no matching product is found)
         :rtype: nailgun.entities.Product
         """
-        try:
-            self._products_in_subscriptions
-        except AttributeError:
-            self._products_in_subscriptions = {}
-        try:
-            return self._products_in_subscriptions.setdefault(
-                subscription.id,
-                self._get_products_in_subscription(subscription)
-            )[name]
-        except KeyError:
+        server_config = subscription._server_config
+        if organization is None and not isinstance(subscription, EntityRef):
+            organization = getattr(subscription, 'organization', None)
+        if organization is None:
+            # References to ensured subscriptions do not hold their
+            # organization, but it is known if it was listed already
+            org_id = SUBSCRIPTION_CATALOG.organization_of(
+                subscription.id, server_config
+            )
+        else:
+            org_id = organization.id
+        if org_id is None:
+            prod_json = self._get_product_in_subscription(subscription, name)
+        else:
+            prod_json = SUBSCRIPTION_CATALOG.provided_product(
+                org_id, subscription.id, name, server_config
+            )
+        if prod_json is None:
             raise KeyError(
                 'Product in: {} with name: {} not found'
-                .format(self.format_entity(subscription, name))
+                .format(self.format_entity(subscription), name)
             )
+        product = satellite_json_to_entity(
+            prod_json, nailgun.entities.Product, server_config
+        )
+        report_outcome(UNCHANGED, product)
+        return product
 
-    def _get_products_in_subscription(self, subscription):
-        """Returns a dictionariy mapping product names to Product entities for
-        the products in the given subscription
+    def _get_product_in_subscription(self, subscription, name):
+        """Returns the JSON data of a product in a subscription of an unknown
+        organization. The subscription is read to find its organization so its
+        products can be looked up in the catalog, and if Satellite does not
+        say which organization it belongs to, the products it lists are used
 
         :param nailgun.entities.Subscription subscription: The subscription
+        :param str name: The product name
         :rtype: dict
         """
+        server_config = subscription._server_config
         path = 'katello/api/v2/subscriptions/{}'.format(subscription.id)
-        subscription_json = satellite_get_response(path)
-        name_dict = dict(
-            (
-                prod_json['name'],
-                satellite_json_to_entity(prod_json, nailgun.entities.Product)
+        subscription_json = satellite_get_response(path, {}, server_config)
+        org_id = (subscription_json.get('organization') or {}).get('id') \
+            or subscription_json.get('organization_id')
+        if org_id is not None:
+            return SUBSCRIPTION_CATALOG.provided_product(
+                org_id, subscription.id, name, server_config
             )
-            for prod_json in subscription_json['provided_products']
-        )
-        return name_dict
+        for prod_json in subscription_json.get('provided_products') or ():
+            if prod_json['name'] == name:
+                return prod_json
@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+"""Running DSL scripts, either against a single Satellite server or against
+many servers at the same time
+
+When fanning out to many servers, the script is run once for every server in
+a separate worker process, with that server set as the default one, so the
+whole run takes about as long as the slowest server
+"""
+import sys
+import runpy
+import traceback
+from argparse import ArgumentParser
+from collections import namedtuple
+from multiprocessing import Manager, Pool
+from Queue import Empty
+from time import time
+
+from logger import LOGGER
+
+PROGRESS_INTERVAL = 5
+
+ServerResult = namedtuple(
+    'ServerResult', ('server', 'outcomes', 'writes', 'error', 'wall_time')
+)
+
+
+def run_script(script):
+    """Run a DSL script as if it was the main program. Configuration files
+    (see 'loader') are loaded and applied instead. Entities the script
+    declared but did not apply (as scripts written before 'ensure' was
+    deferred do) are applied once it ends
+
+    :param str script: The path of the script
+    """
+    import satellite_dsl
+    from loader import is_config_file
+
+    if is_config_file(script):
+        from loader import load_config
+
+        load_config(script, satellite_dsl.ensure)
+        satellite_dsl.apply()
+        return
+    try:
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit as exit:
+        if exit.code:
+            raise
+    applied = satellite_dsl.apply()
+    if applied:
+        LOGGER.warning(
+            'Applied %d entities %s declared without applying them',
+            len(applied), script
+        )
+
+
+def fan_out(
+    script,
+    server_configs,
+    processes=None,
+    progress=None,
+    max_writes=None,
+    manifest=None,
+    verify_after=None,
+):
+    """Apply a DSL script to several Satellite servers in parallel, each in
+    its own worker process
+
+    :param str script: The path of the script
+    :param list server_configs: The nailgun.config.ServerConfig objects of the
+                                servers to apply the script to
+    :param int processes: The maximal amount of servers to work on at the
+                          same time, defaults to all of them
+    :param callable progress: A function that is called with the server URL
+                              and a dictionary counting the outcomes of the
+                              entities ensured so far on it whenever an entity
+                              is ensured. Progress is logged every
+                              PROGRESS_INTERVAL seconds if not given
+    :param int max_writes: The maximal amount of writes to send to each server
+                           at the same time, defaults to the current limit
+    :param str manifest: The path to keep the manifests of incremental runs
+                         at, each server gets its own manifest file next to
+                         it. Defaults to the path of the active manifest if
+                         runs are incremental
+    :param float verify_after: The amount of seconds after which to make a
+                               full verify run, used with 'manifest'
+    :returns: A ServerResult for every server, in the given order
+    :rtype: list
+    """
+    from manifest import get_manifest
+
+    if not server_configs:
+        LOGGER.warning('No servers to apply %s to', script)
+        return []
+    if progress is None:
+        progress = _ProgressLogger()
+    if manifest is None and get_manifest() is not None:
+        manifest = get_manifest().path
+        verify_after = get_manifest().verify_after
+    manager = Manager()
+    try:
+        queue = manager.Queue()
+        pool = Pool(
+            processes or len(server_configs), _init_worker, (max_writes,)
+        )
+        try:
+            async_results = [
+                pool.apply_async(_apply_script, (
+                    script, server_config, queue, manifest, verify_after
+                ))
+                for server_config in server_configs
+            ]
+            pool.close()
+            counts = dict(
+                (server_config.url, {}) for server_config in server_configs
+            )
+            while True:
+                done = all(result.ready() for result in async_results)
+                try:
+                    server, outcome = queue.get(timeout=0.5)
+                except Empty:
+                    if done:
+                        break
+                    continue
+                counts[server][outcome] = counts[server].get(outcome, 0) + 1
+                progress(server, counts[server])
+            results = [result.get() for result in async_results]
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        manager.shutdown()
+    log_results(results)
+    return results
+
+
+def log_results(results):
+    """Log a summary of the results of applying a script to several servers
+
+    :param list results: A list of ServerResult objects
+    """
+    from write_scheduler import summarize_writes
+
+    totals = {}
+    for result in results:
+        for outcome, count in result.outcomes.iteritems():
+            totals[outcome] = totals.get(outcome, 0) + count
+        for write in result.writes:
+            if write.error:
+                LOGGER.error(
+                    '%s: writing %s "%s" failed: %s',
+                    result.server, write.entity_class, write.name, write.error
+                )
+        if result.error:
+            LOGGER.error('%s failed:\n%s', result.server, result.error)
+        else:
+            LOGGER.info(
+                '%s done in %.1fs: %s, %s',
+                result.server, result.wall_time,
+                _format_counts(result.outcomes),
+                summarize_writes(result.writes),
+            )
+    LOGGER.info(
+        '%d/%d servers succeeded, %s',
+        sum(1 for result in results if not result.error), len(results),
+        _format_counts(totals)
+    )
+
+
+class _ProgressLogger(object):
+    """Logs the progress of every server at most once in PROGRESS_INTERVAL
+    seconds
+    """
+    def __init__(self):
+        self._last_logged = {}
+
+    def __call__(self, server, counts):
+        now = time()
+        if now - self._last_logged.get(server, 0) >= PROGRESS_INTERVAL:
+            self._last_logged[server] = now
+            LOGGER.info('%s: %s', server, _format_counts(counts))
+
+
+def _format_counts(counts):
+    """Format a dictionary of outcome counts for display
+    """
+    return '{} entities ensured ({})'.format(
+        sum(counts.itervalues()),
+        ', '.join(
+            '{} {}'.format(count, outcome)
+            for outcome, count in sorted(counts.iteritems())
+        ) or 'none',
+    )
+
+
+def _init_worker(max_writes=None):
+    """Drop state the worker process inherited from its parent, that can not
+    be shared with it
+    """
+    from executor import forget_io_pool
+    from governor import forget_governors
+    from state_cache import reopen_state_cache
+    from http_sessions import close_sessions
+    from prefetch import PREFETCH_INDEX
+    from subscription_catalog import SUBSCRIPTION_CATALOG
+    from write_scheduler import WRITE_SCHEDULER
+
+    forget_io_pool()
+    forget_governors()
+    reopen_state_cache()
+    close_sessions()
+    PREFETCH_INDEX.clear()
+    SUBSCRIPTION_CATALOG.clear()
+    WRITE_SCHEDULER.clear()
+    if max_writes is not None:
+        WRITE_SCHEDULER.set_max_writes(max_writes)
+
+
+def _apply_script(script, server_config, queue, manifest, verify_after):
+    """Apply a DSL script to a server, runs in a worker process
+
+    :param str manifest: The path the server manifest path is derived from,
+                         None if runs are not incremental
+    :returns: The result of applying the script
+    :rtype: ServerResult
+    """
+    from manifest import enable_incremental, server_manifest_path
+    from nailgun_hacks import set_default_server_config
+    from outcomes import OutcomeCounter, add_outcome_listener
+    from write_scheduler import WRITE_SCHEDULER
+
+    set_default_server_config(server_config)
+    if manifest is not None:
+        enable_incremental(
+            server_manifest_path(manifest, server_config.url), verify_after
+        )
+    counter = OutcomeCounter()
+    add_outcome_listener(counter)
+    add_outcome_listener(
+        lambda outcome, entity: queue.put((server_config.url, outcome))
+    )
+    WRITE_SCHEDULER.record_results()
+    start = time()
+    try:
+        run_script(script)
+        error = None
+    except BaseException:
+        error = traceback.format_exc()
+    return ServerResult(
+        server=server_config.url,
+        outcomes=counter.counts,
+        writes=WRITE_SCHEDULER.take_results(),
+        error=error,
+        wall_time=time() - start,
+    )
+
+
+def main(argv=None):
+    """Command line interface for applying and planning DSL scripts and
+    taking snapshots
+    """
+    import logging
+    import nailgun.config
+    from snapshot import plan, take_snapshot
+    from governor import set_rate_limit
+    from journal import enable_journal
+    from manifest import enable_incremental
+    from write_scheduler import (
+        WRITE_SCHEDULER,
+        set_max_writes,
+        summarize_writes,
+    )
+
+    parser = ArgumentParser(
+        description='Apply DSL scripts to Satellite servers, or plan them '
+        'offline from snapshots'
+    )
+    commands = parser.add_subparsers(dest='command')
+    apply_cmd = commands.add_parser(
+        'apply', help='Apply a DSL script to one or more servers'
+    )
+    apply_cmd.add_argument(
+        'script', help='The DSL script or configuration file to apply'
+    )
+    apply_cmd.add_argument(
+        'servers', nargs='*', metavar='LABEL',
+        help='Labels of servers in the NailGun configuration file, the '
+        'default server is used if none are given'
+    )
+    apply_cmd.add_argument(
+        '--processes', type=int,
+        help='The maximal amount of servers to work on at the same time'
+    )
+    apply_cmd.add_argument(
+        '--journal', metavar='PATH',
+        help='Journal the ensured entities in the given file'
+    )
+    apply_cmd.add_argument(
+        '--resume', action='store_true',
+        help='Trust the entities already in the journal, to resume a run '
+        'that failed'
+    )
+    apply_cmd.add_argument(
+        '--manifest', metavar='PATH',
+        help='Only ensure the entities which declarations changed since the '
+        'last successful run, as recorded in the given manifest file'
+    )
+    apply_cmd.add_argument(
+        '--verify-after', type=float, metavar='SECONDS',
+        help='Ensure all the entities if the manifest was last verified '
+        'longer ago than this'
+    )
+    apply_cmd.add_argument(
+        '--rate-limit', type=float,
+        help='The maximal amount of requests to send to each server per '
+        'second'
+    )
+    apply_cmd.add_argument(
+        '--max-writes', type=int,
+        help='The maximal amount of writes to send to each server at the '
+        'same time'
+    )
+    snapshot_cmd = commands.add_parser(
+        'snapshot', help='Write a snapshot of the Satellite inventory'
+    )
+    snapshot_cmd.add_argument('output', help='The snapshot file to write')
+    snapshot_cmd.add_argument(
+        '--no-read', dest='read', action='store_false',
+        help='Only keep the data found in search results'
+    )
+    plan_cmd = commands.add_parser(
+        'plan', help='Evaluate a DSL script against a snapshot'
+    )
+    plan_cmd.add_argument('snapshot', help='The snapshot file to use')
+    plan_cmd.add_argument(
+        'script', help='The DSL script or configuration file to evaluate'
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig()
+    LOGGER.setLevel(logging.INFO)
+    if args.command == 'apply':
+        if args.max_writes is not None:
+            set_max_writes(args.max_writes)
+        if args.rate_limit is not None:
+            set_rate_limit(args.rate_limit)
+        if args.journal:
+            enable_journal(args.journal, resume=args.resume)
+        elif args.resume:
+            parser.error('--resume requires --journal')
+        if args.manifest and not args.servers:
+            enable_incremental(args.manifest, args.verify_after)
+        if not args.servers:
+            WRITE_SCHEDULER.record_results()
+            try:
+                run_script(args.script)
+            finally:
+                writes = WRITE_SCHEDULER.take_results()
+                for write in writes:
+                    if write.error:
+                        LOGGER.error(
+                            'Writing %s "%s" failed: %s',
+                            write.entity_class, write.name, write.error
+                        )
+                LOGGER.info('Done: %s', summarize_writes(writes))
+            return
+        results = fan_out(
+            args.script,
+            [nailgun.config.ServerConfig.get(label) for label in args.servers],
+            processes=args.processes,
+            max_writes=args.max_writes,
+            manifest=args.manifest,
+            verify_after=args.verify_after,
+        )
+        return 1 if any(result.error for result in results) else 0
+    elif args.command == 'snapshot':
+        take_snapshot(args.output, read=args.read)
+    else:
+        script_plan = plan(args.script, args.snapshot)
+        for change in script_plan.changes:
+            print '{} {} {}'.format(
+                change.action, change.path, change.name or change.id
+            )
+        print script_plan.summary()
+
+
+if __name__ == '__main__':
+    sys.exit(main() or 0)
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+"""Snapshots of the Satellite inventory and an offline plan mode
+
+A snapshot is a gzipped file of JSON lines, the first describes the snapshot
+and every other one holds the JSON data of a single entity along with its API
+path and the search context it was listed in.
+
+In plan mode the requests NailGun makes are answered in-process from a
+snapshot instead of being sent to Satellite, so a DSL script can be evaluated
+without touching the server. Entities the script would create or update are
+only changed in memory and recorded in a 'Plan'
+"""
+import json
+import gzip
+from collections import deque, namedtuple
+from contextlib import closing, contextmanager
+from datetime import datetime
+from httplib import responses
+from threading import Lock
+from urlparse import urlparse, parse_qsl
+
+import nailgun.config
+import nailgun.entities
+from nailgun.entity_mixins import EntityReadMixin, EntitySearchMixin
+import requests
+import requests.adapters
+from requests import HTTPError
+from requests.structures import CaseInsensitiveDict
+
+from entity_ensurer import EntityEnsurer
+from entity_store import EntityStore, request_params
+from nailgun_hacks import (
+    default_server_config,
+    default_server_config_replaced,
+    entity_index,
+    satellite_get_response_async,
+    satellite_iter_results,
+)
+from http_sessions import mount_adapter, unmount_adapter
+from prefetch import PREFETCH_INDEX
+from runner import run_script
+from state_cache import state_cache_suspended
+from subscription_catalog import SUBSCRIPTION_CATALOG
+
+from logger import LOGGER
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_PER_PAGE = 1000
+# The most entity reads to have in flight at once while taking a snapshot
+SNAPSHOT_READS_IN_FLIGHT = 32
+# Content classes that are not managed with the DSL and can be huge
+SKIPPED_CLASSES = frozenset([
+    'Errata',
+    'ForemanTask',
+    'Package',
+    'Permission',
+    'PuppetModule',
+])
+
+
+def snapshot_classes():
+    """Returns the entity classes a snapshot includes by default, which are
+    the searchable classes that have an ensurer
+
+    :rtype: list
+    """
+    server_config = nailgun.config.ServerConfig(url='http://localhost')
+    classes = {}
+    for entity_cls in vars(nailgun.entities).itervalues():
+        if not (
+            isinstance(entity_cls, type) and
+            issubclass(entity_cls, EntitySearchMixin) and
+            issubclass(entity_cls, EntityReadMixin) and
+            entity_cls.__name__ not in SKIPPED_CLASSES
+        ):
+            continue
+        try:
+            EntityEnsurer(entity_cls)
+            api_path = entity_cls(server_config)._meta['api_path']
+        except Exception:
+            # No ensurer, or more parameters are needed to build a path
+            continue
+        # Abstract classes share their API path with their subclasses
+        if api_path not in classes or \
+                issubclass(classes[api_path], entity_cls):
+            classes[api_path] = entity_cls
+    return sorted(classes.itervalues(), key=lambda cls: cls.__name__)
+
+
+def take_snapshot(
+    path,
+    server_config=None,
+    entity_classes=None,
+    read=True,
+):
+    """Write a snapshot of the entities in a Satellite server to a file
+
+    :param str path: The path of the snapshot file
+    :param nailgun.config.ServerConfig server_config: Connection information
+    :param list entity_classes: The classes of entities to include, defaults
+                                to 'snapshot_classes()'
+    :param bool read: Wither to read every entity instead of only keeping the
+                      data found in search results. Reading is slower but
+                      spares reads in plan mode
+    :returns: The amount of entities in the snapshot
+    :rtype: int
+    """
+    if server_config is None:
+        server_config = default_server_config()
+    if entity_classes is None:
+        entity_classes = snapshot_classes()
+    organizations = entity_index(
+        nailgun.entities.Organization, server_config=server_config
+    )
+    count = 0
+    with closing(gzip.open(path, 'wb')) as snapshot:
+        _write_line(snapshot, dict(
+            format=SNAPSHOT_FORMAT,
+            server=server_config.url,
+            taken_at=datetime.utcnow().isoformat(),
+        ))
+        for entity_cls in entity_classes:
+            entity = entity_cls(server_config)
+            contexts = EntityEnsurer(entity_cls).snapshot_contexts(
+                entity_cls, organizations
+            )
+            for context in contexts:
+                try:
+                    for ent_json in _iter_entities(
+                        entity.path('base'), context, server_config, read
+                    ):
+                        _write_line(snapshot, dict(
+                            path=entity._meta['api_path'],
+                            context=context,
+                            json=ent_json,
+                        ))
+                        count += 1
+                except HTTPError as httpe:
+                    LOGGER.warning(
+                        'Skipping %s entities in context %s: %s',
+                        entity_cls.__name__, context, httpe
+                    )
+    LOGGER.info('Wrote %d entities to snapshot: %s', count, path)
+    return count
+
+
+def _iter_entities(base_path, context, server_config, read):
+    """Iterate over the entities in the given API path and context as their
+    pages are listed. If 'read' is True, the listed entities are read
+    concurrently, with up to SNAPSHOT_READS_IN_FLIGHT reads in flight
+
+    :rtype: generator
+    """
+    listed = satellite_iter_results(
+        query_path=base_path,
+        query_data=context,
+        server_config=server_config,
+        per_page=SNAPSHOT_PER_PAGE,
+    )
+    if not read:
+        for ent_json in listed:
+            yield ent_json
+        return
+    reads = deque()
+    for ent_json in listed:
+        reads.append((ent_json, satellite_get_response_async(
+            '{}/{}'.format(base_path, ent_json['id']), {}, server_config
+        )))
+        if len(reads) >= SNAPSHOT_READS_IN_FLIGHT:
+            yield _read_result(*reads.popleft())
+    while reads:
+        yield _read_result(*reads.popleft())
+
+
+def _read_result(ent_json, ent_read):
+    """Returns the JSON data of a read entity, or its listed data if reading
+    it failed
+    """
+    try:
+        return ent_read.get()
+    except HTTPError as httpe:
+        LOGGER.debug('Keeping listed data of #%s: %s', ent_json['id'], httpe)
+        return ent_json
+
+
+def _write_line(snapshot, data):
+    snapshot.write(json.dumps(data, separators=(',', ':')))
+    snapshot.write('\n')
+
+
+def load_snapshot(path):
+    """Load a snapshot file into an entity store
+
+    :param str path: The path of the snapshot file
+    :rtype: EntityStore
+    """
+    with closing(gzip.open(path, 'rb')) as snapshot:
+        header = json.loads(next(snapshot))
+        if header.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(
+                'Unsupported snapshot format: {}'.format(header.get('format'))
+            )
+        store = EntityStore(nailgun.config.ServerConfig(url=header['server']))
+        for line in snapshot:
+            entry = json.loads(line)
+            store.load(entry['path'], entry['json'], entry['context'])
+    LOGGER.info(
+        'Loaded snapshot of %s taken at %s',
+        header['server'], header['taken_at']
+    )
+    return store
+
+
+PlannedChange = namedtuple('PlannedChange', ('action', 'path', 'id', 'name'))
+
+
+class Plan(object):
+    """The changes a DSL script would have made to a Satellite server
+    """
+    def __init__(self):
+        self.changes = []
+        self._lock = Lock()
+
+    def record(self, method, path, ent_json):
+        """Record a change made by an API request
+
+        :param str method: The HTTP method of the request (POST or PUT)
+        :param str path: The URL path of the request
+        :param dict ent_json: The JSON data of the changed entity
+        """
+        change = PlannedChange(
+            action='create' if method == 'POST' else 'update',
+            path=path,
+            id=ent_json.get('id'),
+            name=ent_json.get('name'),
+        )
+        with self._lock:
+            self.changes.append(change)
+
+    @property
+    def creates(self):
+        return [change for change in self.changes if change.action == 'create']
+
+    @property
+    def updates(self):
+        return [change for change in self.changes if change.action == 'update']
+
+    def summary(self):
+        """Returns a one line summary of the plan
+
+        :rtype: str
+        """
+        return '{} to create, {} to update'.format(
+            len(self.creates), len(self.updates)
+        )
+
+    def __len__(self):
+        return len(self.changes)
+
+
+class SnapshotAdapter(requests.adapters.BaseAdapter):
+    """A transport adapter for 'requests' that answers requests from an
+    entity store instead of sending them to the network, and records changes
+    in a plan
+    """
+    def __init__(self, store, plan):
+        """
+        :param EntityStore store: The entities to answer requests with
+        :param Plan plan: The plan to record changes in
+        """
+        super(SnapshotAdapter, self).__init__()
+        self.store = store
+        self.plan = plan
+
+    def send(self, request, **kwargs):
+        url = urlparse(request.url)
+        params = request_params(parse_qsl(url.query), request.body)
+        status, data = self.store.handle(request.method, url.path, params)
+        if request.method in ('POST', 'PUT') and status < 300:
+            self.plan.record(request.method, url.path, data)
+        response = requests.Response()
+        response.status_code = status
+        response.reason = responses.get(status)
+        response.headers = CaseInsensitiveDict(
+            {'Content-Type': 'application/json'}
+        )
+        response._content = json.dumps(data)
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
+
+
+@contextmanager
+def plan_mode(snapshot, server_config=None):
+    """A context manager within which all the requests to the given server
+    are answered from a snapshot. Entities the DSL creates or updates are
+    recorded in the plan the context manager returns.
+
+    :param str snapshot: The path of a snapshot file, or an already loaded
+                         EntityStore
+    :param nailgun.config.ServerConfig server_config: The configuration of the
+                                                      server the snapshot
+                                                      stands in for, by
+                                                      default the server the
+                                                      snapshot was taken of,
+                                                      which is also made the
+                                                      default server within
+                                                      the block
+    :rtype: Plan
+    """
+    if not isinstance(snapshot, EntityStore):
+        snapshot = load_snapshot(snapshot)
+    if server_config is None:
+        server_config = nailgun.config.ServerConfig(
+            url=snapshot._server_config.url
+        )
+        with default_server_config_replaced(server_config):
+            with plan_mode(snapshot, server_config) as plan:
+                yield plan
+        return
+    plan = Plan()
+    mount_adapter(server_config.url, SnapshotAdapter(snapshot, plan))
+    # Entities listed from the real server must not be mixed with the ones in
+    # the snapshot
+    PREFETCH_INDEX.clear()
+    SUBSCRIPTION_CATALOG.clear()
+    try:
+        with state_cache_suspended():
+            yield plan
+    finally:
+        unmount_adapter(server_config.url)
+        PREFETCH_INDEX.clear()
+        SUBSCRIPTION_CATALOG.clear()
+    LOGGER.info('Plan: %s', plan.summary())
+
+
+def plan(script, snapshot, server_config=None):
+    """Run a DSL script in plan mode
+
+    :param str script: The path of the script
+    :param str snapshot: The path of a snapshot file
+    :param nailgun.config.ServerConfig server_config: The configuration of the
+                                                      server the snapshot
+                                                      stands in for, by
+                                                      default the server the
+                                                      snapshot was taken of
+    :rtype: Plan
+    """
+    with plan_mode(snapshot, server_config) as script_plan:
+        run_script(script)
+    return script_plan
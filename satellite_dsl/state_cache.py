@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+"""A persistent on-disk cache of the last seen state of Satellite entities
+
+The cache is an SQLite file that keeps the JSON data of entities keyed by
+server URL, entity class and id, along with the 'updated_at' time and ETag the
+server reported for it, so repeated runs can revalidate entities instead of
+downloading them again
+"""
+import json
+import sqlite3
+from time import time
+from contextlib import contextmanager
+from threading import Lock
+
+from logger import LOGGER
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entities (
+    server TEXT NOT NULL,
+    entity_class TEXT NOT NULL,
+    entity_id INTEGER NOT NULL,
+    json TEXT NOT NULL,
+    updated_at TEXT,
+    etag TEXT,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (server, entity_class, entity_id)
+);
+CREATE INDEX IF NOT EXISTS entities_last_used ON entities (last_used);
+'''
+
+_state_cache = None
+
+
+class CachedEntity(object):
+    """The cached state of an entity
+    """
+    __slots__ = ('json', 'updated_at', 'etag')
+
+    def __init__(self, json, updated_at, etag):
+        self.json = json
+        self.updated_at = updated_at
+        self.etag = etag
+
+
+class EntityStateCache(object):
+    """An SQLite backed cache of entity JSON data with size based eviction of
+    the least recently used entities
+    """
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param str path: The path of the SQLite file
+        :param int max_bytes: The maximal total size of the cached JSON data
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._db = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+        self._size = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entities'
+        ).fetchone()[0]
+        self._listed_updated_at = {}
+
+    def get(self, server, entity_class, entity_id):
+        """Returns the cached state of an entity
+
+        :param str server: The server URL
+        :param str entity_class: The entity class name
+        :param int entity_id: The entity id
+        :returns: The cached entity or None if its not cached
+        :rtype: CachedEntity
+        """
+        key = (server, entity_class, entity_id)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT json, updated_at, etag FROM entities '
+                'WHERE server = ? AND entity_class = ? AND entity_id = ?',
+                key
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                'UPDATE entities SET last_used = ? '
+                'WHERE server = ? AND entity_class = ? AND entity_id = ?',
+                (time(),) + key
+            )
+        return CachedEntity(json.loads(row[0]), row[1], row[2])
+
+    def put(self, server, entity_class, entity_id, ent_json, etag=None):
+        """Store the state of an entity, evicting the least recently used
+        entities if the cache grows too large
+
+        :param str server: The server URL
+        :param str entity_class: The entity class name
+        :param int entity_id: The entity id
+        :param dict ent_json: The JSON data of the entity
+        :param str etag: The ETag the server returned for the entity
+        """
+        data = json.dumps(ent_json, separators=(',', ':'))
+        key = (server, entity_class, entity_id)
+        with self._lock:
+            self._size -= self._row_size(key)
+            self._db.execute(
+                'INSERT OR REPLACE INTO entities '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                key + (
+                    data, ent_json.get('updated_at'), etag, len(data), time()
+                )
+            )
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def forget(self, server, entity_class, entity_id):
+        """Remove an entity from the cache (E.g. because it was changed)
+
+        :param str server: The server URL
+        :param str entity_class: The entity class name
+        :param int entity_id: The entity id
+        """
+        key = (server, entity_class, entity_id)
+        with self._lock:
+            self._size -= self._row_size(key)
+            self._db.execute(
+                'DELETE FROM entities '
+                'WHERE server = ? AND entity_class = ? AND entity_id = ?',
+                key
+            )
+            self._listed_updated_at.pop(key, None)
+
+    def note_listed(self, server, entity_class, entity_id, updated_at):
+        """Remember the 'updated_at' time an entity was listed with in this
+        run, so its cached state can be trusted without asking the server if
+        it matches
+
+        :param str server: The server URL
+        :param str entity_class: The entity class name
+        :param int entity_id: The entity id
+        :param str updated_at: The 'updated_at' time found in the listing
+        """
+        with self._lock:
+            self._listed_updated_at[(server, entity_class, entity_id)] = \
+                updated_at
+
+    def listed_updated_at(self, server, entity_class, entity_id):
+        """Returns the 'updated_at' time an entity was listed with in this run
+        or None if it was not listed
+        """
+        with self._lock:
+            return self._listed_updated_at.get(
+                (server, entity_class, entity_id)
+            )
+
+    def forget_listed(self):
+        """Forget the 'updated_at' times entities were listed with, so
+        entities are not trusted by listings made before changes that the
+        next run may not see
+        """
+        with self._lock:
+            self._listed_updated_at = {}
+
+    def close(self):
+        """Close the SQLite file
+        """
+        with self._lock:
+            self._db.close()
+
+    def _row_size(self, key):
+        """Returns the size of a cached entity or 0 if its not cached (The
+        lock must be held)
+        """
+        row = self._db.execute(
+            'SELECT size FROM entities '
+            'WHERE server = ? AND entity_class = ? AND entity_id = ?',
+            key
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _evict(self):
+        """Remove the least recently used entities until the cache is well
+        within its size limit (The lock must be held)
+        """
+        target = self.max_bytes * 9 // 10
+        evicted = 0
+        rows = self._db.execute(
+            'SELECT server, entity_class, entity_id, size FROM entities '
+            'ORDER BY last_used'
+        ).fetchall()
+        for server, entity_class, entity_id, size in rows:
+            if self._size <= target:
+                break
+            self._db.execute(
+                'DELETE FROM entities '
+                'WHERE server = ? AND entity_class = ? AND entity_id = ?',
+                (server, entity_class, entity_id)
+            )
+            self._size -= size
+            evicted += 1
+        LOGGER.debug('Evicted %d entities from the state cache', evicted)
+
+
+def enable_state_cache(path, max_bytes=DEFAULT_MAX_BYTES):
+    """Start caching entity state in the given SQLite file
+
+    :param str path: The path of the SQLite file
+    :param int max_bytes: The maximal total size of the cached JSON data
+    :rtype: EntityStateCache
+    """
+    global _state_cache
+    disable_state_cache()
+    _state_cache = EntityStateCache(path, max_bytes)
+    return _state_cache
+
+
+def disable_state_cache():
+    """Stop caching entity state
+    """
+    global _state_cache
+    if _state_cache is not None:
+        _state_cache.close()
+    _state_cache = None
+
+
+def reopen_state_cache():
+    """Open the active entity state cache file again, without closing the
+    inherited connection. Meant for forked processes, which can not share
+    SQLite connections with their parent
+    """
+    global _state_cache
+    if _state_cache is not None:
+        _state_cache = EntityStateCache(
+            _state_cache.path, _state_cache.max_bytes
+        )
+
+
+def get_state_cache():
+    """Returns the active entity state cache or None if caching is disabled
+
+    :rtype: EntityStateCache
+    """
+    return _state_cache
+
+
+@contextmanager
+def state_cache_suspended():
+    """A context manager that stops using the active entity state cache
+    within its block, without closing it
+    """
+    global _state_cache
+    state_cache, _state_cache = _state_cache, None
+    try:
+        yield
+    finally:
+        _state_cache = state_cache
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+"""A catalog of the subscriptions of organizations and the products they
+provide
+
+The subscriptions of an organization are listed in one paginated pass, which
+includes the products every subscription provides, and are then looked up
+from memory by subscription id or by product name. A lookup that finds
+nothing lists the organization again, in case the subscription was added
+since it was listed. Catalogs are shared by all ensurers and kept for a
+limited time, and if the entity state cache is enabled, are also kept in it so
+later runs can use them as well
+"""
+from threading import Lock
+from time import time
+
+from nailgun_hacks import default_server_config, satellite_iter_results
+from state_cache import get_state_cache
+
+from logger import LOGGER
+
+DEFAULT_TTL = 60 * 60
+# The name catalogs are kept in the entity state cache under
+CACHE_CLASS = 'SubscriptionCatalog'
+
+
+class OrganizationSubscriptions(object):
+    """The subscriptions of one organization
+    """
+    __slots__ = (
+        'loaded_at',
+        'subscriptions',
+        'products',
+        'by_product_name',
+    )
+
+    def __init__(self, subscriptions, loaded_at=None):
+        """
+        :param list subscriptions: The JSON data of the subscriptions
+        :param float loaded_at: When the subscriptions were listed, defaults
+                                to now
+        """
+        self.loaded_at = time() if loaded_at is None else loaded_at
+        self.subscriptions = dict(
+            (sub_json['id'], sub_json) for sub_json in subscriptions
+        )
+        self.products = dict(
+            (sub_json['id'], dict(
+                (prod_json['name'], prod_json)
+                for prod_json in sub_json.get('provided_products') or ()
+            ))
+            for sub_json in subscriptions
+        )
+        self.by_product_name = {}
+        for sub_json in subscriptions:
+            self.by_product_name.setdefault(
+                sub_json.get('product_name'), []
+            ).append(sub_json)
+
+    def to_json(self):
+        return dict(
+            loaded_at=self.loaded_at,
+            subscriptions=self.subscriptions.values(),
+        )
+
+
+class SubscriptionCatalog(object):
+    """A shared catalog of the subscriptions of organizations
+    """
+    def __init__(self, ttl=DEFAULT_TTL):
+        """
+        :param int ttl: How many seconds to use a listing of the subscriptions
+                        of an organization for
+        """
+        self.ttl = ttl
+        self._orgs = {}
+        self._load_locks = {}
+        self._lock = Lock()
+
+    def provided_product(
+        self,
+        organization_id,
+        subscription_id,
+        name,
+        server_config=None,
+    ):
+        """Returns the JSON data of a product provided by a subscription
+
+        :param int organization_id: The id of the subscription organization
+        :param int subscription_id: The id of the subscription
+        :param str name: The product name
+        :param nailgun.config.ServerConfig server_config: Connection
+                                                          information
+        :returns: The product data or None if the subscription does not
+                  provide such a product
+        :rtype: dict
+        """
+        return self._lookup(
+            organization_id,
+            lambda org_subs:
+            org_subs.products.get(subscription_id, {}).get(name),
+            server_config,
+        )
+
+    def subscriptions(self, organization_id, product_name, server_config=None):
+        """Returns the JSON data of the subscriptions of an organization for a
+        given product
+
+        :param int organization_id: The id of the organization
+        :param str product_name: The product name of the subscriptions
+        :param nailgun.config.ServerConfig server_config: Connection
+                                                          information
+        :returns: The subscriptions data, in the order Satellite listed them.
+                  The list is empty if there are no such subscriptions
+        :rtype: list
+        """
+        return self._lookup(
+            organization_id,
+            lambda org_subs: org_subs.by_product_name.get(product_name, []),
+            server_config,
+        )
+
+    def organization_of(self, subscription_id, server_config=None):
+        """Returns the id of the organization a subscription belongs to, if
+        the subscriptions of that organization were listed
+
+        :param int subscription_id: The id of the subscription
+        :param nailgun.config.ServerConfig server_config: Connection
+                                                          information
+        :returns: The organization id, or None if it is not known
+        :rtype: int
+        """
+        if server_config is None:
+            server_config = default_server_config()
+        with self._lock:
+            for (url, org_id), org_subs in self._orgs.iteritems():
+                if url == server_config.url and \
+                        subscription_id in org_subs.subscriptions:
+                    return org_id
+        return None
+
+    def organization(
+        self,
+        organization_id,
+        server_config=None,
+        listed_before=None,
+    ):
+        """Returns the subscriptions of an organization, listing them if they
+        were not listed yet or were listed more than 'ttl' seconds ago. Each
+        organization is only listed once, even if looked up by many threads
+        at the same time
+
+        :param int organization_id: The id of the organization
+        :param nailgun.config.ServerConfig server_config: Connection
+                                                          information
+        :param float listed_before: If given, list the organization again from
+                                    the server if it was listed before this
+                                    time
+        :rtype: OrganizationSubscriptions
+        """
+        if server_config is None:
+            server_config = default_server_config()
+        key = (server_config.url, int(organization_id))
+        with self._lock:
+            org_subs = self._orgs.get(key)
+            if self._usable(org_subs, listed_before):
+                return org_subs
+            load_lock = self._load_locks.setdefault(key, Lock())
+        with load_lock:
+            with self._lock:
+                org_subs = self._orgs.get(key)
+            if not self._usable(org_subs, listed_before):
+                org_subs = self._load(
+                    key, server_config, use_cache=listed_before is None
+                )
+                with self._lock:
+                    self._orgs[key] = org_subs
+            return org_subs
+
+    def forget(self, organization_id, server_config=None):
+        """Drop the subscriptions of an organization, so they are listed again
+        on the next lookup
+
+        :param int organization_id: The id of the organization
+        :param nailgun.config.ServerConfig server_config: Connection
+                                                          information
+        """
+        if server_config is None:
+            server_config = default_server_config()
+        key = (server_config.url, int(organization_id))
+        with self._lock:
+            self._orgs.pop(key, None)
+        state_cache = get_state_cache()
+        if state_cache is not None:
+            state_cache.forget(key[0], CACHE_CLASS, key[1])
+
+    def clear(self):
+        """Drop all the subscriptions kept in memory
+        """
+        with self._lock:
+            self._orgs.clear()
+
+    def _lookup(self, organization_id, find, server_config):
+        """Look something up in the subscriptions of an organization, listing
+        the organization again if it is not found
+
+        :param callable find: A function that is given the
+                              OrganizationSubscriptions and returns what was
+                              found in them, or an empty value
+        """
+        started = time()
+        found = find(self.organization(organization_id, server_config))
+        if not found:
+            found = find(self.organization(
+                organization_id, server_config, listed_before=started
+            ))
+        return found
+
+    def _fresh(self, org_subs):
+        return time() - org_subs.loaded_at < self.ttl
+
+    def _usable(self, org_subs, listed_before):
+        return org_subs is not None and self._fresh(org_subs) and (
+            listed_before is None or org_subs.loaded_at >= listed_before
+        )
+
+    def _load(self, key, server_config, use_cache=True):
+        """Returns the subscriptions of an organization from the state cache
+        if they were kept there recently enough and 'use_cache' is True, and
+        otherwise from the server
+        """
+        state_cache = get_state_cache()
+        if state_cache is not None and use_cache:
+            cached = state_cache.get(key[0], CACHE_CLASS, key[1])
+            if cached is not None:
+                org_subs = OrganizationSubscriptions(
+                    cached.json['subscriptions'], cached.json['loaded_at']
+                )
+                if self._fresh(org_subs):
+                    return org_subs
+        LOGGER.debug('Listing subscriptions of organization #%s', key[1])
+        org_subs = OrganizationSubscriptions(list(satellite_iter_results(
+            query_path='katello/api/v2/organizations/{}/subscriptions'
+            .format(key[1]),
+            server_config=server_config,
+        )))
+        if state_cache is not None:
+            state_cache.put(key[0], CACHE_CLASS, key[1], org_subs.to_json())
+        return org_subs
+
+
+SUBSCRIPTION_CATALOG = SubscriptionCatalog()
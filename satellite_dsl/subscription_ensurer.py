@@ -4,13 +4,11 @@
 import nailgun.entities
 
 from type_handler import type_handler
-from nailgun_hacks import (
-    build_entity_attr_query,
-    satellite_get_entities,
-)
 
 from logger import LOGGER
 from entity_ensurer import EntityEnsurer
+from outcomes import UNCHANGED, report_outcome
+from subscription_catalog import SUBSCRIPTION_CATALOG
 
 
 @type_handler(fortype=nailgun.entities.Subscription, incls=EntityEnsurer)
@@ -44,25 +42,39 @@ class SubscriptionEnsurer(EntityEnsurer):
                 .format(product_name, self.format_entity(organization))
             )
         LOGGER.info('Unchanged entitiy: %s', self.format_entity(entities[0]))
+        report_outcome(UNCHANGED, entities[0])
         return entities[0]
 
     def find_by_key(self, entity_cls, product_name, organization):
         """Find a Subscription for given organization and product
 
+        The subscriptions are looked up in the shared subscription catalog,
+        which lists all the subscriptions of the organization once instead of
+        searching for every product
+
         :param type entity_cls: The class of entity to look for
         :param str product_name: The product name for the subscription
         :param nailgun.entities.Organization organization: The organization
 
-        :returns: The found Subscription
-        :rtype nailgun.entities.Subscription
+        :returns: The found Subscriptions
+        :rtype list
         """
-        path = 'katello/api/v2/organizations/{}/subscriptions'.format(
-            organization.id
-        )
-        data = dict(search=build_entity_attr_query(product_name=product_name))
-        entities = satellite_get_entities(
-            entity_cls=nailgun.entities.Subscription,
-            query_path=path,
-            query_data=data,
-        )
-        return entities
+        server_config = organization._server_config
+        return [
+            nailgun.entities.Subscription(
+                server_config,
+                id=sub_json['id'],
+                organization=organization.id,
+            )
+            for sub_json in SUBSCRIPTION_CATALOG.subscriptions(
+                organization.id, product_name, server_config
+            )
+        ]
+
+    def snapshot_contexts(self, entity_cls, organizations):
+        """Subscriptions are only listed within organizations, so list them in
+        every organization found on the server
+
+        :rtype: list
+        """
+        return [{'organization_id': org.id} for org in organizations]
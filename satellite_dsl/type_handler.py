@@ -7,7 +7,15 @@ specific instance meant to handle that type. Different classes can be
 registered into the same class to handle different types. Inheritance rules
 apply so that if class B is subclass of B, a handler for A will be returned
 unless a handler for B was registered
+
+Handlers can also be registered lazily by naming the module that registers
+them, which is then only imported when a handler for the type is first looked
+up
+
+Handler lookup and registration are thread safe
 """
+from importlib import import_module
+from threading import RLock
 
 
 class TypeHandler(type):
@@ -17,17 +25,31 @@ class TypeHandler(type):
     singletones looked up by type, with the lookup supporting inheritance)
     """
     _handlers = {}
+    _lazy_handlers = {}
+    _handlers_lock = RLock()
 
     def __call__(cls, handled_type):
-        for parent in handled_type.__mro__:
-            try:
-                return cls._handlers[parent]
-            except KeyError:
-                pass
+        while True:
+            with cls._handlers_lock:
+                lazy_module = None
+                for parent in handled_type.__mro__:
+                    try:
+                        return cls._handlers[parent]
+                    except KeyError:
+                        pass
+                    lazy_module = cls._lazy_handlers.get(_type_name(parent))
+                    if lazy_module is not None:
+                        break
+            if lazy_module is None:
+                break
+            # Import outside the lock since importing waits for the import
+            # lock, which may be held by a thread registering a handler
+            import_module(lazy_module)
+            with cls._handlers_lock:
+                cls._lazy_handlers.pop(_type_name(parent), None)
         raise TypeError(
             'Class {} has no handler in {}'.format(str(handled_type), str(cls))
         )
-        pass
 
     def register_handler(cls, handled_type, handler_cls):
         """Registers a class as the handler for a given type
@@ -38,8 +60,9 @@ class TypeHandler(type):
         :returns: handler_cls
         :rtype: type
         """
-        cls._handlers[handled_type] = \
-            super(TypeHandler, handler_cls).__call__()
+        handler = super(TypeHandler, handler_cls).__call__()
+        with cls._handlers_lock:
+            cls._handlers[handled_type] = handler
         return handler_cls
 
 
@@ -59,3 +82,36 @@ def type_handler(fortype, incls=None):
             cls = TypeHandler(cls.__name__, cls.__bases__, cls.__dict__.copy())
             return cls.register_handler(fortype, cls)
     return register_handler
+
+
+def lazy_type_handler(fortype, module):
+    """Registers a module that registers the handler for a given type when
+    imported, so it is only imported when a handler for that type (or a
+    subclass of it) is first looked up
+
+    :param str fortype: The qualified name of the type (E.g.
+                        'nailgun.entities.Product'), so the type itself does
+                        not need to be imported
+    :param str module: The qualified name of the module
+    """
+    with TypeHandler._handlers_lock:
+        TypeHandler._lazy_handlers[fortype] = module
+
+
+def import_lazy_handlers():
+    """Import all the modules registered with 'lazy_type_handler' that were
+    not imported yet, E.g. before looking handlers up from threads that must
+    not import anything
+    """
+    with TypeHandler._handlers_lock:
+        lazy_handlers = TypeHandler._lazy_handlers.items()
+    for fortype, lazy_module in lazy_handlers:
+        import_module(lazy_module)
+        with TypeHandler._handlers_lock:
+            TypeHandler._lazy_handlers.pop(fortype, None)
+
+
+def _type_name(typ):
+    """Returns the qualified name of the given type
+    """
+    return '{}.{}'.format(typ.__module__, typ.__name__)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""Scheduling of the entity creates and updates sent to Satellite servers
+
+All writes go through a shared scheduler, which limits the amount of writes
+in flight to each server regardless of how many entities are ensured at the
+same time. When asked to, the scheduler also records the result of every
+write for reporting once the run is done
+"""
+from collections import namedtuple
+from threading import BoundedSemaphore, Lock
+from time import time
+
+# Lower than the default amount of entities ensured at the same time, since
+# writes cost Satellite much more than the reads ensuring entities mostly makes
+DEFAULT_MAX_WRITES = 4
+
+WriteResult = namedtuple(
+    'WriteResult',
+    ('server', 'entity_class', 'name', 'id', 'outcome', 'seconds', 'error'),
+)
+
+
+class WriteScheduler(object):
+    """Sends entity writes to Satellite servers, at most 'max_writes' at the
+    same time to each server
+    """
+    def __init__(self, max_writes=DEFAULT_MAX_WRITES):
+        """
+        :param int max_writes: The maximal amount of writes to send to a single
+                               server at the same time
+        """
+        self.max_writes = max_writes
+        self._results = None
+        self._slots = {}
+        self._lock = Lock()
+
+    def write(self, ensurer, entity):
+        """Create or update an entity, waiting for a free slot of its server
+        first
+
+        :param EntityEnsurer ensurer: The ensurer of the entity class
+        :param nailgun.entities.Entity entity: The entity to write, it is
+                                               updated if its 'id' is set and
+                                               created otherwise
+        :returns: The written entity
+        :rtype: nailgun.entities.Entity
+        """
+        with self._slot(entity._server_config.url):
+            start = time()
+            try:
+                outcome, written = ensurer.write_entity(entity)
+            except Exception as error:
+                self._record(entity, None, time() - start, error)
+                raise
+            self._record(written, outcome, time() - start)
+            return written
+
+    def set_max_writes(self, max_writes):
+        """Change the maximal amount of writes to send to a single server at
+        the same time. Writes already in flight are allowed to finish
+
+        :param int max_writes: The amount of writes
+        """
+        with self._lock:
+            self.max_writes = max_writes
+            self._slots = {}
+
+    def clear(self):
+        """Drop the write results and the per-server limits, and stop
+        recording results. Meant for forked processes, which may inherit
+        limits held by threads of their parent
+        """
+        with self._lock:
+            self._results = None
+            self._slots = {}
+
+    def record_results(self):
+        """Start recording the results of writes, for 'take_results'. Results
+        are not recorded otherwise, so they do not pile up in long runs
+        """
+        with self._lock:
+            if self._results is None:
+                self._results = []
+
+    def take_results(self):
+        """Returns the results of the writes made since the last call, or
+        since recording them was started with 'record_results'
+
+        :returns: A list of WriteResult objects
+        :rtype: list
+        """
+        with self._lock:
+            results = self._results or []
+            if self._results is not None:
+                self._results = []
+        return results
+
+    def _slot(self, server):
+        """Returns the semaphore limiting the writes to a server
+        """
+        with self._lock:
+            try:
+                return self._slots[server]
+            except KeyError:
+                slot = self._slots[server] = BoundedSemaphore(self.max_writes)
+                return slot
+
+    def _record(self, entity, outcome, seconds, error=None):
+        if self._results is None:
+            return
+        result = WriteResult(
+            server=entity._server_config.url,
+            entity_class=type(entity).__name__,
+            name=getattr(entity, 'name', None),
+            id=getattr(entity, 'id', None),
+            outcome=outcome,
+            seconds=seconds,
+            error=None if error is None else str(error),
+        )
+        with self._lock:
+            if self._results is not None:
+                self._results.append(result)
+
+
+def set_max_writes(max_writes):
+    """Set the maximal amount of writes to send to a single server at the
+    same time
+
+    :param int max_writes: The amount of writes
+    """
+    WRITE_SCHEDULER.set_max_writes(max_writes)
+
+
+def summarize_writes(results):
+    """Summarize write results for display
+
+    :param list results: A list of WriteResult objects
+    :rtype: str
+    """
+    failed = sum(1 for result in results if result.error)
+    return '{} writes ({} failed, {:.1f}s spent writing)'.format(
+        len(results), failed, sum(result.seconds for result in results)
+    )
+
+
+WRITE_SCHEDULER = WriteScheduler()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""Tests for the traffic governor, with canned responses and against a fake
+Satellite server
+"""
+import unittest
+from threading import Thread
+from time import time
+
+import requests
+
+from satellite_dsl import governor
+from satellite_dsl.fake_satellite import FakeSatellite
+from satellite_dsl.governor import (
+    MAX_RETRY_AFTER,
+    TrafficGovernor,
+    _retry_after,
+    forget_governors,
+    get_governor,
+)
+from satellite_dsl.nailgun_hacks import satellite_get_response
+
+
+def _response(status, headers=None):
+    """Returns a canned response with the given status and headers
+    """
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = ''
+    return response
+
+
+class _Responder(object):
+    """Sends canned responses one after the other, repeating the last one
+    """
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent = 0
+
+    def __call__(self):
+        response = self.responses[min(self.sent, len(self.responses) - 1)]
+        self.sent += 1
+        return response
+
+
+class TestTrafficGovernor(unittest.TestCase):
+    def setUp(self):
+        self._backoff_base = governor.BACKOFF_BASE
+        governor.BACKOFF_BASE = 0.0
+
+    def tearDown(self):
+        governor.BACKOFF_BASE = self._backoff_base
+
+    def test_window_grows_additively(self):
+        gov = TrafficGovernor(concurrency=4)
+        for _ in range(4):
+            gov.send('GET', _Responder(_response(200)))
+        self.assertGreater(gov.concurrency, 4.0)
+        self.assertLess(gov.concurrency, 5.0)
+        self.assertEqual(gov.in_flight, 0)
+
+    def test_window_halves_once_per_window(self):
+        gov = TrafficGovernor(concurrency=8)
+        # Writes are not retried on 502, so every call is a single request
+        gov.send('POST', _Responder(_response(502)))
+        self.assertEqual(gov.concurrency, 4.0)
+        for _ in range(3):
+            gov.send('POST', _Responder(_response(502)))
+        self.assertEqual(gov.concurrency, 4.0)
+        gov.send('POST', _Responder(_response(502)))
+        self.assertEqual(gov.concurrency, 2.0)
+        self.assertEqual(gov.overloads, 5)
+
+    def test_window_never_below_one(self):
+        gov = TrafficGovernor(concurrency=1)
+        for _ in range(5):
+            gov.send('POST', _Responder(_response(504)))
+        self.assertEqual(gov.concurrency, 1.0)
+
+    def test_idempotent_requests_retried(self):
+        gov = TrafficGovernor()
+        responder = _Responder(_response(502), _response(504), _response(200))
+        self.assertEqual(gov.send('GET', responder).status_code, 200)
+        self.assertEqual(responder.sent, 3)
+        self.assertEqual(gov.retries, 2)
+
+    def test_retries_give_up(self):
+        gov = TrafficGovernor()
+        responder = _Responder(_response(502))
+        self.assertEqual(gov.send('GET', responder).status_code, 502)
+        self.assertEqual(responder.sent, governor.MAX_RETRIES + 1)
+
+    def test_writes_retried_only_when_rejected(self):
+        gov = TrafficGovernor()
+        responder = _Responder(_response(502), _response(200))
+        self.assertEqual(gov.send('PUT', responder).status_code, 502)
+        self.assertEqual(responder.sent, 1)
+        responder = _Responder(_response(503), _response(201))
+        self.assertEqual(gov.send('POST', responder).status_code, 201)
+        self.assertEqual(responder.sent, 2)
+
+    def test_retry_after_holds_all_requests(self):
+        gov = TrafficGovernor()
+        start = time()
+        responder = _Responder(
+            _response(429, {'Retry-After': '0.3'}), _response(200)
+        )
+        self.assertEqual(gov.send('GET', responder).status_code, 200)
+        self.assertGreaterEqual(time() - start, 0.3)
+        # Another request sent meanwhile waits for the hold as well
+        gov._hold(0.3)
+        start = time()
+        gov.send('GET', _Responder(_response(200)))
+        self.assertGreaterEqual(time() - start, 0.25)
+
+    def test_slot_released_on_unexpected_errors(self):
+        gov = TrafficGovernor(concurrency=4)
+
+        def fail():
+            raise ValueError('bad request data')
+        for _ in range(5):
+            self.assertRaises(ValueError, gov.send, 'GET', fail)
+        self.assertEqual(gov.in_flight, 0)
+        self.assertEqual(gov.concurrency, 4.0)
+
+    def test_connection_failures_retried(self):
+        gov = TrafficGovernor()
+        attempts = []
+
+        def flaky():
+            attempts.append(None)
+            if len(attempts) < 3:
+                raise requests.exceptions.ConnectionError('reset')
+            return _response(200)
+        self.assertEqual(gov.send('GET', flaky).status_code, 200)
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(gov.in_flight, 0)
+
+    def test_concurrency_limited(self):
+        gov = TrafficGovernor(concurrency=2, max_concurrency=2)
+        peak = []
+
+        def send_request():
+            peak.append(gov.in_flight)
+            return _response(200)
+        threads = [
+            Thread(target=gov.send, args=('GET', send_request))
+            for _ in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(max(peak), 2)
+        self.assertEqual(gov.in_flight, 0)
+
+    def test_rate_limit(self):
+        gov = TrafficGovernor(rate=20, burst=1)
+        start = time()
+        for _ in range(5):
+            gov.send('GET', _Responder(_response(200)))
+        self.assertGreaterEqual(time() - start, 0.15)
+
+    def test_retry_after_parsing(self):
+        self.assertEqual(_retry_after(_response(503, {'Retry-After': '5'})), 5)
+        self.assertEqual(
+            _retry_after(_response(503, {'Retry-After': '100000'})),
+            MAX_RETRY_AFTER
+        )
+        self.assertEqual(
+            _retry_after(_response(503, {'Retry-After': '-3'})), 0.0
+        )
+        self.assertIsNone(_retry_after(_response(
+            503, {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+        )))
+        self.assertIsNone(_retry_after(_response(503)))
+
+
+class TestGovernorAgainstFakeSatellite(unittest.TestCase):
+    def setUp(self):
+        self._backoff_base = governor.BACKOFF_BASE
+        governor.BACKOFF_BASE = 0.01
+        forget_governors()
+        self.fake = FakeSatellite(latency=0.02, max_concurrent=2).start()
+
+    def tearDown(self):
+        self.fake.stop()
+        forget_governors()
+        governor.BACKOFF_BASE = self._backoff_base
+
+    def test_overloaded_server(self):
+        server_config = self.fake.server_config()
+        # Authenticate once, so concurrent requests share a session
+        satellite_get_response('/api/v2/hostgroups', {}, server_config)
+        errors = []
+
+        def query():
+            try:
+                satellite_get_response(
+                    '/api/v2/hostgroups', {}, server_config
+                )
+            except Exception as error:
+                errors.append(error)
+        threads = [Thread(target=query) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertGreater(self.fake.rejected, 0)
+        gov = get_governor(self.fake.url)
+        self.assertGreater(gov.retries, 0)
+        self.assertLess(gov.concurrency, governor.INITIAL_CONCURRENCY)
+        self.assertEqual(gov.in_flight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
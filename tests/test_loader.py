@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+"""Tests for loading entity declarations from configuration files
+"""
+import cPickle
+import os
+import shutil
+import tempfile
+import unittest
+
+import nailgun.entities
+
+import satellite_dsl
+from satellite_dsl import loader
+from satellite_dsl.fake_satellite import FakeSatellite
+from satellite_dsl.loader import compile_config, load_config
+from satellite_dsl.nailgun_hacks import set_default_server_config
+
+CONFIG = '''\
+- entity: Organization
+  ref: main_org
+  name: Default Organization
+- entity: Location
+  ref: main_loc
+  name: Default Location
+---
+entity: HostGroup
+name: test_hg
+organization: [{$ref: main_org}]
+location: [{$ref: main_loc}]
+'''
+
+
+class _Declarations(object):
+    """An 'ensure' function that records the declarations it is called with
+    """
+    def __init__(self):
+        self.declared = []
+
+    def __call__(self, entity_cls, **attrs):
+        self.declared.append((entity_cls, attrs))
+        return len(self.declared) - 1
+
+
+class LoaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_config(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as config_file:
+            config_file.write(content)
+        return path
+
+    def cache_files(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return sorted(os.listdir(self.cache_dir))
+
+
+class TestRefs(LoaderTestCase):
+    def test_links_resolved(self):
+        path = self.write_config('config.yaml', CONFIG)
+        ensure = _Declarations()
+        declared = load_config(path, ensure, cache_dir=None)
+        self.assertEqual(declared, [0, 1, 2])
+        self.assertEqual(
+            [entity_cls for entity_cls, attrs in ensure.declared],
+            [
+                nailgun.entities.Organization,
+                nailgun.entities.Location,
+                nailgun.entities.HostGroup,
+            ]
+        )
+        self.assertEqual(
+            ensure.declared[2][1],
+            dict(name='test_hg', organization=[0], location=[1])
+        )
+
+    def test_jsonl(self):
+        path = self.write_config('config.jsonl', '\n'.join([
+            '{"entity": "Organization", "ref": "org", "name": "O"}',
+            '',
+            '{"entity": "Product", "name": "P", "organization": '
+            '{"$ref": "org"}}',
+        ]))
+        ensure = _Declarations()
+        load_config(path, ensure, cache_dir=None)
+        self.assertEqual(
+            ensure.declared[1],
+            (nailgun.entities.Product, dict(name='P', organization=0))
+        )
+
+    def test_invalid_declarations(self):
+        path = self.write_config('bad.yaml', '\n'.join([
+            '- entity: HostGroup',
+            '  name: hg',
+            '  organization: [{$ref: later}]',
+            '- entity: Organization',
+            '  ref: later',
+            '  name: {$ref: later}',
+            '- entity: Nope',
+            '- entity: Organization',
+            '  ref: later',
+            '  bogus: 1',
+            '- just a string',
+        ]))
+        with self.assertRaises(ValueError) as raised:
+            compile_config(path, cache_dir=None)
+        message = str(raised.exception)
+        for problem in (
+            '#1: organization: link to undeclared ref',
+            '#2: name: links are only allowed in link attributes',
+            '#3: unknown entity class: Nope',
+            "#4: entities of type 'Organization' do not have an 'bogus'",
+            '#4: duplicate ref: later',
+            '#5: not a mapping',
+        ):
+            self.assertIn(problem, message)
+
+    def test_applied_links(self):
+        path = self.write_config('config.yaml', CONFIG)
+        with FakeSatellite() as fake:
+            set_default_server_config(fake.server_config())
+            try:
+                load_config(path, satellite_dsl.ensure, cache_dir=None)
+                satellite_dsl.apply()
+            finally:
+                set_default_server_config(None)
+            org, = fake.entities['katello/api/v2/organizations'].values()
+            loc, = fake.entities['api/v2/locations'].values()
+            hg, = fake.entities['api/v2/hostgroups'].values()
+        self.assertEqual(hg['name'], 'test_hg')
+        self.assertEqual(hg['organization_ids'], [org['id']])
+        self.assertEqual(hg['location_ids'], [loc['id']])
+
+
+class TestCache(LoaderTestCase):
+    def test_cached_when_unchanged(self):
+        path = self.write_config('config.yaml', CONFIG)
+        compiled = compile_config(path, self.cache_dir)
+        cache_file, = self.cache_files()
+        # Loading again reads the cache instead of the configuration
+        with open(os.path.join(self.cache_dir, cache_file), 'wb') as cache:
+            cPickle.dump([('Organization', {})], cache)
+        self.assertEqual(
+            compile_config(path, self.cache_dir), [('Organization', {})]
+        )
+        self.assertEqual(len(compiled), 3)
+
+    def test_changed_file(self):
+        path = self.write_config('config.yaml', CONFIG)
+        compile_config(path, self.cache_dir)
+        self.write_config('config.yaml', CONFIG.replace('test_hg', 'new_hg'))
+        compiled = compile_config(path, self.cache_dir)
+        self.assertEqual(compiled[2][1]['name'], 'new_hg')
+        self.assertEqual(len(self.cache_files()), 2)
+
+    def test_changed_version(self):
+        path = self.write_config('config.yaml', CONFIG)
+        compile_config(path, self.cache_dir)
+        version = loader.__version__
+        loader.__version__ = version + '.dev1'
+        try:
+            compile_config(path, self.cache_dir)
+        finally:
+            loader.__version__ = version
+        self.assertEqual(len(self.cache_files()), 2)
+
+    def test_unreadable_cache(self):
+        path = self.write_config('config.yaml', CONFIG)
+        compile_config(path, self.cache_dir)
+        cache_path = os.path.join(self.cache_dir, self.cache_files()[0])
+        for content in ('', 'not a pickle\x00', cPickle.dumps(5)):
+            with open(cache_path, 'wb') as cache:
+                cache.write(content)
+            compiled = compile_config(path, self.cache_dir)
+            self.assertEqual(len(compiled), 3)
+            self.assertEqual(compiled[2][1]['name'], 'test_hg')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests for searching many entities by their keys with batched 'or' queries
+"""
+import unittest
+
+import nailgun.entities
+
+from satellite_dsl.entity_store import EntityStore, _parse_query
+from satellite_dsl.fake_satellite import FakeSatellite
+from satellite_dsl.nailgun_hacks import (
+    build_entity_attr_query,
+    build_entity_keys_query,
+    entity_search_by_keys,
+    format_entity_query_value,
+    iter_entity_keys_queries,
+)
+
+TRICKY_NAMES = [
+    'plain',
+    'with space',
+    'or',
+    'AND',
+    'a"quote',
+    'back\\slash',
+    '(parens)',
+    'x=y',
+    '',
+    u'café',
+    u'日本'.encode('utf-8'),
+]
+
+
+class TestQueryFormatting(unittest.TestCase):
+    def test_plain_values_unquoted(self):
+        self.assertEqual(format_entity_query_value('web'), u'web')
+        self.assertEqual(format_entity_query_value(7), u'7')
+
+    def test_values_quoted(self):
+        self.assertEqual(format_entity_query_value('a b'), u'"a b"')
+        self.assertEqual(format_entity_query_value('or'), u'"or"')
+        self.assertEqual(format_entity_query_value(''), u'""')
+        self.assertEqual(
+            format_entity_query_value('say "hi"\\'), u'"say \\"hi\\"\\\\"'
+        )
+
+    def test_non_ascii_values(self):
+        self.assertEqual(format_entity_query_value(u'café'), u'café')
+        self.assertEqual(
+            format_entity_query_value(u'café'.encode('utf-8')), u'café'
+        )
+        self.assertEqual(
+            build_entity_attr_query(name=u'café au lait'),
+            u'name = "café au lait"'.encode('utf-8')
+        )
+
+
+class TestParseQuery(unittest.TestCase):
+    def test_single_term(self):
+        self.assertEqual(_parse_query('name = web'), [[(u'name', u'web')]])
+
+    def test_empty_query(self):
+        self.assertEqual(_parse_query(''), [[]])
+
+    def test_or_groups(self):
+        self.assertEqual(
+            _parse_query('(name = a) or (name = b and title = "a/b c")'),
+            [
+                [(u'name', u'a')],
+                [(u'name', u'b'), (u'title', u'a/b c')],
+            ]
+        )
+
+    def test_quoted_keywords_and_escapes(self):
+        self.assertEqual(
+            _parse_query(r'(name = "or") or (name = "a \"(b)\" \\ c")'),
+            [[(u'name', u'or')], [(u'name', u'a "(b)" \\ c')]]
+        )
+
+    def test_round_trip(self):
+        keys = [dict(name=name) for name in TRICKY_NAMES]
+        keys.append(dict(name='multi', title='a/b c'))
+        parsed = _parse_query(build_entity_keys_query(keys))
+        self.assertEqual(len(parsed), len(keys))
+        for key, group in zip(keys, parsed):
+            expected = dict(
+                (attr, value.decode('utf-8')
+                 if isinstance(value, str) else value)
+                for attr, value in key.iteritems()
+            )
+            self.assertEqual(dict(group), expected)
+
+
+class TestQueryChunks(unittest.TestCase):
+    def test_single_chunk(self):
+        keys = [dict(name='hg{}'.format(i)) for i in range(5)]
+        chunks = list(iter_entity_keys_queries(keys))
+        self.assertEqual(chunks, [(keys, build_entity_keys_query(keys))])
+
+    def test_chunks_within_limit(self):
+        keys = [dict(name='host group {}'.format(i)) for i in range(50)]
+        chunks = list(iter_entity_keys_queries(keys, max_length=200))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(sum((chunk for chunk, query in chunks), []), keys)
+        for chunk, query in chunks:
+            self.assertLessEqual(len(query), 200)
+            self.assertEqual(query, build_entity_keys_query(chunk))
+
+    def test_long_key_alone(self):
+        keys = [dict(name='a'), dict(name='x' * 100), dict(name='b')]
+        chunks = list(iter_entity_keys_queries(keys, max_length=50))
+        self.assertEqual(
+            [chunk for chunk, query in chunks], [[key] for key in keys]
+        )
+
+    def test_no_keys(self):
+        self.assertEqual(list(iter_entity_keys_queries([])), [])
+
+
+class TestStoreSearch(unittest.TestCase):
+    def setUp(self):
+        self.store = EntityStore()
+        for name in TRICKY_NAMES:
+            self.store.add(nailgun.entities.HostGroup, name=name)
+        self.api_path = 'api/v2/hostgroups'
+
+    def search_names(self, query):
+        results = self.store.search(self.api_path, dict(search=query))
+        return [ent_json['name'] for ent_json in results['results']]
+
+    def test_or_query(self):
+        keys = [dict(name='or'), dict(name='(parens)'), dict(name='missing')]
+        self.assertEqual(
+            self.search_names(build_entity_keys_query(keys)),
+            ['or', '(parens)']
+        )
+
+    def test_tricky_values_matched(self):
+        for name in TRICKY_NAMES:
+            self.assertEqual(
+                self.search_names(build_entity_attr_query(name=name)), [name]
+            )
+
+
+class TestSearchByKeys(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeSatellite().start()
+        self.server_config = self.fake.server_config()
+        self.org = self.fake.add(nailgun.entities.Organization, name='org')
+        for name in TRICKY_NAMES:
+            self.fake.add(
+                nailgun.entities.HostGroup,
+                name=name,
+                title='top/' + (
+                    name if isinstance(name, str) else name.encode('utf-8')
+                ),
+                organization_ids=[self.org['id']],
+            )
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def search(self, keys, **kwargs):
+        return entity_search_by_keys(
+            nailgun.entities.HostGroup,
+            keys,
+            server_config=self.server_config,
+            **kwargs
+        )
+
+    def queries(self):
+        return len([
+            path for method, path in self.fake.requests
+            if method == 'GET' and path == '/api/v2/hostgroups'
+        ])
+
+    def assertFound(self, found, names):
+        self.assertEqual(
+            [[entity.name for entity in entities] for entities in found],
+            [[] if name is None else [name] for name in names]
+        )
+
+    def test_results_in_key_order(self):
+        names = list(reversed(TRICKY_NAMES))
+        found = self.search([dict(name=name) for name in names])
+        self.assertFound(found, [
+            name.decode('utf-8') if isinstance(name, str) else name
+            for name in names
+        ])
+        self.assertEqual(self.queries(), 1)
+
+    def test_missing_and_duplicate_keys(self):
+        found = self.search([
+            dict(name='plain'),
+            dict(name='nope'),
+            dict(name='plain'),
+            dict(name=u'café'),
+        ])
+        self.assertFound(found, [u'plain', None, u'plain', u'café'])
+        self.assertIsNot(found[0], found[2])
+        self.assertEqual(self.queries(), 1)
+
+    def test_split_queries(self):
+        names = TRICKY_NAMES[:8]
+        found = self.search(
+            [dict(name=name) for name in names], max_query_length=60
+        )
+        self.assertFound(found, [name.decode('utf-8') for name in names])
+        self.assertGreater(self.queries(), 1)
+
+    def test_keys_with_different_attributes(self):
+        found = self.search([
+            dict(name='with space'),
+            dict(title='top/or'),
+            dict(name='or', title='top/plain'),
+            dict(name=u'日本', title=u'top/日本'),
+        ])
+        self.assertFound(found, [u'with space', u'or', None, u'日本'])
+
+    def test_context(self):
+        other = self.fake.add(nailgun.entities.Organization, name='other')
+        found = self.search(
+            [dict(name='plain')], context=dict(organization_id=other['id'])
+        )
+        self.assertFound(found, [None])
+        found = self.search(
+            [dict(name='plain')],
+            context=dict(organization_id=self.org['id']),
+        )
+        self.assertFound(found, [u'plain'])
+
+
+if __name__ == '__main__':
+    unittest.main()